@@ -0,0 +1,145 @@
+# IMA-ADPCM (WAV format 0x11) decoding for WavPlayer
+#
+# A block starts with a 4 byte header (int16 first sample, uint8 step
+# index, one reserved byte) followed by 4-bit codes, low nibble first.  A
+# full block of block_align bytes holds (block_align - 4) * 2 + 1 samples,
+# the last block of a file may be shorter.  Only mono is supported, which
+# is what utilities/wav2adpcm.py writes.
+#
+# decode() turns whole blocks into 16-bit samples in place of a file read,
+# the inner loop uses the viper emitter on MicroPython and a plain Python
+# loop elsewhere, like mixer.py.
+#
+# Example:
+#    n = wav.readinto(adpcm_mv[: 9 * block_align])
+#    nbytes = decode(adpcm_mv, n, wav_samples_mv, block_align)
+
+from array import array
+
+try:
+    from micropython import viper
+except ImportError:
+    viper = None
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IMA_ADPCM = 0x11
+
+STEPS = array("H", (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41,
+    45, 50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209,
+    230, 253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876,
+    963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749,
+    3024, 3327, 3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630,
+    9493, 10442, 11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385,
+    24623, 27086, 29794, 32767))
+
+# step index change for code & 7
+INDEX_ADJUST = (-1, -1, -1, -1, 2, 4, 6, 8)
+
+
+def block_samples(nbytes):
+    # samples in a mono block of nbytes bytes
+    return (nbytes - 4) * 2 + 1 if nbytes > 4 else 0
+
+
+def decoded_length(data_length, block_align):
+    # bytes of 16-bit samples that data_length bytes of blocks decode to
+    blocks, rest = divmod(data_length, block_align)
+    return 2 * (blocks * block_samples(block_align) + block_samples(rest))
+
+
+if viper is not None:
+    @viper
+    def decode_block(src, start: int, n: int, out, pos: int) -> int:
+        # decode the n byte block at src[start] into out[pos], in samples
+        s = ptr8(src)
+        o = ptr16(out)
+        steps = ptr16(STEPS)
+        pred = s[start] | (s[start + 1] << 8)
+        if pred & 0x8000:
+            pred -= 0x10000
+        index = s[start + 2]
+        if index > 88:
+            index = 88
+        o[pos] = pred
+        k = pos + 1
+        i = start + 4
+        end = start + n
+        while i < end:
+            b = s[i]
+            j = 0
+            while j < 2:
+                code = b & 15
+                b >>= 4
+                step = steps[index]
+                diff = step >> 3
+                if code & 1:
+                    diff += step >> 2
+                if code & 2:
+                    diff += step >> 1
+                if code & 4:
+                    diff += step
+                if code & 8:
+                    pred -= diff
+                    if pred < -32768:
+                        pred = -32768
+                else:
+                    pred += diff
+                    if pred > 32767:
+                        pred = 32767
+                code &= 7
+                if code < 4:
+                    index -= 1
+                    if index < 0:
+                        index = 0
+                else:
+                    index += (code - 3) * 2
+                    if index > 88:
+                        index = 88
+                o[k] = pred
+                k += 1
+                j += 1
+            i += 1
+        return k - pos
+else:
+    def decode_block(src, start, n, out, pos):
+        s = src
+        o = memoryview(out).cast("B").cast("h")
+        pred = s[start] | (s[start + 1] << 8)
+        if pred & 0x8000:
+            pred -= 0x10000
+        index = min(s[start + 2], 88)
+        o[pos] = pred
+        k = pos + 1
+        for i in range(start + 4, start + n):
+            b = s[i]
+            for code in (b & 15, b >> 4):
+                step = STEPS[index]
+                diff = step >> 3
+                if code & 1:
+                    diff += step >> 2
+                if code & 2:
+                    diff += step >> 1
+                if code & 4:
+                    diff += step
+                if code & 8:
+                    pred = max(pred - diff, -32768)
+                else:
+                    pred = min(pred + diff, 32767)
+                index = min(max(index + INDEX_ADJUST[code & 7], 0), 88)
+                o[k] = pred
+                k += 1
+        return k - pos
+
+
+def decode(src, n, out, block_align):
+    # decode the first n bytes of src, whole blocks except at the end of
+    # the data, into 16-bit samples in out; returns the bytes written
+    pos = 0
+    start = 0
+    while start < n:
+        size = min(block_align, n - start)
+        if size > 4:
+            pos += decode_block(src, start, size, out, pos)
+        start += size
+    return 2 * pos
@@ -0,0 +1,214 @@
+# LED effects for the raygun
+#
+# Each effect is a small class that draws into a Renderer (see ledrender.py).
+# An effect declares the frame rate it wants in `fps` and, for one-shot
+# effects, how many frames it has in `frames` (0 means it runs until it is
+# replaced).  render(frame_no, t) draws frame number frame_no, t is the
+# frame's scheduled time in ms since the effect started.  Timing and
+# commit() are left to the FrameScheduler (see scheduler.py).  An effect
+# with frames of different lengths sets `times`, the start of each frame
+# in ms, in place of fps.
+#
+# Colours are full range and integer only: the Renderer applies gamma and
+# the brightness (low power mode included) to every frame.  RED_LOW and
+# GREEN_LOW are the dim indicator colours, the LED levels the badge has
+# always used put through tables.level().
+#
+# Reactive follows the sound playing: level() is read once per frame, an
+# envelope lookup (see envelope.py) rather than any work on the samples.
+
+import random
+from tables import SINE, WHEEL, breath_curve, level
+
+# Define start and end colors
+start_color = (0, 0, 255)  # Blue
+end_color = (255, 0, 0)    # Red
+
+RED_LOW = (level(10), 0, 0)
+GREEN_LOW = (0, level(10), 0)
+
+
+def gradient(start_color, end_color, steps, span=1):
+    # steps RGB triples running from start_color to `span` of the way to end_color
+    out = bytearray(3 * steps)
+    for i in range(steps):
+        factor = i / (steps - 1) * span
+        for c in range(3):
+            out[3 * i + c] = int(start_color[c] + factor * (end_color[c] - start_color[c]))
+    return out
+
+
+def set_group_wheel(fb, i, pos):
+    # set group i to wheel position pos
+    pos *= 3
+    fb.set_group(i, WHEEL[pos], WHEEL[pos + 1], WHEEL[pos + 2])
+
+
+class Effect:
+    fps = 25
+    frames = 0
+    times = None
+
+    def __init__(self, fb):
+        self.fb = fb
+
+    def render(self, frame_no, t):
+        pass
+
+
+class Startup(Effect):
+    # fill from the barrel end, every lit group takes the newest gradient colour
+    fps = 14
+
+    def __init__(self, fb):
+        super().__init__(fb)
+        self.frames = fb.groups
+        self.colours = gradient(start_color, end_color, fb.groups)
+
+    def render(self, frame_no, t):
+        c = 3 * frame_no
+        colours = self.colours
+        self.fb.fill_range(0, frame_no + 1, colours[c], colours[c + 1], colours[c + 2])
+
+
+class Wipe(Effect):
+    def __init__(self, fb, colour, fps=33):
+        super().__init__(fb)
+        self.colour = colour
+        self.fps = fps
+        self.frames = fb.groups
+
+    def render(self, frame_no, t):
+        colour = self.colour
+        self.fb.fill_range(0, frame_no + 1, colour[0], colour[1], colour[2])
+
+
+class Firing(Effect):
+    # red->green gradient, a reverse wipe to black, then everything back on red
+    fps = 100
+
+    def __init__(self, fb):
+        super().__init__(fb)
+        self.frames = fb.groups + 2
+        self.colours = gradient((255, 0, 0), (0, 255, 0), fb.groups, 0.5)
+
+    def render(self, frame_no, t):
+        fb = self.fb
+        groups = fb.groups
+        if frame_no > groups:
+            fb.fill(RED_LOW[0], RED_LOW[1], RED_LOW[2])
+            return
+        colours = self.colours
+        lit = groups - frame_no
+        for i in range(lit):
+            fb.set_group(i, colours[3 * i], colours[3 * i + 1], colours[3 * i + 2])
+        fb.fill_range(lit, groups, 0, 0, 0)
+
+
+class Breathing(Effect):
+    fps = 25
+
+    def __init__(self, fb, colour, max_brightness=50):
+        super().__init__(fb)
+        self.colour = colour
+        self.curve = breath_curve(max_brightness)
+
+    def render(self, frame_no, t):
+        curve = self.curve
+        level = curve[frame_no % len(curve)]
+        colour = self.colour
+        self.fb.fill(colour[0] * level // 255,
+                     colour[1] * level // 255,
+                     colour[2] * level // 255)
+
+
+class Blink(Effect):
+    # half a second on, half a second off
+    fps = 2
+
+    def __init__(self, fb, colour):
+        super().__init__(fb)
+        self.colour = colour
+
+    def render(self, frame_no, t):
+        if frame_no & 1:
+            self.fb.clear()
+        else:
+            colour = self.colour
+            self.fb.fill(colour[0], colour[1], colour[2])
+
+
+class Rainbow(Effect):
+    fps = 100
+
+    def render(self, frame_no, t):
+        fb = self.fb
+        groups = fb.groups
+        counter = frame_no & 255
+        for i in range(groups):
+            pixel_index = (i * 256 // groups) + counter
+            set_group_wheel(fb, i, pixel_index & 255)
+
+
+class Chase(Effect):
+    fps = 10
+
+    def render(self, frame_no, t):
+        fb = self.fb
+        groups = fb.groups
+        counter = frame_no % groups
+        fb.clear()
+
+        # Turn on the current group and the next few groups for the chase effect
+        for j in range(5):  # Number of groups in the chase
+            group_index = (counter + j) % groups
+            set_group_wheel(fb, group_index, (group_index * 256 // groups) & 255)
+
+
+class Twinkle(Effect):
+    fps = 2
+
+    def render(self, frame_no, t):
+        fb = self.fb
+        groups = fb.groups
+        fb.clear()
+
+        # Randomly turn on a few groups
+        for _ in range(10):  # Number of twinkles
+            group_index = random.randint(0, groups - 1)
+            set_group_wheel(fb, group_index, (group_index * 256 // groups) & 255)
+
+
+class Wave(Effect):
+    fps = 20
+
+    def render(self, frame_no, t):
+        fb = self.fb
+        counter = frame_no % 255
+        # sin(x / 10) in SINE steps: 256 / (20 * pi) ~= 4172 / 1024
+        for i in range(fb.groups):
+            wave_value = SINE[((i + counter) * 4172 >> 10) & 255]
+            fb.set_group(i, wave_value, 0, 255 - wave_value)
+
+
+class Reactive(Effect):
+    # a level meter from the barrel end: level() (0-255, an envelope
+    # value) picks how many groups are lit through a table
+    fps = 50
+
+    def __init__(self, fb, level, start=(0, 255, 0), end=(255, 0, 0)):
+        super().__init__(fb)
+        self.level = level
+        self.colours = gradient(start, end, fb.groups)
+        groups = fb.groups
+        self.meter = bytearray(256)
+        for v in range(256):
+            self.meter[v] = (v * groups + 254) // 255
+
+    def render(self, frame_no, t):
+        fb = self.fb
+        lit = self.meter[self.level()]
+        colours = self.colours
+        for i in range(lit):
+            fb.set_group(i, colours[3 * i], colours[3 * i + 1], colours[3 * i + 2])
+        fb.fill_range(lit, fb.groups, 0, 0, 0)
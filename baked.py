@@ -0,0 +1,71 @@
+# Baked LED animations, streamed from flash
+#
+# A deterministic effect (the startup fill, the firing wipe) comes out
+# the same every time, so utilities/bake_anim.py renders it once on the
+# host into a frame file.  Baked plays one back as an effect: each frame
+# is a single readinto() from the file straight into the strip's buffer
+# (Renderer.load()), with no per-frame compute beyond the Renderer's
+# gamma and brightness pass.
+#
+# File layout, little endian:
+#
+#    "ANIM"  uint16 version  uint16 frames  uint16 pixels  uint8 bpp  pad
+#    frames * uint16        how long each frame is shown, in ms
+#    frames * pixels * bpp  the frames, in the strip's wire order
+#
+# The frame times go into `times`, so the FrameScheduler shows every
+# frame for as long as the file says and skips frames it is late for.
+#
+# Example:
+#    firing_fx = Baked(fb, "firing.anim")
+#    sched.play(firing_fx)
+
+import struct
+from array import array
+from animations import Effect
+
+ANIM_MAGIC = b"ANIM"
+ANIM_VERSION = 1
+ANIM_HEADER = "<4sHHHBx"
+ANIM_HEADER_SIZE = struct.calcsize(ANIM_HEADER)
+
+
+class Baked(Effect):
+    def __init__(self, fb, path):
+        super().__init__(fb)
+        f = open(path, "rb")
+        magic, version, frames, pixels, bpp = struct.unpack(ANIM_HEADER,
+                                                             f.read(ANIM_HEADER_SIZE))
+        if magic != ANIM_MAGIC or version != ANIM_VERSION:
+            f.close()
+            raise ValueError("%s: not a version %d animation" % (path, ANIM_VERSION))
+        self.frame_bytes = pixels * bpp
+        if self.frame_bytes != len(fb.np.buf):
+            f.close()
+            raise ValueError("%s: %d bytes a frame, the strip has %d" % (
+                path, self.frame_bytes, len(fb.np.buf)))
+
+        self.f = f
+        self.frames = frames
+        delays = array("H", [0] * frames)
+        f.readinto(delays)
+        # start of each frame, and the length of the whole animation
+        self.times = array("I", [0] * frames)
+        t = 0
+        for i in range(frames):
+            self.times[i] = t
+            t += delays[i]
+        self.length_ms = t
+        # for the scheduler's period, which the times replace
+        self.fps = max(1, 1000 * frames // max(t, 1))
+
+        self.data = ANIM_HEADER_SIZE + 2 * frames
+        # the frame the file is positioned at
+        self.pos = 0
+        f.seek(self.data)
+
+    def render(self, frame_no, t):
+        if frame_no != self.pos:
+            self.f.seek(self.data + frame_no * self.frame_bytes)
+        self.fb.load(self.f)
+        self.pos = frame_no + 1
@@ -0,0 +1,240 @@
+# Closed-loop HV charge control
+#
+# The HV transformer was driven at a fixed, hand-tuned 2500 Hz and 1.22%
+# duty, which holds the capacitor at around 250 V but takes 2-3 seconds
+# to recover after a pulse.  ChargeController samples the charge sense
+# on GPIO26 with the ADC every period_ms and moves the drive along a ramp
+# between two settings:
+#
+#    boost   duty_boost at freq_boost, while the level is below taper
+#    hold    the hand-tuned duty_hold at freq_hold, at full_level and up
+#
+# with a straight line between them from taper to full_level.  A flyback
+# stores energy in proportion to the square of the on-time each cycle,
+# until the core saturates; more duty at the same frequency mostly burnt
+# current when the drive was tuned.  So the boost end raises frequency
+# with duty and keeps the on-time (duty / 65536 / freq) close to the hold
+# value's: about four times the power, no saturation.  The hold end is
+# what the badge always used, so nothing extra is burnt in the
+# transformer once the capacitor is full.
+#
+# The ramp is bounded: the drive climbs towards boost by at most
+# ramp_step (of 256) per sample, backs off straight away and never goes
+# past DUTY_MAX.  A recharge takes about 700 ms and only spends the start
+# of it at full boost, the taper does the rest.  If the level has not
+# reached full_level within max_boost_ms, or the drive has added up to
+# more than boost_budget_ms at full boost since it last did, the sense
+# cannot be trusted (or the capacitor is open or leaky): the controller
+# falls back to hold and latches `fault`.  A blind boost would otherwise
+# run the capacitor well past the voltage the hold drive gives.  on()
+# does not clear the fault.  clear_fault() does, and so do clear_after
+# recharges to full at the hold drive, which show the sense is reading
+# again: one slow recharge (a bad contact, cold cells) costs a few slow
+# recharges rather than the boost until the next reboot.
+#
+# The sense is active low like the old digital input: the reading falls
+# as the capacitor charges, so level = 65535 - read_u16() with invert.
+# full_level and taper are in those units and were picked for a sense
+# that spans 0-300 V; check `level` on a charged badge to calibrate.
+# Until that has been done main.py sets the boost end to the hold drive.
+# value() is 1 while charged (with hysteresis), so the controller stands
+# in for the old `charged` Signal; it only reads the last sample and is
+# safe in a hard IRQ.  pulsed(), also IRQ-safe, tells it a pulse has just
+# emptied the capacitor, so value() drops at once rather than at the next
+# sample.  on_charged(), if set, is called from the timer callback each
+# time the charge comes back while charging.
+#
+# adc and pwm only need read_u16() and freq() / duty_u16(), so a model of
+# the capacitor can take their place on the host (utilities/charge_sim.py).
+#
+# Example:
+#    charger = ChargeController(PWM(Pin(12)), ADC(26))
+#    charger.on()        # armed
+#    charger.value()     # charged?
+#    charger.off()       # disarmed, transformer off
+
+import time
+
+try:
+    from machine import Timer
+    PERIODIC = Timer.PERIODIC
+except ImportError:
+    Timer = None
+    PERIODIC = 1
+
+# the hand-tuned drive, around 250 V on the HV capacitor
+FREQ_HOLD = 2500
+DUTY_HOLD = 800
+# right after a pulse, 7.6 us on-time against 4.9 us
+FREQ_BOOST = 4000
+DUTY_BOOST = 2000
+# never drive harder than this, whatever the arguments say
+DUTY_MAX = 2600
+
+FULL_LEVEL = 52000
+TAPER_LEVEL = 40000
+HYSTERESIS = 1000
+PERIOD_MS = 20
+RAMP_STEP = 64
+# a recharge takes about 700 ms and uses about 280 ms of full boost
+MAX_BOOST_MS = 1200
+BOOST_BUDGET_MS = 400
+# recharges at hold that clear a fault
+CLEAR_AFTER = 3
+
+
+class ChargeController:
+    def __init__(self, pwm, adc, invert=True, full_level=FULL_LEVEL, taper=TAPER_LEVEL,
+                 freq_hold=FREQ_HOLD, duty_hold=DUTY_HOLD, freq_boost=FREQ_BOOST,
+                 duty_boost=DUTY_BOOST, ramp_step=RAMP_STEP, max_boost_ms=MAX_BOOST_MS,
+                 boost_budget_ms=BOOST_BUDGET_MS, clear_after=CLEAR_AFTER, period_ms=PERIOD_MS,
+                 timer=None, clock=time):
+        self.pwm = pwm
+        self.adc = adc
+        self.invert = invert
+        self.full_level = full_level
+        self.taper = taper
+        self.freq_hold = freq_hold
+        self.duty_hold = min(duty_hold, DUTY_MAX)
+        self.freq_boost = freq_boost
+        self.duty_boost = min(duty_boost, DUTY_MAX)
+        self.ramp_step = ramp_step
+        self.max_boost_ms = max_boost_ms
+        # in ramp position * ms, 256 is full boost
+        self.boost_budget = boost_budget_ms * 256
+        self.clear_after = clear_after
+        self.period_ms = period_ms
+        self.clock = clock
+
+        self.enabled = False
+        self.charged = False
+        self.on_charged = None
+        # last sample, position on the ramp (0 hold .. 256 boost) and
+        # the drive that is set
+        self.level = 0
+        self.position = 0
+        self.freq = 0
+        self.duty = 0
+        # ticks_ms() when the level was last full (or charging started),
+        # and the boost driven since then
+        self.boost_since = 0
+        self.boosted = 0
+        # latched when boosting did not get to full, the drive stays at
+        # hold; recharges made since
+        self.fault = False
+        self.recovered = 0
+
+        # recharges timed from dropping below full to full again, and
+        # boosts cut short
+        self.empty_since = 0
+        self.recharges = 0
+        self.recharge_last_ms = 0
+        self.recharge_max_ms = 0
+        self.faults = 0
+
+        pwm.duty_u16(0)
+        self.sample()
+        self.timer = timer if timer is not None else Timer(-1)
+        self.timer.init(mode=PERIODIC, period=period_ms, callback=self.tick)
+
+    def on(self):
+        # start charging, from the hold end of the ramp
+        self.enabled = True
+        self.position = 0
+        self.boost_since = self.clock.ticks_ms()
+        self.boosted = 0
+        if not self.charged:
+            self.empty_since = self.boost_since
+        self.drive(0)
+
+    def off(self):
+        self.enabled = False
+        self.position = 0
+        self.freq = 0
+        self.duty = 0
+        self.pwm.duty_u16(0)
+
+    def clear_fault(self):
+        # allow boosting again
+        self.fault = False
+        self.recovered = 0
+
+    def value(self):
+        return 1 if self.charged else 0
+
+    def pulsed(self):
+        # the capacitor has just been discharged
+        if self.charged:
+            self.charged = False
+            self.empty_since = self.clock.ticks_ms()
+
+    def sample(self):
+        level = self.adc.read_u16()
+        if self.invert:
+            level = 65535 - level
+        self.level = level
+        charged = self.charged
+        if charged and level < self.full_level - HYSTERESIS:
+            self.charged = False
+            self.empty_since = self.clock.ticks_ms()
+        elif not charged and level >= self.full_level:
+            self.charged = True
+            if self.enabled:
+                ms = self.clock.ticks_diff(self.clock.ticks_ms(), self.empty_since)
+                self.recharges += 1
+                self.recharge_last_ms = ms
+                if ms > self.recharge_max_ms:
+                    self.recharge_max_ms = ms
+                if self.fault:
+                    self.recovered += 1
+                    if self.recovered >= self.clear_after:
+                        self.clear_fault()
+                if self.on_charged is not None:
+                    self.on_charged()
+        return level
+
+    def target(self, level):
+        # ramp position for a level: 256 below taper, 0 at full and up
+        if level <= self.taper:
+            return 256
+        if level >= self.full_level:
+            return 0
+        return (self.full_level - level) * 256 // (self.full_level - self.taper)
+
+    def tick(self, _=None):
+        level = self.sample()
+        if not self.enabled:
+            return
+
+        clock = self.clock
+        now = clock.ticks_ms()
+        want = self.target(level)
+        if want == 0:
+            # full, the boost limits start again from here
+            self.boost_since = now
+            self.boosted = 0
+        elif self.fault:
+            want = 0
+        elif (clock.ticks_diff(now, self.boost_since) > self.max_boost_ms
+                or self.boosted > self.boost_budget):
+            # boosting without getting to full
+            self.fault = True
+            self.recovered = 0
+            self.faults += 1
+            want = 0
+        elif want > self.position + self.ramp_step:
+            want = self.position + self.ramp_step
+        self.drive(want)
+        self.boosted += want * self.period_ms
+
+    def drive(self, position):
+        # set the PWM for a ramp position, touching it only on a change
+        self.position = position
+        freq = self.freq_hold + (self.freq_boost - self.freq_hold) * position // 256
+        duty = self.duty_hold + (self.duty_boost - self.duty_hold) * position // 256
+        if freq != self.freq:
+            self.freq = freq
+            self.pwm.freq(freq)
+        if duty != self.duty:
+            self.duty = duty
+            self.pwm.duty_u16(duty)
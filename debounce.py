@@ -0,0 +1,134 @@
+# Timer-based debounce for the front panel buttons
+#
+# The pin IRQ only timestamps the edge and (re)arms a one-shot timer, so
+# nothing ever sleeps in interrupt context.  When the timer fires, a button
+# that has been quiet for debounce_ms and still reads active counts as
+# pressed; one that reads inactive again was a glitch and is rejected.
+#
+# A pressed button is held for chord_ms (and while any other button is
+# still settling) waiting for its partner.  If every button is pressed
+# inside that window on_chord() is called instead of on_press(i).  A
+# partner that was pressed earlier, has already been reported and still
+# reads active counts too, so holding one button and then pressing the
+# other is a chord as it was before the debouncer.
+#
+# Example:
+#    buttons = Debouncer((low_power_pin, wakeup_pin), on_press, on_chord)
+#    low_power_pin.irq(trigger=Pin.IRQ_RISING, handler=buttons.handlers[0])
+#    wakeup_pin.irq(trigger=Pin.IRQ_RISING, handler=buttons.handlers[1])
+
+import time
+
+try:
+    from machine import Timer
+    ONE_SHOT = Timer.ONE_SHOT
+except ImportError:
+    Timer = None
+    ONE_SHOT = 0
+
+IDLE = 0
+SETTLING = 1
+HELD = 2
+
+
+class Debouncer:
+    def __init__(self, pins, on_press, on_chord=None, debounce_ms=50,
+                 chord_ms=0, active=1, timer=None, clock=time):
+        self.pins = pins
+        self.on_press = on_press
+        self.on_chord = on_chord
+        self.debounce_ms = debounce_ms
+        self.chord_ms = chord_ms
+        self.active = active
+        self.clock = clock
+        self.timer = timer if timer is not None else Timer(-1)
+
+        n = len(pins)
+        self.state = bytearray(n)
+        self.since = [0] * n
+
+        # presses and chords reported, edges that restarted a settling
+        # button, settled buttons that no longer read active
+        self.presses = 0
+        self.chords = 0
+        self.bounces = 0
+        self.rejected = 0
+
+        # one IRQ handler per pin and the timer callback, bound once
+        self.handlers = tuple(self._handler(i) for i in range(n))
+        self._check = self.check
+
+    def _handler(self, i):
+        def handler(pin):
+            self.edge(i)
+        return handler
+
+    def edge(self, i):
+        # called from the pin IRQ: timestamp and make sure the timer runs
+        state = self.state
+        if state[i] == SETTLING:
+            self.bounces += 1
+        elif state[i] == HELD:
+            # still bouncing after it settled, ignore
+            self.bounces += 1
+            return
+        state[i] = SETTLING
+        self.since[i] = self.clock.ticks_ms()
+        self.arm(self.debounce_ms)
+
+    def arm(self, period):
+        self.timer.init(mode=ONE_SHOT, period=max(period, 1), callback=self._check)
+
+    def check(self, _=None):
+        # timer callback: settle buttons, then look for chords and presses
+        clock = self.clock
+        now = clock.ticks_ms()
+        state = self.state
+        since = self.since
+        n = len(state)
+        wait = -1
+
+        for i in range(n):
+            if state[i] == SETTLING:
+                left = self.debounce_ms - clock.ticks_diff(now, since[i])
+                if left > 0:
+                    wait = left if wait < 0 else min(wait, left)
+                elif self.pins[i].value() == self.active:
+                    state[i] = HELD
+                    since[i] = now
+                else:
+                    self.rejected += 1
+                    state[i] = IDLE
+
+        held = 0
+        down = 0
+        settling = False
+        for i in range(n):
+            if state[i] == HELD:
+                held += 1
+            elif state[i] == SETTLING:
+                settling = True
+            elif self.pins[i].value() == self.active:
+                # reported already and still held down
+                down += 1
+
+        if held and held + down == n and n > 1 and self.on_chord is not None:
+            for i in range(n):
+                state[i] = IDLE
+            self.chords += 1
+            self.on_chord()
+        elif held and not settling:
+            # a partner that is still settling may yet make this a chord
+            for i in range(n):
+                if state[i] != HELD:
+                    continue
+                left = self.chord_ms - clock.ticks_diff(now, since[i])
+                if left > 0:
+                    wait = left if wait < 0 else min(wait, left)
+                else:
+                    state[i] = IDLE
+                    self.presses += 1
+                    self.on_press(i)
+
+        if wait >= 0:
+            self.arm(wait)
@@ -0,0 +1,67 @@
+# Precomputed amplitude envelopes for the sound clips
+#
+# Following the audio on the LEDs by measuring the samples would put RMS
+# work in the I2S callback.  utilities/build_env.py measures every clip
+# once on the host instead, at a low rate, into a small file beside it
+# ("pew-small.wav" gets "pew-small.env").  At run time the level is one
+# index into that table at the clip's playback position
+# (WavPlayer.position_ms()), cheap enough for every frame.
+#
+# File layout, little endian:
+#
+#    "WENV"  uint16 version  uint16 steps per second  uint16 steps
+#    steps * uint8          the clip's loudness, 255 at its loudest step
+#
+# load() returns the envelopes of the clips that have one, keyed by the
+# clip's name; clips without an .env file are left out.
+#
+# Example:
+#    envelopes = load(("nomana.wav", "nomana2.wav"))
+#    env = envelopes.get(wp.latest)
+#    level = env.at(wp.position_ms()) if env is not None else 0
+
+import struct
+
+ENV_MAGIC = b"WENV"
+ENV_VERSION = 1
+ENV_HEADER = "<4sHHH"
+ENV_HEADER_SIZE = struct.calcsize(ENV_HEADER)
+
+
+class Envelope:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            magic, version, rate, steps = struct.unpack(ENV_HEADER, f.read(ENV_HEADER_SIZE))
+            if magic != ENV_MAGIC or version != ENV_VERSION:
+                raise ValueError("%s: not a version %d envelope" % (path, ENV_VERSION))
+            self.rate = rate
+            self.levels = bytearray(steps)
+            f.readinto(self.levels)
+
+    def at(self, ms):
+        # the level ms into the clip, 0 outside it
+        if ms < 0:
+            return 0
+        i = ms * self.rate // 1000
+        if i >= len(self.levels):
+            return 0
+        return self.levels[i]
+
+
+def env_name(wav_file):
+    # "pew-small.wav" -> "pew-small.env"
+    if wav_file.endswith(".wav"):
+        wav_file = wav_file[:-4]
+    return wav_file + ".env"
+
+
+def load(names, root="/"):
+    # name -> Envelope for every clip in names with an envelope file
+    envelopes = {}
+    root = root.rstrip("/") + "/"
+    for name in names:
+        try:
+            envelopes[name] = Envelope(root + env_name(name))
+        except OSError:
+            pass
+    return envelopes
@@ -0,0 +1,280 @@
+# Table-driven state machine for the raygun
+#
+# States and events are small integers.  TABLE maps (state, event) to the
+# next state, so a transition is one bytes lookup.  A few targets are
+# resolved when the event is handled:
+#
+#    BY_ARM     Armed or Disarmed, from the arm switch
+#    BY_SOUND   toggle sound_on and go to Sound On / Sound Off
+#    RESUME     back to the state we were in before
+#
+# Pin IRQs call post(), which only appends to a fixed-size ring buffer and
+# asks micropython.schedule() to run run_pending(), so a transition happens
+# as soon as the interrupt has been serviced rather than on the next pass
+# of the main loop.  Code already running on the main thread can call
+# dispatch() directly.  A scheduled run_pending() can land in the middle of
+# such a call (or of another run_pending()): while one is applying events
+# `busy` is set, dispatch() queues its event behind it and run_pending()
+# leaves the queue to the one already draining it, so transitions never
+# overlap.  Entry actions stay with the main loop: every transition bumps
+# `seq` and enter() returns True once for each seq, so a transition that
+# lands while the entry actions are being claimed is not lost.
+#
+# The animation thread on the other core reads the state through
+# snapshot().  dispatch() only ever runs on the main core and publishes a
+# transition seqlock style: seq goes odd, state, previous, low_power_mode
+# and sound_on are written, then seq goes even again.  snapshot() retries
+# until it has read all of them between the same two even values of seq,
+# so the other core never sees half a transition and neither side takes a
+# lock.  seq goes up by two per transition.
+#
+# Every queued event is stamped with ticks_us() when posted, the time until
+# its transition is applied is kept in latency_last / latency_max and
+# latency_total / latency_count.
+
+import time
+from array import array
+from trace import trace, TR_STATE
+
+try:
+    from micropython import const, schedule
+except ImportError:
+    def const(x):
+        return x
+    schedule = None
+
+try:
+    from machine import disable_irq, enable_irq
+except ImportError:
+    def disable_irq():
+        return 0
+
+    def enable_irq(state=0):
+        pass
+
+# states
+STARTUP = const(0)
+DISARMED = const(1)
+ARMED = const(2)
+FIRING = const(3)
+LOW_POWER = const(4)
+ERROR = const(5)
+SOUND_ON = const(6)
+SOUND_OFF = const(7)
+
+STATE_NAMES = ("Startup", "Disarmed", "Armed", "Firing",
+               "Low Power", "Error", "Sound On", "Sound Off")
+
+# events
+EV_DONE = const(0)       # the current one-shot activity has finished
+EV_ARM = const(1)        # arm switch on
+EV_DISARM = const(2)     # arm switch off
+EV_FIRE = const(3)       # pulse button while armed and charged
+EV_PULSE = const(4)      # pulse button while disarmed
+EV_LOW_POWER = const(5)  # low power button
+EV_WAKEUP = const(6)     # wakeup button
+EV_CHORD = const(7)      # low power and wakeup buttons together
+EV_TIMEOUT = const(8)    # armed with nothing happening for a while
+
+EVENT_NAMES = ("DONE", "ARM", "DISARM", "FIRE", "PULSE",
+               "LOW_POWER", "WAKEUP", "CHORD", "TIMEOUT")
+
+NUM_STATES = len(STATE_NAMES)
+NUM_EVENTS = len(EVENT_NAMES)
+
+# targets that are not plain states
+IGNORE = const(0xFF)
+BY_ARM = const(0xF0)
+BY_SOUND = const(0xF1)
+RESUME = const(0xF2)
+
+# the buttons work from every state except while starting up, while a shot
+# is being fired (its sound and firing_song_index belong to the shot) and
+# while a sound toggle is being announced
+_BUTTONS = ((EV_LOW_POWER, LOW_POWER), (EV_WAKEUP, BY_ARM), (EV_CHORD, BY_SOUND))
+
+TRANSITIONS = (
+    (STARTUP, ((EV_DONE, BY_ARM),)),
+    (DISARMED, ((EV_ARM, ARMED), (EV_PULSE, ERROR)) + _BUTTONS),
+    (ARMED, ((EV_DISARM, DISARMED), (EV_FIRE, FIRING), (EV_TIMEOUT, LOW_POWER)) + _BUTTONS),
+    # each shot of a repeat or burst enters Firing again
+    (FIRING, ((EV_DONE, ARMED), (EV_FIRE, FIRING), (EV_DISARM, DISARMED))),
+    (LOW_POWER, _BUTTONS),
+    (ERROR, ((EV_DONE, BY_ARM),)),
+    (SOUND_ON, ((EV_DONE, RESUME),)),
+    (SOUND_OFF, ((EV_DONE, RESUME),)),
+)
+
+
+def build_table(transitions):
+    table = bytearray([IGNORE] * (NUM_STATES * NUM_EVENTS))
+    for state, row in transitions:
+        for event, target in row:
+            table[state * NUM_EVENTS + event] = target
+    return bytes(table)
+
+
+TABLE = build_table(TRANSITIONS)
+
+# low power animations, in the order the low power button cycles them
+LP_NONE = const(0)
+LP_CHASE = const(1)
+LP_RAINBOW = const(2)
+LP_TWINKLE = const(3)
+LP_WAVE = const(4)
+LP_AUDIO = const(5)
+
+
+class StateMachine:
+    def __init__(self, arm_switch, table=TABLE, size=16, clock=time):
+        self.arm_switch = arm_switch
+        self.table = table
+        self.clock = clock
+        self.state = STARTUP
+        self.previous = STARTUP
+        self.low_power_mode = LP_NONE
+        self.sound_on = True
+
+        # seq is odd while a transition is written, entered_seq is the
+        # seq whose entry actions have been claimed (none yet at startup)
+        self.seq = 0
+        self.entered_seq = -1
+        self.busy = False
+        self.ignored = 0
+
+        # event ring buffer, one slot is always left empty
+        self.size = size
+        self.events = bytearray(size)
+        self.stamps = array("I", [0] * size)
+        self.head = 0
+        self.tail = 0
+        self.overflows = 0
+
+        self.latency_last = 0
+        self.latency_max = 0
+        self.latency_total = 0
+        self.latency_count = 0
+
+        # bound once, so posting from an IRQ does not allocate
+        self._run_pending = self.run_pending
+
+    def post(self, event):
+        # safe to call from an IRQ handler; several IRQs post, so the slot
+        # is claimed with interrupts off
+        state = disable_irq()
+        head = self.head
+        nxt = (head + 1) % self.size
+        if nxt == self.tail:
+            self.overflows += 1
+            enable_irq(state)
+            return
+        self.events[head] = event
+        self.stamps[head] = self.clock.ticks_us()
+        self.head = nxt
+        enable_irq(state)
+        if schedule is not None:
+            try:
+                schedule(self._run_pending, 0)
+            except RuntimeError:
+                # schedule queue full, the main loop will drain us
+                pass
+
+    def run_pending(self, _=None):
+        if self.busy:
+            # scheduled inside a dispatch() or run_pending(), which drains
+            # the queue (or leaves it to the main loop) once it is done
+            return
+        self.busy = True
+        try:
+            clock = self.clock
+            while self.tail != self.head:
+                tail = self.tail
+                event = self.events[tail]
+                stamp = self.stamps[tail]
+                self.tail = (tail + 1) % self.size
+                if self.apply(event):
+                    latency = clock.ticks_diff(clock.ticks_us(), stamp)
+                    self.latency_last = latency
+                    self.latency_total += latency
+                    self.latency_count += 1
+                    if latency > self.latency_max:
+                        self.latency_max = latency
+        finally:
+            self.busy = False
+
+    def dispatch(self, event):
+        # apply event now, returns True if it caused a transition; from a
+        # callback that interrupted another transition it is queued instead
+        if self.busy:
+            self.post(event)
+            return False
+        self.busy = True
+        try:
+            return self.apply(event)
+        finally:
+            self.busy = False
+
+    def apply(self, event):
+        old = self.state
+        sound_on = self.sound_on
+        target = self.table[old * NUM_EVENTS + event]
+        if target == BY_ARM:
+            target = ARMED if self.arm_switch() else DISARMED
+        elif target == BY_SOUND:
+            sound_on = not sound_on
+            target = SOUND_ON if sound_on else SOUND_OFF
+        elif target == RESUME:
+            target = self.previous
+        if target == IGNORE:
+            self.ignored += 1
+            return False
+
+        mode = self.low_power_mode
+        if target == LOW_POWER:
+            # the low power button steps through the animations,
+            # arriving from anywhere else starts with the chase
+            if old == LOW_POWER:
+                mode = mode % LP_AUDIO + 1
+            elif old not in (SOUND_ON, SOUND_OFF):
+                mode = LP_CHASE
+
+        trace(TR_STATE, target)
+        self.seq += 1
+        self.previous = old
+        self.state = target
+        self.low_power_mode = mode
+        self.sound_on = sound_on
+        self.seq += 1
+        return True
+
+    def pending(self):
+        # a transition whose entry actions nobody has claimed yet
+        return self.seq != self.entered_seq
+
+    def enter(self):
+        # True once per transition, for whoever runs its entry actions
+        seq = self.seq
+        if seq == self.entered_seq:
+            return False
+        self.entered_seq = seq
+        return True
+
+    def snapshot(self):
+        # (seq, state, low_power_mode) of one transition, for the other core
+        while True:
+            seq = self.seq
+            if seq & 1:
+                continue
+            state = self.state
+            mode = self.low_power_mode
+            if self.seq == seq:
+                return seq, state, mode
+
+    def wait(self, timeout_ms, slice_ms=5):
+        # sleep up to timeout_ms, returning early once a transition or a
+        # queued event is pending
+        clock = self.clock
+        start = clock.ticks_ms()
+        while (not self.pending() and self.tail == self.head
+               and clock.ticks_diff(clock.ticks_ms(), start) < timeout_ms):
+            clock.sleep_ms(slice_ms)
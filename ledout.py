@@ -0,0 +1,153 @@
+# NeoPixel output that overlaps the transfer with rendering
+#
+# neopixel.NeoPixel.write() bit-bangs the whole strip with interrupts off:
+# 76 pixels are 2.3 ms on the wire, and the animation core can do nothing
+# else meanwhile.  DoubleStrip keeps two frame buffers instead.  write()
+# hands the finished one to a port that clocks it out in the background
+# and returns at once, with `buf` now the other buffer, so the next frame
+# renders while this one is still going out.  The next write() only waits
+# if the previous frame is not out yet, and for the strip's latch after it.
+#
+# buf alternates between the two buffers, so every frame has to fill in
+# every pixel, as Renderer.scatter() does; a driver that only changes a
+# few pixels per frame needs the plain NeoPixel.  Renderer reads np.buf
+# afresh for each frame, so it works with either.
+#
+# PioPort is the port on the RP2040: the WS2812 program on a PIO state
+# machine, fed from the buffer by DMA.  Byte-wide DMA writes to the TX
+# FIFO come out as the byte repeated in all four lanes, and the program
+# shifts 8 bits per pull from the top, so the buffer goes out as it is,
+# in the strip's wire order.  Firmware without rp2.DMA, or with no DMA
+# channel free, falls back to sm.put(), which is still PIO timed but
+# blocks until the FIFO has taken the last byte.  The host simulator has
+# its own port and blocking NeoPixel, both timed with BIT_US and LATCH_US
+# from here (utilities/sim/neopixel.py).
+#
+# strip() picks DoubleStrip on a PIO port where there is rp2 and the
+# state machine can be claimed, and neopixel.NeoPixel otherwise: off the
+# RP2040, or with the PIO taken (its program memory, or sm_id in use).
+#
+# Example:
+#    np = strip(Pin(29), 76)
+#    fb = Renderer(np, led_groups)
+#    ...
+#    fb.commit()         # starts the transfer and returns
+
+import time
+
+try:
+    import rp2
+except ImportError:
+    rp2 = None
+
+# 10 PIO cycles per bit at 8 MHz, 1.25 us
+FREQ = 8000000
+BIT_US = 1.25
+# WS2812B needs more than 280 us low to latch a frame
+LATCH_US = 300
+
+# the TX FIFO of state machine 0, and PIO1's offset from PIO0
+PIO0_TXF0 = 0x50200010
+PIO_STRIDE = 0x100000
+
+
+if rp2 is not None:
+    @rp2.asm_pio(sideset_init=rp2.PIO.OUT_LOW, out_shiftdir=rp2.PIO.SHIFT_LEFT,
+                 autopull=True, pull_thresh=8)
+    def _ws2812():
+        wrap_target()
+        label("bitloop")
+        out(x, 1)               .side(0)    [2]
+        jmp(not_x, "do_zero")   .side(1)    [1]
+        jmp("bitloop")          .side(1)    [4]
+        label("do_zero")
+        nop()                   .side(0)    [4]
+        wrap()
+
+
+class PioPort:
+    def __init__(self, pin, sm_id=1):
+        self.sm = rp2.StateMachine(sm_id, _ws2812, freq=FREQ, sideset_base=pin)
+        self.sm.active(1)
+        self.dma = None
+        if hasattr(rp2, "DMA"):
+            pio = sm_id // 4
+            self.fifo = PIO0_TXF0 + PIO_STRIDE * pio + 4 * (sm_id % 4)
+            try:
+                self.dma = rp2.DMA()
+            except OSError:
+                # every channel taken, sm.put() it is
+                return
+            self.ctrl = self.dma.pack_ctrl(size=0, inc_write=False,
+                                           treq_sel=8 * pio + sm_id % 4)
+
+    def start(self, buf):
+        # start clocking out buf, which must not change until busy() is False
+        if self.dma is None:
+            self.sm.put(buf, 24)
+            return
+        self.dma.config(read=buf, write=self.fifo, count=len(buf), ctrl=self.ctrl,
+                        trigger=True)
+
+    def busy(self):
+        return self.dma is not None and self.dma.active()
+
+
+class DoubleStrip:
+    ORDER = (1, 0, 2, 3)
+
+    def __init__(self, port, n, bpp=3, clock=time):
+        self.port = port
+        self.n = n
+        self.bpp = bpp
+        self.clock = clock
+        self.bufs = (bytearray(n * bpp), bytearray(n * bpp))
+        self.back = 0
+        self.buf = self.bufs[0]
+        # on the wire plus the latch, from the start of a transfer
+        self.frame_us = int(n * bpp * 8 * BIT_US) + LATCH_US
+        self.sent_us = 0
+        self.sending = False
+
+        # writes that had to wait for the previous frame, and for how long
+        self.waits = 0
+        self.wait_us = 0
+
+    def __len__(self):
+        return self.n
+
+    def wait(self):
+        # until the last frame is out and latched
+        if not self.sending:
+            return
+        clock = self.clock
+        start = clock.ticks_us()
+        left = self.frame_us - clock.ticks_diff(start, self.sent_us)
+        if left > 0:
+            clock.sleep_us(left)
+        while self.port.busy():
+            pass
+        self.sending = False
+        waited = clock.ticks_diff(clock.ticks_us(), start)
+        if waited > 0:
+            self.waits += 1
+            self.wait_us += waited
+
+    def write(self):
+        self.wait()
+        self.port.start(self.buf)
+        self.sent_us = self.clock.ticks_us()
+        self.sending = True
+        self.back ^= 1
+        self.buf = self.bufs[self.back]
+
+
+def strip(pin, n, bpp=3, sm_id=1):
+    # DoubleStrip on a PIO where there is one free, the plain NeoPixel otherwise
+    if rp2 is not None:
+        try:
+            return DoubleStrip(PioPort(pin, sm_id), n, bpp)
+        except (OSError, ValueError):
+            pass
+    from neopixel import NeoPixel
+    return NeoPixel(pin, n, bpp)
@@ -0,0 +1,254 @@
+# Flat frame-buffer renderer for the raygun LED strip
+#
+# Effects draw in "group space": one RGB triple per entry of led_groups,
+# kept in a single preallocated bytearray.  commit() scatters the group
+# colours straight into the NeoPixel buffer through byte-offset tables that
+# are computed once at boot, then calls np.write().  Nothing is allocated
+# once the Renderer has been constructed.
+#
+# On the way out every colour goes through `lut`, a tables.gamma_table():
+# gamma correction and the global brightness in one lookup, so effects
+# draw at the full 0-255 range and a brightness change is set_lut() with
+# another prebuilt table.  The table gives 8 fraction bits as well; with
+# dither on, what those lose in a frame is carried into the next one, so
+# a level between two LED steps comes out as a mix of both over time
+# instead of a band.  While there is such a fraction left, `fractional`
+# is set and commit() writes even an unchanged frame; refresh() is the
+# same for the scheduler to call between frames, but only writes when the
+# next dither step changes a byte: a fraction of 1/16 needs a write one
+# refresh in sixteen, not every one.
+#
+# A frame runs from begin() to commit().  Drawing marks the frame dirty,
+# and commit() calls np.write() at most once, and only when the frame is
+# dirty and its checksum differs from the last frame actually written.
+# `writes` and `writes_saved` count both outcomes, `refreshes` the extra
+# dither writes.
+#
+# load(f) reads a whole baked frame (baked.py) from a file straight into
+# np.buf instead; the next commit() puts it through the lut in place and
+# writes it, without the scatter or the checksum.  The groups no longer
+# describe the strip then, so load() clears them: an effect drawing only
+# some groups after a baked one starts from black, not stale colours.
+#
+# Example:
+#    fb = Renderer(np, led_groups)
+#    fb.begin()
+#    fb.fill(0, 0, 0)
+#    fb.set_group(3, 255, 0, 0)
+#    fb.commit()
+
+from array import array
+from tables import gamma_table
+from trace import trace, TR_FRAME, TR_WRITE, TR_WRITTEN
+
+try:
+    from micropython import const, native
+except ImportError:
+    def const(x):
+        return x
+
+    def native(f):
+        return f
+
+# set in shade()'s result when an output byte changed, below it the
+# OR of the fractions left over
+CHANGED = const(0x100)
+
+
+class Renderer:
+    def __init__(self, np, groups, lut=None, dither=True):
+        self.np = np
+        self.groups = len(groups)
+
+        # one RGB triple per group, this is what the effects draw into
+        self.rgb = bytearray(3 * self.groups)
+        self.black = bytes(3 * self.groups)
+        self.dirty = True
+        # np.buf holds a loaded frame rather than the groups
+        self.raw = False
+
+        # rgb through the lut, what scatter() copies out, and the dither
+        # remainders for the groups and for loaded frames
+        self.lut = lut if lut is not None else gamma_table()
+        self.dither = dither
+        self.out = bytearray(3 * self.groups)
+        self.err = bytearray(3 * self.groups)
+        self.raw_err = bytearray(len(np.buf))
+        self.fractional = False
+        self.refreshes = 0
+
+        # checksum of the last frame sent to the strip, -1 before the first
+        self.sum_a = -1
+        self.sum_b = -1
+        self.sum_a_new = 0
+        self.sum_b_new = 0
+        self.writes = 0
+        self.writes_saved = 0
+
+        # The NeoPixel driver stores each pixel in wire order (GRB for
+        # WS2812), ORDER maps an (r, g, b) index to its position in buf.
+        order = getattr(np, "ORDER", (1, 0, 2, 3))
+        bpp = getattr(np, "bpp", 3)
+
+        # start[i]..start[i+1] are the entries of offsets owned by group i,
+        # offsets holds the byte offset of R, G and B for every LED in turn
+        self.start = array("H", [0] * (self.groups + 1))
+        pixels = 0
+        for i in range(self.groups):
+            pixels += len(groups[i])
+            self.start[i + 1] = 3 * pixels
+
+        self.offsets = array("H", [0] * (3 * pixels))
+        k = 0
+        for group in groups:
+            for led in group:
+                base = (led - 1) * bpp
+                for c in range(3):
+                    self.offsets[k] = base + order[c]
+                    k += 1
+
+    def begin(self):
+        trace(TR_FRAME)
+        self.dirty = False
+
+    def set_group(self, i, r, g, b):
+        self.dirty = True
+        rgb = self.rgb
+        i *= 3
+        rgb[i] = r
+        rgb[i + 1] = g
+        rgb[i + 2] = b
+
+    def fill(self, r, g, b):
+        self.dirty = True
+        rgb = self.rgb
+        for i in range(0, len(rgb), 3):
+            rgb[i] = r
+            rgb[i + 1] = g
+            rgb[i + 2] = b
+
+    def fill_range(self, first, last, r, g, b):
+        # fill groups first..last-1
+        self.dirty = True
+        rgb = self.rgb
+        for i in range(3 * first, 3 * last, 3):
+            rgb[i] = r
+            rgb[i + 1] = g
+            rgb[i + 2] = b
+
+    def clear(self):
+        self.fill(0, 0, 0)
+
+    def load(self, f):
+        # the next frame of a baked file, in the strip's own byte order
+        f.readinto(self.np.buf)
+        self.rgb[:] = self.black
+        self.raw = True
+
+    def set_lut(self, lut):
+        # another brightness, the next commit() writes whatever it holds;
+        # fractions left from the old table would keep `fractional` set
+        self.lut = lut
+        err = self.err
+        for i in range(len(err)):
+            err[i] = 0
+        self.sum_a = -1
+        self.dirty = True
+
+    @native
+    def shade(self, src, dst, err):
+        # dst[i] = lut[src[i]], the fraction carried in err with dither
+        lut = self.lut
+        left = 0
+        if self.dither:
+            for i in range(len(src)):
+                v = lut[src[i]] + err[i]
+                if dst[i] != v >> 8:
+                    dst[i] = v >> 8
+                    left |= CHANGED
+                err[i] = v & 0xFF
+                left |= v & 0xFF
+        else:
+            for i in range(len(src)):
+                dst[i] = (lut[src[i]] + 128) >> 8
+        return left
+
+    @native
+    def scatter(self):
+        # copy every shaded group colour into np.buf in a single pass
+        buf = self.np.buf
+        rgb = self.out
+        offsets = self.offsets
+        start = self.start
+        k = 0
+        for i in range(self.groups):
+            r = rgb[3 * i]
+            g = rgb[3 * i + 1]
+            b = rgb[3 * i + 2]
+            end = start[i + 1]
+            while k < end:
+                buf[offsets[k]] = r
+                buf[offsets[k + 1]] = g
+                buf[offsets[k + 2]] = b
+                k += 3
+
+    @native
+    def checksum(self):
+        # Fletcher-style running sums, b makes the sum position dependent
+        a = 0
+        b = 0
+        for v in self.rgb:
+            a = (a + v) & 0xFFFF
+            b = (b + a) & 0xFFFF
+        self.sum_a_new = a
+        self.sum_b_new = b
+
+    def commit(self, force=False):
+        # push the frame with a single np.write(), skipped when nothing changed
+        if self.raw:
+            self.raw = False
+            self.dirty = False
+            # whatever the groups hold next has to be written
+            self.sum_a = -1
+            buf = self.np.buf
+            self.shade(buf, buf, self.raw_err)
+            # nothing left to refresh, the loaded frame is shaded in place
+            self.fractional = False
+            self.write()
+            self.writes += 1
+            return True
+        if not (self.dirty or force or self.fractional):
+            self.writes_saved += 1
+            return False
+        self.dirty = False
+        self.checksum()
+        if (not force and not self.fractional and self.sum_a_new == self.sum_a
+                and self.sum_b_new == self.sum_b):
+            self.writes_saved += 1
+            return False
+        self.sum_a = self.sum_a_new
+        self.sum_b = self.sum_b_new
+        self.fractional = self.shade(self.rgb, self.out, self.err) & 0xFF != 0
+        self.scatter()
+        self.write()
+        self.writes += 1
+        return True
+
+    def refresh(self):
+        # the same picture again with the next dither step, if that
+        # changes what the strip shows
+        if not self.fractional:
+            return False
+        left = self.shade(self.rgb, self.out, self.err)
+        self.fractional = left & 0xFF != 0
+        if not left & CHANGED:
+            return False
+        self.scatter()
+        self.write()
+        self.refreshes += 1
+        return True
+
+    def write(self):
+        trace(TR_WRITE)
+        self.np.write()
+        trace(TR_WRITTEN)
@@ -2,8 +2,8 @@
 # Copyright (C) Colin O'Flynn, 2021
 # CC-SA 3.0 License
 
-from machine import Pin, PWM, Signal
-import neopixel
+import machine
+from machine import Pin, PWM, Signal, ADC
 import time
 import utime
 import array
@@ -12,15 +12,23 @@ import math
 import _thread
 import random
 from wavplayer import WavPlayer
+from ledrender import Renderer
+from tables import gamma_table, LOW_POWER_SCALE
+from ledout import strip
+from scheduler import FrameScheduler
+from debounce import Debouncer
+from pulse import PulseTrigger, MODE_SINGLE, MODE_REPEAT, MODE_BURST
+from pulsegen import pulser
+from charge import ChargeController, FREQ_HOLD, DUTY_HOLD
+from trace import trace, TR_UPDATE, TR_BUTTON
+import animations
+from baked import Baked
+from envelope import load as load_envelopes
+from fsm import StateMachine
+from fsm import STARTUP, DISARMED, ARMED, FIRING, LOW_POWER, ERROR, SOUND_ON, SOUND_OFF
+from fsm import EV_DONE, EV_ARM, EV_DISARM, EV_FIRE, EV_PULSE, EV_LOW_POWER, EV_WAKEUP, EV_CHORD, EV_TIMEOUT
 
-state = "Startup"
-substate = "None"
-state_changed = True
-animation_changed = True
 running = True
-loop_counter = 0
-sound_on = True
-low_power_brightness = 0.05
 
 
 
@@ -30,6 +38,12 @@ WS_PIN = Pin(21)
 SD_PIN = Pin(19)
 I2S_ID = 0
 BUFFER_LENGTH_IN_BYTES = 2000
+# RAM for preloaded sounds, enough for all three firing sounds
+SOUND_CACHE_BYTES = 40000
+# firing sounds overlap: the playing clip plus two mixed voices
+SOUND_VOICES = 3
+# built by utilities/build_bank.py, the WAV files are used when it is missing
+SOUND_BANK = "sounds.bnk"
 
 wp = WavPlayer(
     id=I2S_ID,
@@ -37,115 +51,76 @@ wp = WavPlayer(
     ws_pin=Pin(WS_PIN),
     sd_pin=Pin(SD_PIN),
     ibuf=BUFFER_LENGTH_IN_BYTES,
+    cache_bytes=SOUND_CACHE_BYTES,
+    voices=SOUND_VOICES,
+    bank=SOUND_BANK,
 )
 
 firing_song = ["pew-small.wav", "tesla.wav", "blaster.wav"]
 firing_song_index = 0
 
+# A shot should never wait on the file system
+for song in firing_song:
+    wp.preload(song)
+
 low_power_song = ["nomana.wav", "nomana2.wav", "nomana3.wav"]
 low_power_song_index = 0
 
+# Loudness tracks for the LEDs to follow, built by utilities/build_env.py;
+# only the low power songs play under the Reactive meter, and a clip
+# without one just shows as silent
+envelopes = load_envelopes(low_power_song)
+
+def audio_level():
+    # the envelope of the newest sound where it is playing now, 0-255
+    env = envelopes.get(wp.latest)
+    if env is None:
+        return 0
+    return env.at(wp.position_ms())
+
 # ======== BUTTON TRIGGERS ========
 
+# All state changes go through the state machine, the IRQ handlers below
+# only post events to it (see fsm.py)
+fsm = StateMachine(lambda: buttonArm.value())
+
 # Setup GPIO15 as input with pull-up resistor
 low_power_pin = machine.Pin(9, machine.Pin.IN, machine.Pin.PULL_UP)
 wakeup_pin = machine.Pin(15, machine.Pin.IN, machine.Pin.PULL_UP)
 
-# Define the callback function for button press
-def low_power_callback(pin):
-    global state
-    global substate
-    global state_changed
-    global sound_on
-    global animation_changed
+# The buttons are debounced with a one-shot timer rather than sleeping in
+# the IRQ handler, pressing both together is the sound on/off chord
+BUTTON_DEBOUNCE_MS = 50
+BUTTON_CHORD_MS = 50
 
-    if state == "Sound On" or state == "Sound Off":
-        # we are in the middle of a triggered sound change, ignore this button push
-        return
+def button_pressed(i):
+    trace(TR_BUTTON, i)
+    fsm.post(EV_LOW_POWER if i == 0 else EV_WAKEUP)
 
-    # Short delay to debounce and check both buttons
-    utime.sleep_ms(50)
+def buttons_chord():
+    trace(TR_BUTTON, 2)
+    fsm.post(EV_CHORD)
 
-    if low_power_pin.value() and wakeup_pin.value():
-        print("Both buttons pressed!")
+buttons = Debouncer((low_power_pin, wakeup_pin), button_pressed, buttons_chord,
+                    debounce_ms=BUTTON_DEBOUNCE_MS, chord_ms=BUTTON_CHORD_MS)
 
-        # invert the value of the sound_on variable
-        sound_on = not sound_on
-        substate = state
-        state = "Sound On" if sound_on else "Sound Off"
-        return
-        
-
-    print("Low Power Button pressed!")
-    # Implement the logic to handle the button press
-    state = "Low Power"
-
-    if substate == "None":
-        substate = "Chase"
-    elif substate == "Chase":
-        substate = "Rainbow"
-    elif substate == "Rainbow":
-        substate = "Twinkle"
-    elif substate == "Twinkle":
-        substate = "Wave"
-    elif substate == "Wave":
-        substate = "Chase"
-    
-    
-    state_changed = True
-    animation_changed = True
-
-def wakeup_callback(pin):
-    global state
-    global substate
-    global state_changed
-    global sound_on
-    global animation_changed
-
-    if state == "Sound On" or state == "Sound Off":
-        # we are in the middle of a triggered sound change, ignore this button push
-        return
-    
-    # Short delay to debounce and check both buttons
-    utime.sleep_ms(50)
-
-    if low_power_pin.value() and wakeup_pin.value():
-        print("Both buttons pressed!")
-        
-        # invert the value of the sound_on variable
-        sound_on = not sound_on
-        substate = state
-        state = "Sound On" if sound_on else "Sound Off"
-        return
-
-    print("Wakeup Button pressed!")
-    # Implement the logic to handle the button press
-    if buttonArm.value():
-        if state != "Armed":
-            state_changed = True
-            animation_changed = True
-        state = "Armed"
-    else:
-        if state != "Disarmed":
-            state_changed = True
-            animation_changed = True
-        state = "Disarmed"
-        
-    substate = "None"
+def arm_callback(pin):
+    trace(TR_BUTTON, 3)
+    fsm.post(EV_ARM if buttonArm.value() else EV_DISARM)
     
+# Attach the interrupt to GPIO9
+low_power_pin.irq(trigger=machine.Pin.IRQ_RISING, handler=buttons.handlers[0])
 # Attach the interrupt to GPIO15
-low_power_pin.irq(trigger=machine.Pin.IRQ_RISING, handler=low_power_callback)
-# Attach the interrupt to GPIO15
-wakeup_pin.irq(trigger=machine.Pin.IRQ_RISING, handler=wakeup_callback)
+wakeup_pin.irq(trigger=machine.Pin.IRQ_RISING, handler=buttons.handlers[1])
 
 
 # ======== LED CONFIGURATION ========
-# Create NeoPixel object with appropriate configuration.
-np = neopixel.NeoPixel(Pin(29), 76)
+# Create NeoPixel object with appropriate configuration.  strip() gives a
+# double-buffered PIO/DMA output where it can (see ledout.py), so frames
+# go out while the next one renders.
+np = strip(Pin(29), 76)
 n = np.n
 
-brightness = 0
-
 led_groups = [
     [28, 67, 29, 66], [27, 65], [26, 64], [25, 61, 30, 68], 
     [24, 62, 31, 69], [23, 63, 32, 70], [22, 60], [21, 59, 33, 71], 
@@ -155,238 +130,117 @@ led_groups = [
     [6, 44], [5, 43], [4, 42], [3, 41], [2, 40], [1, 39]
 ]
 
-def scale_color(color, factor):
-    return tuple(int(c * factor) for c in color)
+# Overall LED brightness out of 255.  Effects draw at full range and the
+# Renderer applies gamma and brightness once per frame through one of
+# these tables; low power mode swaps in the dimmer one, in whole LED
+# levels so nothing is dithered and a frame is one write at most
+BRIGHTNESS = 255
+FULL_LUT = gamma_table(BRIGHTNESS)
+LOW_POWER_LUT = gamma_table(BRIGHTNESS * LOW_POWER_SCALE >> 8, whole=True)
 
-def interpolate_color(start_color, end_color, factor):
-    return tuple(int(start_color[i] + factor * (end_color[i] - start_color[i])) for i in range(3))
+# Effects draw into fb one colour per group, fb.commit() pushes the frame
+fb = Renderer(np, led_groups, lut=FULL_LUT)
 
-def wheel(pos):
-    # Generate rainbow colors across 0-255 positions.
-    if pos < 85:
-        return (pos * 3, 255 - pos * 3, 0)
-    elif pos < 170:
-        pos -= 85
-        return (255 - pos * 3, 0, pos * 3)
-    else:
-        pos -= 170
-        return (0, pos * 3, 255 - pos * 3)
+# fsm.seq of the transition whose animation is showing, a newer one cuts
+# the current frame's wait short
+shown_seq = -1
 
-# Define start and end colors
-start_color = (0, 0, 255)  # Blue
-end_color = (255, 0, 0)    # Red
+def state_changed():
+    return fsm.seq != shown_seq
 
-def set_all_leds(color):
-    for group in led_groups:
-        for led in group:
-            np[led-1] = color
-    np.write()
-
-def flash_all_red():
-    for i in range(n):
-        np[i] = (10, 0, 0)
-    np.write()
-    time.sleep_ms(500)
-    for i in range(n):
-        np[i] = (0, 0, 0)
-    np.write()
-    time.sleep_ms(500)
-
-def startup_animation():
-    for i in range(len(led_groups)):
-        # Calculate the current color based on the interpolation
-        factor = i / (len(led_groups) - 1)
-        current_color = interpolate_color(start_color, end_color, factor)
-        
-        # Turn on the LEDs in the current group
-        for led in led_groups[i]:
-            np[led-1] = current_color
-        
-        # Update the colors of all previous LEDs to the current color
-        for j in range(i + 1):
-            for led in led_groups[j]:
-                np[led-1] = current_color
-        
-        np.write()
-        time.sleep(0.07)
-
-def wipe_animation(colour, sleep_time=0.03):
-    for i in range(len(led_groups)):
-
-        # Turn on the LEDs in the current group
-        for led in led_groups[i]:
-            np[led-1] = colour
-        
-        np.write()
-        time.sleep(sleep_time)
-
-def firing_animation():
-
-    #set a colour gradiant from red to green
-    for i in range(len(led_groups)):
-        factor = i / (len(led_groups) - 1)
-        current_color = interpolate_color((255, 0, 0), (0, 255, 0), factor/2)
-        for led in led_groups[i]:
-            np[led-1] = current_color
-    np.write()     
-
-    # a reverse wipe animation turning all the leds off (then all back on)
-    for i in range(len(led_groups)-1, -1, -1):
-        for led in led_groups[i]:
-            np[led-1] = (0, 0, 0)
-        np.write()
-        time.sleep(0.01)
-
-    #turn them all back on
-    for i in range(len(led_groups)):
-        for led in led_groups[i]:
-            np[led-1] = (10, 0, 0)
-    np.write()    
-
-def breathing_effect(colour, max_brightness=50):
-    global loop_counter
-
-    loop_counter %= max_brightness
-   
-    # Calculate the brightness factor using a sine wave
-    brightness_factor = (math.sin(brightness / max_brightness * 2 * math.pi) + 1) / 2
-    
-    # Adjust the brightness of all LEDs
-    adjusted_color = tuple(int(c * brightness_factor) for c in colour)
-    set_all_leds(adjusted_color)
-    time.sleep(0.04)
-    loop_counter += 1
-
-def rainbow_cycle(wait=0.01):
-    global loop_counter
-
-    loop_counter %= 256
-
-    for i in range(len(led_groups)):
-        pixel_index = (i * 256 // len(led_groups)) + loop_counter
-        color = wheel(pixel_index & 255)
-        scaled_color = scale_color(color, low_power_brightness)
-        for led in led_groups[i]:
-            np[led - 1] = scaled_color
-    np.write()
-    time.sleep(wait)
-    loop_counter += 1
-
-def chase_animation():
-    global loop_counter
-
-    loop_counter %= len(led_groups)
-
-    # Turn off all LEDs
-    set_all_leds((0, 0, 0))
-    
-    # Turn on the current group and the next few groups for the chase effect
-    for j in range(5):  # Number of groups in the chase
-        group_index = (loop_counter + j) % len(led_groups)
-        color = wheel((group_index * 256 // len(led_groups)) & 255)
-        scaled_color = scale_color(color, low_power_brightness)
-        for led in led_groups[group_index]:
-            np[led - 1] = scaled_color
-    
-    np.write()
-    time.sleep(0.1)
-    loop_counter += 1
+sched = FrameScheduler(fb, interrupt=state_changed)
 
-def twinkle_effect():
-    twinkle_color = scale_color((255, 255, 255),0.1)  # White
-
-    # Turn off all LEDs
-    set_all_leds((0, 0, 0))
-    
-    # Randomly turn on a few groups
-    for _ in range(10):  # Number of twinkles
-        group_index = random.randint(0, len(led_groups) - 1)
-        color = wheel((group_index * 256 // len(led_groups)) & 255)
-        scaled_color = scale_color(color, low_power_brightness)
-        for led in led_groups[group_index]:
-            np[led - 1] = scaled_color
-    
-    np.write()
-    time.sleep(0.5)
-
-def wave_pattern():
-    global loop_counter
+def set_all_leds(color):
+    fb.fill(color[0], color[1], color[2])
+    fb.commit()
 
-    loop_counter %= 255
+# The startup and firing sequences stream from frame files when they
+# have been baked (utilities/bake_anim.py) and flashed, so they cost no
+# CPU per frame; without the files they are computed as before
+def baked_or(path, effect):
+    try:
+        return Baked(fb, path)
+    except OSError:
+        return effect
+
+# All effects are built once here, switching state never allocates
+startup_fx = baked_or("startup.anim", animations.Startup(fb))
+firing_fx = baked_or("firing.anim", animations.Firing(fb))
+error_fx = animations.Blink(fb, animations.RED_LOW)
+disarmed_wipe_fx = animations.Wipe(fb, animations.GREEN_LOW, fps=20)
+disarmed_fx = animations.Breathing(fb, animations.GREEN_LOW)
+armed_wipe_fx = animations.Wipe(fb, animations.RED_LOW)
+armed_fx = animations.Breathing(fb, animations.RED_LOW, 20)
+low_power_fx = (
+    None,
+    animations.Chase(fb),
+    animations.Rainbow(fb),
+    animations.Twinkle(fb),
+    animations.Wave(fb),
+    animations.Reactive(fb, audio_level),
+)
 
-    for i in range(len(led_groups)):
-        wave_value = (math.sin(i / 10.0 + loop_counter / 10.0) + 1) / 2 * 255
-        color = (int(wave_value), 0, 255 - int(wave_value))
-        scaled_color = scale_color(color, low_power_brightness)
-        for led in led_groups[i]:
-            np[led - 1] = scaled_color
-    np.write()
-    time.sleep(0.05)
-    loop_counter += 1
+def start_animation(state, low_power_mode):
+    fb.set_lut(LOW_POWER_LUT if state == LOW_POWER else FULL_LUT)
+    if state == STARTUP:
+        sched.play(startup_fx)
+    elif state == DISARMED:
+        sched.play(disarmed_wipe_fx, then=disarmed_fx)
+    elif state == ARMED:
+        sched.play(armed_wipe_fx, then=armed_fx)
+    elif state == LOW_POWER:
+        if low_power_fx[low_power_mode] is not None:
+            sched.play(low_power_fx[low_power_mode])
+        else:
+            sched.stop()
+    elif state == ERROR or state == SOUND_ON or state == SOUND_OFF:
+        sched.play(error_fx)
+    elif state == FIRING:
+        sched.play(firing_fx)
 
 def animation_thread():
-    global state
-    global animation_changed   
-    global running
-    global loop_counter
+    global running, shown_seq
 
     try:
         while running:
-            if state_changed:
-                loop_counter = 0
-
-            if state == "Startup":
-                if (animation_changed):
-                    animation_changed = False
-                    startup_animation()
-            elif state == "Disarmed":
-                if (animation_changed):
-                    animation_changed = False
-                    wipe_animation((0, 10, 0), 0.05) 
-                breathing_effect((0, 10, 0))
-            elif state == "Armed":
-                if (animation_changed):
-                    animation_changed = False
-                    wipe_animation((10, 0, 0)) 
-                breathing_effect((10, 0, 0), 20)
-            elif state == "Low Power":
-                if substate == "Chase":
-                    chase_animation()
-                elif substate == "Rainbow":
-                    rainbow_cycle()
-                elif substate == "Wave":
-                    wave_pattern()
-                elif substate == "Twinkle":
-                    twinkle_effect()
-            elif state == "Error" or state == "Sound On" or state == "Sound Off":
-                flash_all_red()
-            elif state == "Firing":
-                if (animation_changed):
-                    animation_changed = False
-                    firing_animation()
+            # every transition restarts the animation, lead-in included
+            if fsm.seq != shown_seq:
+                # state and mode from the same transition
+                shown_seq, state, mode = fsm.snapshot()
+                start_animation(state, mode)
+
+            # sleep through states with nothing (left) to draw
+            if not sched.step():
+                sched.idle()
     except KeyboardInterrupt:
         running = False
         print("Keyboard Interrupt")
         return
 
 # ============= EMP CONFIGURATION =============
+# The hvpwm pin (GPIO12) drives the HV transformer.  The 'charged' input
+# routes to two pins, one of them is an ADC pin (GPIO26): the charge
+# controller samples it, boosts the drive after a pulse and tapers back
+# to the emperically tuned 2500Hz / 1.22% duty (around 250V on the HV
+# capacitor) as it fills.  Its value() is the 'charged' signal, and the
+# transformer starts off.  See charge.py.
+#
+# The boost is off for now: both ends of the ramp are the hand-tuned
+# drive, and the boost limits are off with it.  FULL_LEVEL and
+# TAPER_LEVEL are guesses until `level` has been read on a charged badge
+# (this line used to be read as a digital input), and with wrong ones the
+# ramp would sit at full boost until the line flips.  The capacitor
+# charges as it always did, in 2-3 s.
+charger = ChargeController(PWM(Pin(12)), ADC(26), freq_boost=FREQ_HOLD, duty_boost=DUTY_HOLD,
+                           max_boost_ms=1 << 30, boost_budget_ms=1 << 20)
+
 def pwm_off():
     """Turn HV Transformer Off"""
-    hvpwm = Pin(12, Pin.OUT)
-    hvpwm.low()
+    charger.off()
 
 def pwm_on():
     """Turn HV Transformer On"""
-    hvpwm = PWM(Pin(12))
-    # The duty cycle & frequency have been emperically tuned
-    # here to maximize the HV charge. This results in around
-    # 250V on the HV capacitor. Setting duty cycle higher generally
-    # just causes more current flow/waste in the HV transformer.
-    hvpwm.freq(2500)
-    hvpwm.duty_u16(800) #range 0 to 65535, 800 = 1.22% duty cycle
-
-#hvpwm pin drives the HV transformer
-pwm_off()
+    charger.on()
 
 # Status LEDs:
 ledHv = Signal(Pin(17, Pin.OUT)) #HV 'on' LED (based on feedback)
@@ -398,13 +252,13 @@ ledStatus.on()
 # Due to original PCB being single-layer milled board, these buttons
 # used different "active" status to simplify the board routing. This
 # was left the same for final PCB.
-buttonArm = Signal(Pin(4,  Pin.IN, pull=Pin.PULL_DOWN))
-buttonPulse = Signal(Pin(3, Pin.IN, pull=Pin.PULL_DOWN))
+arm_pin = Pin(4,  Pin.IN, pull=Pin.PULL_DOWN)
+buttonArm = Signal(arm_pin)
+pulse_pin = Pin(3, Pin.IN, pull=Pin.PULL_DOWN)
+buttonPulse = Signal(pulse_pin)
 
-# The 'charged' input routes to two pins, one of them is an ADC pin.
-# Technically could just use the ADC pin as digital input, but again
-# for 'technical debt' reasons left as two pins.
-charged = Signal(Pin(26,  Pin.IN), invert=True)
+# 1 once the HV capacitor is charged
+charged = charger
 
 # The 'pulseOut' pin drives the gate of the switch via transformer.
 pulse_out_pin = 10
@@ -416,6 +270,9 @@ pulseOut = Pin(pulse_out_pin, Pin.OUT)
 # the drive signal slightly by adjusting drive strength?
 machine.mem32[0x4 + 0x04*pulse_out_pin + 0x4001c000] = 0b1110011
 pulseOut.low()
+# The pulses themselves come from a PIO state machine, exact to 0.1 us
+# (see pulsegen.py), the pad settings above still apply
+pulseGen = pulser(pulseOut)
 
 enabled = False
 oldButtonArm = False
@@ -423,97 +280,126 @@ oldButtonArm = False
 timeout_start = utime.ticks_ms()
 
 
+# The arm switch is also polled by the handlers, the IRQ just gets the
+# change in front of the state machine straight away
+arm_pin.irq(trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING, handler=arm_callback)
+
+# The pulse goes out from the pulse button's own IRQ, before any sound or
+# LED work; the Firing state (and with it the sound and animation) follows
+# from the posted event.  trigger.report() prints the edge to pulse
+# latency histogram and the shot log.
+# FIRE_MODE: MODE_SINGLE fires once per press, MODE_REPEAT keeps firing
+# while the button is held, MODE_BURST fires BURST_SHOTS per press.  The
+# repeats go out as soon as the charge controller sees the capacitor
+# full again, so every shot is a full strength one; the hold-off only
+# covers button bounce.
+# Each shot is PULSE_COUNT pulses of PULSE_WIDTH_US, PULSE_GAP_US apart.
+PULSE_WIDTH_US = 5
+PULSE_COUNT = 1
+PULSE_GAP_US = 0
+PULSE_HOLDOFF_MS = 50
+FIRE_MODE = MODE_REPEAT
+BURST_SHOTS = 3
+
+def pulse_ready():
+    # from the pulse IRQ, must not allocate
+    return (fsm.state == ARMED or fsm.state == FIRING) and charger.charged
+
+def shot_fired():
+    # from the pulse IRQ, must not allocate
+    charger.pulsed()
+    fsm.post(EV_FIRE)
+
+trigger = PulseTrigger(pulseGen, pulse_ready, shot_fired,
+                       width_us=PULSE_WIDTH_US, count=PULSE_COUNT, gap_us=PULSE_GAP_US,
+                       holdoff_ms=PULSE_HOLDOFF_MS,
+                       mode=FIRE_MODE, burst=BURST_SHOTS, held=buttonPulse.value)
+pulse_pin.irq(trigger=Pin.IRQ_RISING, handler=trigger.handler, hard=True)
+charger.on_charged = trigger.charged
+
+
+def sound_done(name):
+    # from the I2S callback when a one-shot sound has played out
+    fsm.post(EV_DONE)
+
+
+def play_now(name, on_done=None):
+    # cut off whatever is playing and start name as soon as it has flushed
+    wp.stop()
+    wp.enqueue(name, on_done)
+
+
 def update(buttonArm, buttonPulse, charged):
-    global state
+    trace(TR_UPDATE)
+    fsm.run_pending()
+    state = fsm.state
 
-    if state == "Startup":
+    if state == STARTUP:
         handle_startup()
-    if state == "Disarmed":
+    elif state == DISARMED:
         handle_disarmed(buttonArm)
-    elif state == "Armed":
+    elif state == ARMED:
         handle_armed(buttonArm, buttonPulse, charged)
-    elif state == "Low Power":
+    elif state == FIRING:
+        handle_firing()
+    elif state == LOW_POWER:
         handle_low_power()
-    elif state == "Sound On":
+    elif state == SOUND_ON:
         handle_sound_on()
-    elif state == "Sound Off":
+    elif state == SOUND_OFF:
         handle_sound_off()
+    else:
+        # Error only exists inside the disarmed handler
+        fsm.enter()
 
 
 def handle_startup():
-    global state
-    global state_changed
-    global animation_changed
-
-    # Implement startup logic
-    wp.play("startup.wav", loop=False)
-    while wp.isplaying() == True:
-        pass
-    
-    if buttonArm.value():
-        state = "Armed"
-    else:
-        state = "Disarmed"
-    state_changed = True
-    animation_changed = True
+    if not fsm.enter():
+        return
 
-def handle_disarmed(buttonArm):
-    global state
-    global state_changed
-    global animation_changed
+    # Implement startup logic, sound_done moves us on when it has played
+    play_now("startup.wav", sound_done)
 
-    if state_changed:
-        ledArm.off()
-        pwm_off()
-        ledHv.off()
-        if sound_on:
-            wp.play("disarm.wav", loop=False)
-            while wp.isplaying() == True:
-                time.sleep(0.1) 
+def handle_disarmed(buttonArm):
+    if fsm.enter():
+        # coming back from the boom sound or a sound toggle is not a
+        # fresh disarm
+        if fsm.previous not in (ERROR, SOUND_ON, SOUND_OFF):
+            trigger.cancel()
+            ledArm.off()
+            pwm_off()
+            ledHv.off()
+            if fsm.sound_on:
+                play_now("disarm.wav")
 
     if buttonArm.value():
         print("Arming")
-        state = "Armed"
-        state_changed = True
-        animation_changed = True
+        fsm.dispatch(EV_ARM)
         return
     
     if buttonPulse.value():
         print("Pulse Button Pressed while disarmed")
-        if (sound_on):
-            wp.play("boom.wav", loop=False)
-            while wp.isplaying() == True:
-                state = "Error"
-            state = "Disarmed"
-    
-    state_changed = False
+        # Error lasts until the boom has played
+        if fsm.sound_on and fsm.dispatch(EV_PULSE):
+            play_now("boom.wav", sound_done)
 
 def handle_armed(buttonArm, buttonPulse, charged):
-    global state
     global timeout_start
-    global state_changed
-    global firing_song_index
-    global animation_changed
-
-    fired = False
-
-    if state_changed:
-        ledArm.on()
-        pwm_on()
-        # Used to sleep HV
-        timeout_start = utime.ticks_ms()
-        
-        if sound_on:
-            wp.play("arm.wav", loop=False)
-            while wp.isplaying() == True:
-                time.sleep(0.1)
 
+    if fsm.enter():
+        # returning from a shot or a sound toggle is not a fresh arm
+        if fsm.previous not in (FIRING, SOUND_ON, SOUND_OFF):
+            ledArm.on()
+            pwm_on()
+            # Used to sleep HV
+            timeout_start = utime.ticks_ms()
+            
+            if fsm.sound_on:
+                play_now("arm.wav")
 
     if not buttonArm.value():
         print("Disarming")
-        state = "Disarmed"
-        state_changed = True
-        animation_changed = True
+        fsm.dispatch(EV_DISARM)
         return
     
     if not charged.value():
@@ -523,103 +409,66 @@ def handle_armed(buttonArm, buttonPulse, charged):
     else:
         ledHv.on()
 
+
+    # The first pulse comes from the IRQ, repeats from the charge
+    # controller; this catches one that was refused at that moment
+    trigger.poll()
     
-    while buttonPulse.value():
-        fired = True 
-        state = "Firing"
-        state_changed = True
-        animation_changed = True
-        if sound_on:
-            wp.play(firing_song[firing_song_index], loop=False)   
-        # Handle pulse logic
-        pulseOut.high()
-        utime.sleep_us(5)
-        pulseOut.low()
+    # Check for timeout to switch to low power or disable
+    if utime.ticks_diff(utime.ticks_ms(), timeout_start) > 60000:
+        fsm.dispatch(EV_TIMEOUT)
 
-        # Used to sleep HV
-        timeout_start = utime.ticks_ms()
+def handle_firing():
+    global timeout_start
+    global firing_song_index
 
-        # Force delay between pulses, allowing you to
-        # hold down button. If you want one-shot operation
-        # add code to check previous value like with 'arm'
-        # button. Note HV circuit takes ~2-3 seconds to
-        # recover so 2nd and later pulses not as strong.
-        utime.sleep_ms(250)
-        state = "Armed"
-        while wp.isplaying() == True:
-            time.sleep(0.1)
-    
-    if fired:
+    if fsm.enter():
+        # the pulse has already gone out
+        if fsm.sound_on:
+            # mixed over the previous shot if that is still playing
+            wp.play(firing_song[firing_song_index], loop=False)
         firing_song_index += 1
         firing_song_index %= len(firing_song)
-    
-    # Check for timeout to switch to low power or disable
-    if utime.ticks_diff(utime.ticks_ms(), timeout_start) > 60000:
-        state = "Low Power"
-        state_changed = True
-        return
-    
-    state_changed = False
+
+        # Used to sleep HV
+        timeout_start = utime.ticks_ms()
+
+    # every shot of a burst or held repeat re-enters Firing
+    trigger.poll()
+    if not trigger.holding_off() and not trigger.busy():
+        fsm.dispatch(EV_DONE)
 
 def handle_low_power():
-    global state
-    global substate
     global low_power_song
     global low_power_song_index
-    global state_changed
 
-    if state_changed:
+    if fsm.enter():
         low_power_song_index = 0
+        trigger.cancel()
         ledArm.off()
         pwm_off()
         ledHv.off()
 
-
-    # Implement low power logic
-    if substate == "None":
-        #start with the chase animation
-        substate = "Chase"
-
     if buttonPulse.value():
         print("Pulse Button Pressed while in low power mode")
-        if (sound_on):
+        # holding the button plays the songs one after another
+        if fsm.sound_on and not wp.isplaying():
             wp.play(low_power_song[low_power_song_index], loop=False)
-            while wp.isplaying() == True:
-                time.sleep(0.1)
-
             low_power_song_index += 1
             low_power_song_index %= len(low_power_song)
 
-    state_changed = False
-
 
 def handle_sound_on():
-    global state
-    global substate
-    global state_changed
-    global animation_changed
-
-    wp.play("soundon.wav", loop=False)
-    while wp.isplaying() == True:
-        time.sleep(0.1)
+    if not fsm.enter():
+        return
 
-    state = substate
-    substate = "None"
-    state_changed = False
-    animation_changed = True
+    play_now("soundon.wav", sound_done)
 
 def handle_sound_off():
-    global state
-    global substate
-    global state_changed
-
-    wp.play("nosound.wav", loop=False)
-    while wp.isplaying() == True:
-        time.sleep(0.1)
+    if not fsm.enter():
+        return
 
-    state = substate
-    substate = "None"
-    state_changed = True
+    play_now("nosound.wav", sound_done)
 
 
 # Start the animation thread
@@ -630,7 +479,8 @@ try:
 
     while running:
         update(buttonArm, buttonPulse, charged)
-        time.sleep(0.1)
+        # sleeps up to 100ms, a transition from an IRQ wakes us early
+        fsm.wait(100)
 
 except KeyboardInterrupt:
     running = False
@@ -0,0 +1,131 @@
+# Software mixer for overlapping 16-bit mono sound effects
+#
+# A Mixer owns a preallocated int16 output buffer and a fixed number of
+# voices.  Each voice plays a RAM buffer of 16-bit samples (a preloaded
+# clip) at its own gain, gains are 8.8 fixed point so 256 is unity.  mix()
+# copies the primary stream (or silence) into the output buffer and adds
+# every active voice on top with saturation.  When all voices are busy
+# add() steals the oldest one.
+#
+# The inner loop uses the viper emitter on MicroPython and a plain Python
+# loop elsewhere, so the host benchmarks exercise the same logic.
+#
+# Example:
+#    mx = Mixer(voices=3, samples=5000)
+#    mx.add(clip_bytes, gain=192)
+#    n = mx.mix(primary_mv, 5000)
+#    audio_out.write(mx.out_mv[:n])
+
+from array import array
+
+try:
+    from micropython import viper
+except ImportError:
+    viper = None
+
+
+if viper is not None:
+    @viper
+    def mix_voice(out, src, start: int, n: int, gain: int, first: int):
+        # out[i] (+)= src[start + i] * gain >> 8, saturated to int16
+        o = ptr16(out)
+        s = ptr16(src)
+        i = 0
+        while i < n:
+            v = int(s[start + i])
+            if v & 0x8000:
+                v -= 0x10000
+            v = (v * gain) >> 8
+            if not first:
+                a = int(o[i])
+                if a & 0x8000:
+                    a -= 0x10000
+                v += a
+            if v > 32767:
+                v = 32767
+            elif v < -32768:
+                v = -32768
+            o[i] = v
+            i += 1
+else:
+    def mix_voice(out, src, start, n, gain, first):
+        s = memoryview(src).cast("B").cast("h")
+        for i in range(n):
+            v = (s[start + i] * gain) >> 8
+            if not first:
+                v += out[i]
+            if v > 32767:
+                v = 32767
+            elif v < -32768:
+                v = -32768
+            out[i] = v
+
+
+class Mixer:
+    def __init__(self, voices=3, samples=5000):
+        self.voices = voices
+        self.samples = samples
+        self.out = array("h", bytes(2 * samples))
+        self.out_mv = memoryview(self.out)
+        self.silence = bytes(2 * samples)
+
+        # per voice: sample buffer (None when idle), position in samples,
+        # gain and when it started (for stealing the oldest)
+        self.src = [None] * voices
+        self.length = [0] * voices
+        self.pos = [0] * voices
+        self.gain = [256] * voices
+        self.started = [0] * voices
+        self.count = 0
+        self.stolen = 0
+
+    def active(self):
+        for src in self.src:
+            if src is not None:
+                return True
+        return False
+
+    def add(self, samples, gain=256):
+        # start a voice playing samples (16-bit mono bytes), returns its index
+        voice = -1
+        for i in range(self.voices):
+            if self.src[i] is None:
+                voice = i
+                break
+        if voice < 0:
+            voice = 0
+            for i in range(1, self.voices):
+                if self.started[i] < self.started[voice]:
+                    voice = i
+            self.stolen += 1
+        # mix() runs in the I2S callback: it skips the voice while the rest
+        # is written and only sees samples once they are all in place
+        self.src[voice] = None
+        self.count += 1
+        self.length[voice] = len(samples) // 2
+        self.pos[voice] = 0
+        self.gain[voice] = gain
+        self.started[voice] = self.count
+        self.src[voice] = samples
+        return voice
+
+    def stop(self):
+        for i in range(self.voices):
+            self.src[i] = None
+
+    def mix(self, primary, n):
+        # mix n samples into out: primary (bytes, or None for silence)
+        # plus every active voice, returns n
+        mix_voice(self.out, primary if primary is not None else self.silence, 0, n, 256, 1)
+        for i in range(self.voices):
+            src = self.src[i]
+            if src is None:
+                continue
+            pos = self.pos[i]
+            m = min(n, self.length[i] - pos)
+            mix_voice(self.out, src, pos, m, self.gain[i], 0)
+            pos += m
+            if pos >= self.length[i]:
+                self.src[i] = None
+            self.pos[i] = pos
+        return n
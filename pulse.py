@@ -0,0 +1,252 @@
+# Pulse button fast path
+#
+# The pulse button gets its own hard pin IRQ.  handler() checks ready()
+# (armed and charged) and the hold-off since the last pulse, hands the
+# HV pulse train to `out` (a pulsegen pulser) straight away and only
+# then calls on_fire(), which must be IRQ-safe (StateMachine.post() is),
+# so sound and LEDs follow from the main loop without ever delaying the
+# pulse.  A shot is `count` pulses of width_us, gap_us apart.
+#
+# The time from entering the IRQ handler to the rising edge of the pulse
+# is measured with ticks_us() for every pulse and kept in a histogram of
+# BIN_US wide bins, the last bin collects everything slower.  fire() is
+# the same pulse from elsewhere and is not counted in the histogram.  It
+# runs from soft context (the charge controller's timer, the main loop),
+# so it checks, sends and records the shot with interrupts off: the IRQ
+# cannot slip a second train in between, past the hold-off and the
+# charge check, or update the log and counters under it.
+#
+# What happens after the first shot depends on mode:
+#
+#    MODE_SINGLE   one shot per press of the button
+#    MODE_REPEAT   while held() says the button is down, fire again the
+#                  moment the capacitor is charged
+#    MODE_BURST    `burst` shots per press, each as soon as it is charged
+#
+# Repeats are driven by charged(), which the charge controller calls as
+# the charge comes back, and by poll() from the main loop for anything
+# that was refused at that moment.  holdoff_ms is only a floor between
+# shots against a bouncing button; recharging is what sets the pace.
+#
+# Every shot goes into a ring of (ticks_ms, recharge ms) pairs, the
+# recharge time being from the previous shot to charged() (0 if the
+# charge was never seen to drop).  report() prints the fire rate from it.
+#
+# Example:
+#    trigger = PulseTrigger(pulser(pulseOut), ready, shot_fired, mode=MODE_REPEAT,
+#                           held=buttonPulse.value)
+#    pulse_pin.irq(trigger=Pin.IRQ_RISING, handler=trigger.handler, hard=True)
+#    charger.on_charged = trigger.charged
+#    ...
+#    trigger.report()
+
+import time
+from array import array
+from pulsegen import encode
+from trace import trace, TR_PULSE_IRQ, TR_PULSE
+
+try:
+    from machine import disable_irq, enable_irq
+except ImportError:
+    def disable_irq():
+        return 0
+
+    def enable_irq(state=0):
+        pass
+
+BIN_US = 10
+BINS = 16
+LOG_SIZE = 32
+
+MODE_SINGLE = 0
+MODE_REPEAT = 1
+MODE_BURST = 2
+MODE_NAMES = ("single", "repeat", "burst")
+
+
+class PulseTrigger:
+    def __init__(self, out, ready, on_fire, width_us=5, count=1, gap_us=0, holdoff_ms=50,
+                 mode=MODE_SINGLE, burst=3, held=None, clock=time):
+        self.out = out
+        self.ready = ready
+        self.on_fire = on_fire
+        self.width_us = width_us
+        # each shot is `count` pulses, checked here rather than in the IRQ
+        self.train = encode(count, width_us, gap_us)
+        self.holdoff_ms = holdoff_ms
+        self.mode = mode
+        self.burst = burst
+        self.held = held
+        self.clock = clock
+
+        # ticks_ms() of the last pulse, and whether there has been one
+        self.fired_ms = 0
+        self.fired = False
+        # shots still to come in this burst
+        self.remaining = 0
+        # ticks_ms() the charge came back after the last shot
+        self.charged_ms = 0
+        self.recharged = False
+
+        # (ticks_ms, recharge ms) per shot
+        self.log = array("I", [0] * (2 * LOG_SIZE))
+        self.log_pos = 0
+        self.log_count = 0
+
+        # pulses sent, edges refused (not ready or inside the hold-off)
+        self.pulses = 0
+        self.refused = 0
+
+        # edge -> pulse latency in us
+        self.histogram = array("H", [0] * BINS)
+        self.latency_last = 0
+        self.latency_max = 0
+
+    def holding_off(self):
+        clock = self.clock
+        return self.fired and clock.ticks_diff(clock.ticks_ms(), self.fired_ms) < self.holdoff_ms
+
+    def pulse(self):
+        # returns ticks_us() of the rising edge, or -1 if refused
+        if not self.ready() or self.holding_off():
+            self.refused += 1
+            return -1
+        clock = self.clock
+        edge = clock.ticks_us()
+        if not self.out.send(self.train):
+            # the PIO still has trains queued
+            self.refused += 1
+            return -1
+        # stamped after send() so it does not delay the pulse
+        trace(TR_PULSE)
+        now = clock.ticks_ms()
+        recharge = 0
+        if self.fired and self.recharged:
+            recharge = clock.ticks_diff(self.charged_ms, self.fired_ms)
+        i = self.log_pos
+        self.log[i] = now
+        self.log[i + 1] = recharge
+        self.log_pos = (i + 2) % (2 * LOG_SIZE)
+        if self.log_count < LOG_SIZE:
+            self.log_count += 1
+        self.fired_ms = now
+        self.fired = True
+        self.recharged = False
+        self.pulses += 1
+        return edge
+
+    def handler(self, pin):
+        # hard IRQ on the pulse button's rising edge
+        start = self.clock.ticks_us()
+        trace(TR_PULSE_IRQ)
+        edge = self.pulse()
+        if edge == -1:
+            return
+        latency = self.clock.ticks_diff(edge, start)
+        self.latency_last = latency
+        if latency > self.latency_max:
+            self.latency_max = latency
+        slot = latency // BIN_US
+        if slot >= BINS:
+            slot = BINS - 1
+        if self.histogram[slot] < 0xFFFF:
+            self.histogram[slot] += 1
+        if self.mode == MODE_BURST:
+            self.remaining = self.burst - 1
+        self.on_fire()
+
+    def fire(self):
+        # the same pulse from anywhere else, returns True if it went out
+        state = disable_irq()
+        edge = self.pulse()
+        enable_irq(state)
+        if edge == -1:
+            return False
+        self.on_fire()
+        return True
+
+    def busy(self):
+        # True while a burst or a held repeat wants more shots
+        if self.remaining:
+            return True
+        return self.mode == MODE_REPEAT and self.held is not None and self.held()
+
+    def again(self):
+        # the next shot of a repeat or a burst, if one is due
+        if self.mode == MODE_REPEAT:
+            if self.held is not None and self.held():
+                self.fire()
+        elif self.remaining and self.fire():
+            self.remaining -= 1
+
+    def charged(self):
+        # from the charge controller, the capacitor is full again
+        if self.fired and not self.recharged:
+            self.charged_ms = self.clock.ticks_ms()
+            self.recharged = True
+        self.again()
+
+    def poll(self):
+        # from the main loop, catches a repeat that charged() could not fire
+        if self.ready() and not self.holding_off():
+            self.again()
+
+    def cancel(self):
+        # drop the rest of a burst
+        self.remaining = 0
+
+    def shots(self):
+        # the shot log oldest first, as (ticks_ms, recharge ms) pairs
+        out = []
+        n = self.log_count
+        i = (self.log_pos - 2 * n) % (2 * LOG_SIZE)
+        for _ in range(n):
+            out.append((self.log[i], self.log[i + 1]))
+            i = (i + 2) % (2 * LOG_SIZE)
+        return out
+
+    def reset_counters(self):
+        for i in range(BINS):
+            self.histogram[i] = 0
+        self.pulses = 0
+        self.refused = 0
+        self.latency_last = 0
+        self.latency_max = 0
+        self.log_pos = 0
+        self.log_count = 0
+
+    def report(self):
+        # print the latency histogram, one bar per bin
+        total = 0
+        for count in self.histogram:
+            total += count
+        print("edge -> pulse latency, %d pulses, %d refused, max %d us" % (
+            self.pulses, self.refused, self.latency_max))
+        for i in range(BINS):
+            count = self.histogram[i]
+            if i == BINS - 1:
+                label = ">=%d" % (i * BIN_US)
+            else:
+                label = "%d-%d" % (i * BIN_US, (i + 1) * BIN_US - 1)
+            bar = "#" * (40 * count // total) if total else ""
+            print("%9s us %5d %s" % (label, count, bar))
+
+        # then the shots, with the rate they came out at
+        shots = self.shots()
+        print("%s mode, last %d shots:" % (MODE_NAMES[self.mode], len(shots)))
+        recharged = 0
+        recharge_total = 0
+        for i in range(len(shots)):
+            t, recharge = shots[i]
+            gap = self.clock.ticks_diff(t, shots[i - 1][0]) if i else 0
+            if recharge:
+                recharged += 1
+                recharge_total += recharge
+            print("%10d ms  +%6d ms  recharge %5d ms" % (t, gap, recharge))
+        if len(shots) > 1:
+            span = self.clock.ticks_diff(shots[-1][0], shots[0][0])
+            if span > 0:
+                print("%d.%02d shots/s" % ((len(shots) - 1) * 1000 // span,
+                                           (len(shots) - 1) * 100000 // span % 100))
+        if recharged:
+            print("mean recharge %d ms" % (recharge_total // recharged))
@@ -0,0 +1,156 @@
+# HV gate pulse trains
+#
+# The gate pulse used to be pulseOut.high(); sleep_us(5); pulseOut.low()
+# from Python, so its width moved with GC pauses, IRQs and the other
+# core's bus traffic.  PioPulser hands it to a PIO state machine at FREQ,
+# which times every edge to the cycle (0.1 us) whatever the CPU is doing.
+#
+# A train is described by one 32-bit word, built and checked by encode():
+#
+#    bits  0-3    count - 1                     1..COUNT_MAX pulses
+#    bits  4-17   high cycles - HIGH_CYCLES     width of each pulse
+#    bits 18-31   low cycles - LOW_CYCLES       gap between pulses
+#
+# HIGH_CYCLES and LOW_CYCLES are the instructions around each delay loop
+# in the program below, so the widths come out exact rather than a few
+# cycles long.  The gap also follows the last pulse of a train, so
+# trains queued back to back stay at least gap_us apart.
+#
+# SoftPulser has the same send() / pending() and runs the same word from
+# Python with sleep_us(), to the microsecond at best.  It is what pulser()
+# gives without rp2, so PulseTrigger and the descriptors run unchanged on
+# the host (utilities/pulsegen_check.py checks both against the PIO
+# program's cycle counts).  send() is IRQ-safe on both.
+#
+# The PIO takes over the pin's function but not its pad settings, so the
+# drive strength and slew rate poked into the pad register stay.
+#
+# Example:
+#    out = pulser(Pin(10, Pin.OUT))
+#    out.send(encode(3, width_us=5, gap_us=100))   # three 5 us pulses
+#    out.pending()                                 # trains not done yet
+
+import time
+
+try:
+    import rp2
+except ImportError:
+    rp2 = None
+
+FREQ = 10000000
+CYCLES_PER_US = FREQ // 1000000
+COUNT_MAX = 16
+FIELD_MAX = 0x3FFF
+HIGH_CYCLES = 3
+LOW_CYCLES = 4
+# trains in flight, kept below the RX FIFO depth so no completion is lost
+QUEUE = 3
+
+
+def encode(count=1, width_us=5, gap_us=0):
+    # the descriptor word for `count` pulses of width_us, gap_us apart
+    if not 1 <= count <= COUNT_MAX:
+        raise ValueError("pulse count %d not in 1..%d" % (count, COUNT_MAX))
+    high = int(width_us * CYCLES_PER_US + 0.5) - HIGH_CYCLES
+    if not 0 <= high <= FIELD_MAX:
+        raise ValueError("pulse width %s us not in %s..%s" % (
+            width_us, HIGH_CYCLES / CYCLES_PER_US, (FIELD_MAX + HIGH_CYCLES) / CYCLES_PER_US))
+    low = int(gap_us * CYCLES_PER_US + 0.5) - LOW_CYCLES
+    if low < 0 and count == 1:
+        # nothing to space out, the shortest tail will do
+        low = 0
+    if not 0 <= low <= FIELD_MAX:
+        raise ValueError("pulse gap %s us not in %s..%s" % (
+            gap_us, LOW_CYCLES / CYCLES_PER_US, (FIELD_MAX + LOW_CYCLES) / CYCLES_PER_US))
+    return low << 18 | high << 4 | (count - 1)
+
+
+def decode(word):
+    # (count, high cycles, low cycles) as the PIO program produces them
+    return ((word & 0xF) + 1, (word >> 4 & FIELD_MAX) + HIGH_CYCLES,
+            (word >> 18 & FIELD_MAX) + LOW_CYCLES)
+
+
+def duration_us(word):
+    # from the first rising edge to the end of the last gap
+    count, high, low = decode(word)
+    return count * (high + low) // CYCLES_PER_US
+
+
+if rp2 is not None:
+    @rp2.asm_pio(set_init=rp2.PIO.OUT_LOW, out_shiftdir=rp2.PIO.SHIFT_RIGHT)
+    def _train():
+        pull(block)
+        out(x, 4)                   # count - 1
+        out(isr, 14)                # high cycles - HIGH_CYCLES
+        label("pulse")
+        set(pins, 1)
+        mov(y, isr)
+        label("high")
+        jmp(y_dec, "high")
+        set(pins, 0)
+        mov(y, osr)                 # the rest of the word, low cycles - LOW_CYCLES
+        label("low")
+        jmp(y_dec, "low")
+        jmp(x_dec, "pulse")
+        push(noblock)               # the train is done
+
+
+class PioPulser:
+    def __init__(self, pin, sm_id=0):
+        self.sm = rp2.StateMachine(sm_id, _train, freq=FREQ, set_base=pin)
+        self.sm.active(1)
+        # trains queued and trains reported done
+        self.sent = 0
+        self.done = 0
+
+    def send(self, word):
+        # queue a train, False if QUEUE are already in flight
+        if self.pending() >= QUEUE:
+            return False
+        self.sm.put(word)
+        self.sent += 1
+        return True
+
+    def pending(self):
+        # trains queued or still going out
+        sm = self.sm
+        while sm.rx_fifo():
+            sm.get()
+            self.done += 1
+        return self.sent - self.done
+
+
+class SoftPulser:
+    def __init__(self, pin, clock=time):
+        self.pin = pin
+        self.clock = clock
+        self.sent = 0
+
+    def send(self, word):
+        # the whole train, before returning
+        pin = self.pin
+        sleep_us = self.clock.sleep_us
+        count = (word & 0xF) + 1
+        high = ((word >> 4 & FIELD_MAX) + HIGH_CYCLES) // CYCLES_PER_US
+        low = ((word >> 18 & FIELD_MAX) + LOW_CYCLES) // CYCLES_PER_US
+        while True:
+            pin.high()
+            sleep_us(high)
+            pin.low()
+            count -= 1
+            if not count:
+                break
+            sleep_us(low)
+        self.sent += 1
+        return True
+
+    def pending(self):
+        return 0
+
+
+def pulser(pin, sm_id=0, clock=time):
+    # PioPulser on the RP2040, SoftPulser elsewhere
+    if rp2 is None:
+        return SoftPulser(pin, clock)
+    return PioPulser(pin, sm_id)
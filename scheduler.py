@@ -0,0 +1,141 @@
+# Fixed-rate frame scheduler for the animation thread
+#
+# Frames are laid out on a fixed grid of 1000 // fps ms from the moment an
+# effect starts.  step() sleeps until the next slot, so render and
+# np.write() time come out of the sleep instead of adding to it.  If a
+# frame starts after its slot it counts as late; if whole slots have gone
+# by, those frames are skipped (never the last frame of a one-shot) and
+# counted as dropped.  An effect with a `times` array (baked.Baked) sets
+# its own frame times instead, in ms from the start; frames whose time
+# has passed are skipped the same way.
+#
+# interrupt, if given, is polled every SLICE_MS while step() sleeps; once
+# it returns True the sleep is cut short and step() returns without
+# drawing, so whoever owns the scheduler can switch effects within a
+# slice instead of after a long frame.  idle() is the wait for when there
+# is nothing to draw: it sleeps until interrupt() says something changed
+# (or for IDLE_MS without one), so the core is not kept spinning.
+#
+# While the Renderer has a dither fraction left (fb.fractional), every
+# full slice of a sleep also ends in fb.refresh(), so levels between two
+# LED steps keep alternating between frames and while idle.
+#
+# Example:
+#    sched = FrameScheduler(fb, interrupt=lambda: fsm.seq != shown_seq)
+#    sched.play(Wipe(fb, (10, 0, 0)), then=Breathing(fb, (10, 0, 0), 20))
+#    while True:
+#        if not sched.step():
+#            sched.idle()
+
+import time
+
+SLICE_MS = 10
+IDLE_MS = 1000
+
+
+class FrameScheduler:
+    def __init__(self, fb, clock=time, interrupt=None):
+        self.fb = fb
+        self.clock = clock
+        self.interrupt = interrupt
+        self.effect = None
+        self.then = None
+        self.period = 0
+        self.frame_no = 0
+        self.start = 0
+
+        # frames rendered, frames that started after their slot, skipped slots
+        self.frames = 0
+        self.late = 0
+        self.dropped = 0
+
+    def play(self, effect, then=None):
+        # start effect now, `then` takes over when a one-shot effect finishes
+        self.effect = effect
+        self.then = then
+        self.period = 1000 // effect.fps
+        self.frame_no = 0
+        self.start = self.clock.ticks_ms()
+
+    def stop(self):
+        self.effect = None
+        self.then = None
+
+    def reset_counters(self):
+        self.frames = 0
+        self.late = 0
+        self.dropped = 0
+
+    def sleep(self, ms):
+        # sleep ms, returns False if interrupt() cut it short
+        clock = self.clock
+        interrupt = self.interrupt
+        fb = self.fb
+        if interrupt is None and not fb.fractional:
+            clock.sleep_ms(ms)
+            return True
+        end = clock.ticks_add(clock.ticks_ms(), ms)
+        while interrupt is None or not interrupt():
+            left = clock.ticks_diff(end, clock.ticks_ms())
+            if left <= 0:
+                return True
+            if left < SLICE_MS:
+                clock.sleep_ms(left)
+            else:
+                clock.sleep_ms(SLICE_MS)
+                fb.refresh()
+        return False
+
+    def idle(self):
+        # nothing to draw, wait for interrupt()
+        self.sleep(IDLE_MS)
+
+    def step(self):
+        # wait for the next frame slot, then render and commit it
+        # returns False when there is nothing left to draw
+        effect = self.effect
+        if effect is None:
+            return False
+
+        clock = self.clock
+        period = self.period
+        frame_no = self.frame_no
+
+        times = effect.times
+        t = times[frame_no] if times is not None else frame_no * period
+        due = clock.ticks_add(self.start, t)
+        wait = clock.ticks_diff(due, clock.ticks_ms())
+        if wait > 0:
+            if not self.sleep(wait):
+                # interrupted, let the owner pick the next effect
+                return True
+        elif wait < 0:
+            if times is not None:
+                # up to the last frame whose time has come
+                behind = 0
+                while (frame_no + behind + 1 < effect.frames
+                       and times[frame_no + behind + 1] <= t - wait):
+                    behind += 1
+            else:
+                behind = -wait // period
+                if effect.frames and frame_no + behind >= effect.frames:
+                    behind = effect.frames - 1 - frame_no
+            if behind > 0:
+                self.dropped += behind
+                frame_no += behind
+            else:
+                self.late += 1
+
+        fb = self.fb
+        fb.begin()
+        effect.render(frame_no, times[frame_no] if times is not None else frame_no * period)
+        fb.commit()
+        self.frames += 1
+        self.frame_no = frame_no + 1
+
+        if effect.frames and self.frame_no >= effect.frames:
+            if self.then is not None:
+                self.play(self.then)
+            else:
+                self.effect = None
+        return True
@@ -0,0 +1,87 @@
+# Precomputed integer lookup tables for the LED effects
+#
+# The RP2040 has no FPU, so everything that used to call math.sin or
+# branch through wheel() on every frame is computed once here at import
+# time.  All tables are bytearrays indexed by a 0-255 phase.
+#
+#    WHEEL       256 RGB triples (768 bytes), the rainbow colour wheel
+#    SINE        256 entries of (sin(2*pi*i/256) + 1) / 2 * 255
+#
+# breath_curve() builds a breathing curve for a given period and peak.
+#
+# Effects draw at the full 0-255 range; brightness and gamma are applied
+# once per frame by the Renderer through a table from gamma_table(): the
+# LED level for each input, peaking at `peak`, in 8.8 fixed point so the
+# fraction can be dithered.  An input whose half step either side takes
+# in a whole LED level gets exactly that level, so a flat colour at one
+# of them never needs dithering; up where one input step spans more than
+# one LED level that is every input.  whole=True rounds every entry to a
+# whole level, for a table that must never cost a dither write (low
+# power).  level() goes the other way, the input that comes out at a
+# given LED level through a full table, for colours that are meant to be
+# dim.
+
+import math
+from array import array
+
+low_power_brightness = 0.05
+
+# low_power_brightness as an integer scale out of 256
+LOW_POWER_SCALE = int(low_power_brightness * 256 + 0.5)
+
+GAMMA = 2.2
+
+
+def _wheel(pos):
+    # Generate rainbow colors across 0-255 positions.
+    if pos < 85:
+        return (pos * 3, 255 - pos * 3, 0)
+    elif pos < 170:
+        pos -= 85
+        return (255 - pos * 3, 0, pos * 3)
+    else:
+        pos -= 170
+        return (0, pos * 3, 255 - pos * 3)
+
+
+def breath_curve(steps, peak=255):
+    # one full breath over `steps` frames, starting at half brightness
+    curve = bytearray(steps)
+    for i in range(steps):
+        curve[i] = int((math.sin(i / steps * 2 * math.pi) + 1) / 2 * peak)
+    return curve
+
+
+def gamma_table(peak=255, gamma=GAMMA, whole=False):
+    # 256 LED levels in 8.8 fixed point, built at boot, never per frame
+    table = array("H", [0] * 256)
+    for i in range(256):
+        v = (i / 255) ** gamma * peak
+        if whole:
+            table[i] = int(v + 0.5) << 8
+            continue
+        whole_level = int(v + 0.5)
+        low = (max(i - 0.5, 0) / 255) ** gamma * peak
+        high = (min(i + 0.5, 255) / 255) ** gamma * peak
+        if low <= whole_level <= high:
+            table[i] = whole_level << 8
+        else:
+            table[i] = int(v * 256 + 0.5)
+    return table
+
+
+def level(led, gamma=GAMMA):
+    # the input that a full table turns into exactly LED level `led`, for
+    # the dim levels where an input step is less than one LED level
+    return int((led / 255) ** (1 / gamma) * 255 + 0.5)
+
+
+SINE = bytearray(256)
+WHEEL = bytearray(768)
+
+for _i in range(256):
+    SINE[_i] = int((math.sin(_i / 256 * 2 * math.pi) + 1) / 2 * 255)
+    for _c, _v in enumerate(_wheel(_i)):
+        WHEEL[3 * _i + _c] = _v
+
+del _i, _c, _v
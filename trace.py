@@ -0,0 +1,106 @@
+# Event tracing into a preallocated ring buffer
+#
+# trace(evt, arg) stores one (event, ticks_us) pair in a fixed array('I')
+# and never allocates, so it can be called from IRQ handlers and the I2S
+# callback.  The event word is the event id in the low byte and a small
+# argument (button, state, ...) above it.  Once the ring is full the
+# oldest pairs are overwritten.  The two cores can trace at the same time
+# without a lock; at worst a pair is lost.
+#
+# From the REPL:
+#    import trace
+#    trace.dump()                # hex, paste it into a file on the host
+#    trace.save("trace.bin")     # or write it to flash and copy it off
+# then on the host:
+#    python utilities/trace_decode.py trace.bin
+#
+# Both forms are "TRC1", the number of pairs, then the pairs oldest first,
+# all little-endian uint32.
+
+import struct
+from array import array
+
+try:
+    from micropython import native
+except ImportError:
+    def native(f):
+        return f
+
+try:
+    from time import ticks_us
+except ImportError:
+    ticks_us = None
+
+# event ids
+TR_UPDATE = 1        # main loop update()
+TR_BUTTON = 2        # button IRQ, arg: 0 low power, 1 wakeup, 2 chord, 3 arm switch
+TR_STATE = 3         # state machine transition, arg: new state
+TR_PULSE_IRQ = 4     # pulse button IRQ entered
+TR_PULSE = 5         # HV pulse rising edge
+TR_PLAY = 6          # WavPlayer.play()
+TR_I2S = 7           # I2S callback entered
+TR_FIRST_SAMPLE = 8  # first samples of a play() handed to I2S
+TR_FRAME = 9         # LED frame render started
+TR_WRITE = 10        # np.write() started
+TR_WRITTEN = 11      # np.write() returned
+
+NAMES = (None, "update", "button", "state", "pulse irq", "pulse", "play", "i2s",
+         "first sample", "frame", "write", "written")
+
+MAGIC = b"TRC1"
+SIZE = 512
+
+buf = array("I", [0] * (2 * SIZE))
+pos = 0
+count = 0
+
+if ticks_us is not None:
+    @native
+    def trace(evt, arg=0):
+        global pos, count
+        i = pos
+        buf[i] = evt | (arg << 8)
+        buf[i + 1] = ticks_us()
+        i += 2
+        if i >= 2 * SIZE:
+            i = 0
+        pos = i
+        if count < SIZE:
+            count += 1
+else:
+    def trace(evt, arg=0):
+        # no ticks_us(): host tools import the instrumented modules
+        pass
+
+
+def clear():
+    global pos, count
+    pos = 0
+    count = 0
+
+
+def pairs():
+    # the recorded words, oldest first
+    start = (pos - 2 * count) % (2 * SIZE)
+    out = array("I")
+    for k in range(2 * count):
+        out.append(buf[(start + k) % (2 * SIZE)])
+    return out
+
+
+def encode():
+    words = pairs()
+    return MAGIC + struct.pack("<I", len(words) // 2) + bytes(words)
+
+
+def dump(width=64):
+    # print the trace as hex lines
+    import binascii
+    data = binascii.hexlify(encode())
+    for i in range(0, len(data), width):
+        print(data[i:i + width].decode())
+
+
+def save(path="trace.bin"):
+    with open(path, "wb") as f:
+        f.write(encode())
@@ -0,0 +1,81 @@
+"""Round-trip the shipped sounds through IMA-ADPCM and compare to the PCM.
+
+Every WAV in ../sounds is encoded with wav2adpcm, written to a temporary
+file, and decoded again through adpcm.decode() in the chunk sizes
+WavPlayer reads (whole blocks that fit its 10000 byte sample buffer).
+
+The decoded samples must match what the encoder predicted sample for
+sample (plus at most the one padding sample of the last block).  The
+signal-to-noise ratio against the original PCM and the worst sample error
+are printed for each file; these are a property of 4-bit ADPCM on these
+harsh 8 kHz sounds, so the check only fails below MIN_SNR_DB.  Exits
+non-zero on any failure.
+
+    python adpcm_check.py
+"""
+
+import glob
+import math
+import os
+import struct
+import sys
+import tempfile
+
+from wav2adpcm import ROOT, read_pcm, write_adpcm
+
+import adpcm
+
+MIN_SNR_DB = 10.0
+SAMPLE_BUFFER = 10000
+ADPCM_BUFFER = 2560
+
+
+def decode_file(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    block_align = struct.unpack("<H", data[32:34])[0]
+    start = data.find(b"data") + 8
+    encoded = memoryview(data)[start:]
+    per_block = adpcm.block_samples(block_align)
+    step = min(ADPCM_BUFFER // block_align, SAMPLE_BUFFER // (2 * per_block)) * block_align
+
+    out = bytearray(SAMPLE_BUFFER)
+    pcm = bytearray()
+    for pos in range(0, len(encoded), step):
+        chunk = encoded[pos:pos + step]
+        n = adpcm.decode(chunk, len(chunk), out, block_align)
+        pcm += out[:n]
+    return list(struct.unpack("<%dh" % (len(pcm) // 2), pcm))
+
+
+def snr(reference, decoded):
+    signal = sum(s * s for s in reference) or 1
+    noise = sum((a - b) ** 2 for a, b in zip(reference, decoded)) or 1
+    return 10 * math.log10(signal / noise)
+
+
+def main():
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        print("%-18s %8s %8s %9s" % ("file", "samples", "SNR dB", "max err"))
+        for path in sorted(glob.glob(os.path.join(ROOT, "sounds", "*.wav"))):
+            name = os.path.basename(path)
+            samples, rate = read_pcm(path)
+            expected = []
+            write_adpcm(os.path.join(tmp, name), samples, rate, decoded=expected)
+            decoded = decode_file(os.path.join(tmp, name))
+
+            db = snr(samples, decoded)
+            worst = max(abs(a - b) for a, b in zip(samples, decoded))
+            ok = (decoded[:len(samples)] == expected
+                  and len(decoded) - len(samples) in (0, 1) and db >= MIN_SNR_DB)
+            failures += not ok
+            print("%-18s %8d %8.1f %9d%s" % (name, len(decoded), db, worst,
+                                             "" if ok else "  FAIL"))
+    if failures:
+        print("%d files failed" % failures)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
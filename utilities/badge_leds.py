@@ -0,0 +1,74 @@
+"""The badge's LED strip and effects, for the host tools.
+
+Shared by bake_anim.py, which bakes frame files for the badge, and the
+benchmarks (bench_render.py, bench_tables.py, bench_sim.py), so a
+benchmark edit cannot change what gets baked:
+
+    LED_GROUPS  main.py's led_groups, 1-based LED numbers per group
+    PIXELS      LEDs on the strip
+    NeoPixel    a stand-in for MicroPython's neopixel.NeoPixel: the same
+                buffer layout and __setitem__, write() only counts
+    EFFECTS     (name, make) for every animation effect, make(animations,
+                fb) builds it the way main.py does; Reactive follows
+                sweep() in place of an envelope
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+LED_GROUPS = [
+    [28, 67, 29, 66], [27, 65], [26, 64], [25, 61, 30, 68],
+    [24, 62, 31, 69], [23, 63, 32, 70], [22, 60], [21, 59, 33, 71],
+    [20, 58, 34, 72], [19, 57, 35, 73], [18, 56], [17, 53, 36, 74],
+    [16, 54, 37, 75], [15, 55, 38, 76], [14, 52], [13, 51],
+    [12, 50], [11, 49], [10, 48], [9, 47], [8, 46], [7, 45],
+    [6, 44], [5, 43], [4, 42], [3, 41], [2, 40], [1, 39]
+]
+
+PIXELS = 76
+
+
+class NeoPixel:
+    """Same buffer layout and __setitem__ as MicroPython's neopixel.py."""
+
+    ORDER = (1, 0, 2, 3)
+
+    def __init__(self, n, bpp=3):
+        self.n = n
+        self.bpp = bpp
+        self.buf = bytearray(n * bpp)
+        self.writes = 0
+
+    def __setitem__(self, i, v):
+        offset = i * self.bpp
+        for i in range(self.bpp):
+            self.buf[offset + self.ORDER[i]] = v[i]
+
+    def write(self):
+        self.writes += 1
+
+
+def sweep():
+    # a stand-in for an envelope: the level steps up 5 a frame and wraps
+    level = [0]
+
+    def read():
+        level[0] = (level[0] + 5) & 255
+        return level[0]
+    return read
+
+
+EFFECTS = (
+    ("startup", lambda a, fb: a.Startup(fb)),
+    ("wipe", lambda a, fb: a.Wipe(fb, a.RED_LOW)),
+    ("firing", lambda a, fb: a.Firing(fb)),
+    ("breathing", lambda a, fb: a.Breathing(fb, a.RED_LOW, 20)),
+    ("blink", lambda a, fb: a.Blink(fb, a.RED_LOW)),
+    ("chase", lambda a, fb: a.Chase(fb)),
+    ("rainbow", lambda a, fb: a.Rainbow(fb)),
+    ("twinkle", lambda a, fb: a.Twinkle(fb)),
+    ("wave", lambda a, fb: a.Wave(fb)),
+    ("reactive", lambda a, fb: a.Reactive(fb, sweep())),
+)
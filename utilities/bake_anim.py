@@ -0,0 +1,103 @@
+"""Bake deterministic LED effects into frame files for baked.Baked.
+
+Each effect is rendered frame by frame through ledrender.Renderer, the
+way the FrameScheduler drives it on the badge, and every frame's pixel
+buffer (76 x 3 bytes, in the strip's wire order) is kept.  Runs of
+identical frames are merged into one frame shown for longer, so a held
+last frame costs nothing.  Frames are baked through a linear table
+without dither, so they hold the effect's own colours; the badge applies
+gamma and brightness as it loads each one, like any other frame.  The
+file layout is the one baked.py reads:
+
+    "ANIM"  uint16 version  uint16 frames  uint16 pixels  uint8 bpp  pad
+    frames * uint16 ms, then frames * pixels * bpp bytes
+
+Effects are named as in badge_leds.py.  One-shot effects bake their own
+frames; effects that run forever need --frames.  Twinkle is random and
+bakes to one fixed sequence.
+
+Run from the utilities directory:
+    python bake_anim.py [effect ...] [--frames N] [--out DIR]
+
+effects default to startup and firing, DIR to ../frames, which
+flash-all.py copies to the badge when it exists.
+"""
+
+import argparse
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from wav2adpcm import ROOT
+
+import animations
+from badge_leds import EFFECTS, LED_GROUPS, PIXELS, NeoPixel
+from baked import ANIM_HEADER, ANIM_MAGIC, ANIM_VERSION
+from ledrender import Renderer
+from tables import gamma_table
+MAX_MS = 0xFFFF
+
+
+def bake(make, frames=None):
+    # (frames rendered, delays, frame buffers), identical frames merged
+    np = NeoPixel(PIXELS)
+    fb = Renderer(np, LED_GROUPS, lut=gamma_table(255, 1.0), dither=False)
+    effect = make(animations, fb)
+    count = effect.frames or frames
+    if not count:
+        raise ValueError("runs forever, give --frames")
+    period = 1000 // effect.fps
+    delays = []
+    out = []
+    for frame_no in range(count):
+        fb.begin()
+        effect.render(frame_no, frame_no * period)
+        fb.commit(force=True)
+        frame = bytes(np.buf)
+        if out and frame == out[-1] and delays[-1] + period <= MAX_MS:
+            delays[-1] += period
+        else:
+            out.append(frame)
+            delays.append(period)
+    return count, delays, out
+
+
+def write(path, delays, frames):
+    with open(path, "wb") as f:
+        f.write(struct.pack(ANIM_HEADER, ANIM_MAGIC, ANIM_VERSION, len(frames), PIXELS, 3))
+        f.write(struct.pack("<%dH" % len(delays), *delays))
+        for frame in frames:
+            f.write(frame)
+    return os.path.getsize(path)
+
+
+def main():
+    names = [name for name, _ in EFFECTS]
+    parser = argparse.ArgumentParser(description="bake LED effects into frame files")
+    parser.add_argument("effects", nargs="*", default=["startup", "firing"],
+                        help=" ".join(names))
+    parser.add_argument("--frames", type=int, help="frames for effects that run forever")
+    parser.add_argument("--out", default=os.path.join(ROOT, "frames"))
+    args = parser.parse_args()
+    for name in args.effects:
+        if name not in names:
+            parser.error("unknown effect %r" % name)
+
+    os.makedirs(args.out, exist_ok=True)
+    print("%-10s %8s %8s %8s %8s" % ("effect", "rendered", "frames", "ms", "bytes"))
+    for name, make in EFFECTS:
+        if name not in args.effects:
+            continue
+        try:
+            rendered, delays, frames = bake(make, args.frames)
+        except ValueError as e:
+            parser.error("%s: %s" % (name, e))
+        path = os.path.join(args.out, name + ".anim")
+        size = write(path, delays, frames)
+        print("%-10s %8d %8d %8d %8d" % (name, rendered, len(frames), sum(delays), size))
+
+
+if __name__ == "__main__":
+    main()
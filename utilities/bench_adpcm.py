@@ -0,0 +1,61 @@
+"""Host-side throughput of the IMA-ADPCM decoder.
+
+Encodes the shipped sounds with wav2adpcm and decodes them through
+adpcm.decode() in WavPlayer-sized reads, printing decoded samples per
+second, the time one refill (the blocks that fit the 10000 byte sample
+buffer) takes against the time it lasts at 8 kHz, and the flash bytes
+read per refill before and after.
+
+The host runs the plain Python fallback of decode_block(); on the RP2040
+the viper version is used, so take the ratios, not the absolute times,
+from this.
+
+Run from the utilities directory:
+    python bench_adpcm.py [rounds]
+"""
+
+import glob
+import os
+import sys
+import time
+
+from wav2adpcm import BLOCK_ALIGN, ROOT, encode, read_pcm
+
+import adpcm
+
+SAMPLE_BUFFER = 10000
+RATE = 8000
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    data = bytearray()
+    for path in sorted(glob.glob(os.path.join(ROOT, "sounds", "*.wav"))):
+        data += encode(read_pcm(path)[0])
+
+    per_block = adpcm.block_samples(BLOCK_ALIGN)
+    blocks = min(2560 // BLOCK_ALIGN, SAMPLE_BUFFER // (2 * per_block))
+    step = blocks * BLOCK_ALIGN
+    out = bytearray(SAMPLE_BUFFER)
+    mv = memoryview(data)
+
+    samples = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for pos in range(0, len(data), step):
+            chunk = mv[pos:pos + step]
+            samples += adpcm.decode(chunk, len(chunk), out, BLOCK_ALIGN) // 2
+    elapsed = time.perf_counter() - start
+
+    refill = blocks * per_block
+    refill_us = elapsed / samples * refill * 1e6
+    budget_us = refill * 1e6 / RATE
+    print("decoded %d samples in %.2f s: %.0f samples/s (%.0fx real time)"
+          % (samples, elapsed, samples / elapsed, samples / elapsed / RATE))
+    print("refill: %d blocks, %d samples, %.0f us to decode, lasts %.0f us (%.1f%%)"
+          % (blocks, refill, refill_us, budget_us, 100 * refill_us / budget_us))
+    print("flash read per refill: %d bytes ADPCM vs %d bytes PCM" % (step, 2 * refill))
+
+
+if __name__ == "__main__":
+    main()
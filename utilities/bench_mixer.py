@@ -0,0 +1,72 @@
+"""Host-side cost of mixer.Mixer per I2S callback.
+
+Mixes one callback's worth of samples (the WavPlayer buffer, 5000 samples
+= 10000 bytes) from the shipped sounds with 0..N overlay voices on top of
+the primary stream, and prints the time per callback against the time
+that chunk takes to play at 8 kHz.  The last column is how many voices
+would fit in that budget at the measured per-voice cost.
+
+The host runs the plain Python fallback of mix_voice(); on the RP2040 the
+viper version is used, so take the per-voice ratio, not the absolute
+times, from this.
+
+Run from the utilities directory:
+    python bench_mixer.py [voices] [rounds]
+"""
+
+import os
+import sys
+import time
+import wave
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT)
+
+from mixer import Mixer
+
+SAMPLES = 5000
+RATE = 8000
+SOUNDS = ("arm.wav", "blaster.wav", "pew-small.wav", "tesla.wav", "boom.wav")
+
+
+def load(name):
+    with wave.open(os.path.join(ROOT, "sounds", name)) as w:
+        return w.readframes(w.getnframes())
+
+
+def per_callback(clips, voices, rounds):
+    mx = Mixer(max(voices, 1), SAMPLES)
+    primary = clips[0][:2 * SAMPLES]
+    primary += bytes(2 * SAMPLES - len(primary))
+    elapsed = 0
+    for _ in range(rounds):
+        mx.stop()
+        for v in range(voices):
+            clip = clips[1 + v % (len(clips) - 1)]
+            # repeat short clips so every voice covers the whole chunk
+            mx.add(clip * (2 * SAMPLES // len(clip) + 1), 192)
+        start = time.perf_counter()
+        mx.mix(primary, SAMPLES)
+        elapsed += time.perf_counter() - start
+    return elapsed / rounds * 1e6
+
+
+def main():
+    voices = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    clips = [load(name) for name in SOUNDS]
+    budget = SAMPLES * 1e6 / RATE
+
+    base = per_callback(clips, 0, rounds)
+    print("callback budget: %d samples at %d Hz = %.0f us" % (SAMPLES, RATE, budget))
+    print("%-7s %12s %10s" % ("voices", "us/callback", "% budget"))
+    for n in range(voices + 1):
+        us = per_callback(clips, n, rounds) if n else base
+        print("%-7d %12.0f %9.1f%%" % (n, us, 100 * us / budget))
+    voice = (per_callback(clips, voices, rounds) - base) / max(voices, 1)
+    print("primary copy %.0f us, %.0f us per voice, %d voices fit in the budget"
+          % (base, voice, max(0, int((budget - base) / voice))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""Host-side benchmark for the LED render path.
+
+Compares the original per-LED tuple path (np[led-1] = colour for every LED)
+against ledrender.Renderer, which writes group colours straight into
+np.buf.  Reports time per frame and the peak transient heap use of a
+frame for each low-power effect, then the np.write() calls per frame on
+each path, how many of them carry the dither between frames (refreshes
+at the scheduler's slice rate) and how many frames the renderer's
+unchanged-frame check saved.
+
+Run from the utilities directory:
+    python bench_render.py [frames]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+import animations
+from badge_leds import LED_GROUPS, PIXELS, NeoPixel
+from ledrender import Renderer
+from scheduler import SLICE_MS
+from tables import LOW_POWER_SCALE, gamma_table
+
+# ---- the original main.py effects, minus the sleeps ----
+
+def legacy_effects(np):
+    import math
+    import random
+
+    low_power_brightness = 0.05
+    state = {"loop_counter": 0}
+
+    def scale_color(color, factor):
+        return tuple(int(c * factor) for c in color)
+
+    def wheel(pos):
+        if pos < 85:
+            return (pos * 3, 255 - pos * 3, 0)
+        elif pos < 170:
+            pos -= 85
+            return (255 - pos * 3, 0, pos * 3)
+        else:
+            pos -= 170
+            return (0, pos * 3, 255 - pos * 3)
+
+    def set_all_leds(color):
+        for group in LED_GROUPS:
+            for led in group:
+                np[led-1] = color
+        np.write()
+
+    def rainbow_cycle():
+        loop_counter = state["loop_counter"] % 256
+        for i in range(len(LED_GROUPS)):
+            pixel_index = (i * 256 // len(LED_GROUPS)) + loop_counter
+            color = wheel(pixel_index & 255)
+            scaled_color = scale_color(color, low_power_brightness)
+            for led in LED_GROUPS[i]:
+                np[led - 1] = scaled_color
+        np.write()
+        state["loop_counter"] = loop_counter + 1
+
+    def chase_animation():
+        loop_counter = state["loop_counter"] % len(LED_GROUPS)
+        set_all_leds((0, 0, 0))
+        for j in range(5):
+            group_index = (loop_counter + j) % len(LED_GROUPS)
+            color = wheel((group_index * 256 // len(LED_GROUPS)) & 255)
+            scaled_color = scale_color(color, low_power_brightness)
+            for led in LED_GROUPS[group_index]:
+                np[led - 1] = scaled_color
+        np.write()
+        state["loop_counter"] = loop_counter + 1
+
+    def twinkle_effect():
+        set_all_leds((0, 0, 0))
+        for _ in range(10):
+            group_index = random.randint(0, len(LED_GROUPS) - 1)
+            color = wheel((group_index * 256 // len(LED_GROUPS)) & 255)
+            scaled_color = scale_color(color, low_power_brightness)
+            for led in LED_GROUPS[group_index]:
+                np[led - 1] = scaled_color
+        np.write()
+
+    def breathing_effect(colour=(0, 10, 0), max_brightness=50):
+        # the sine is of main.py's global `brightness`, which stayed 0, so
+        # every frame came out the same
+        brightness = 0
+        loop_counter = state["loop_counter"] % max_brightness
+        brightness_factor = (math.sin(brightness / max_brightness * 2 * math.pi) + 1) / 2
+        adjusted_color = tuple(int(c * brightness_factor) for c in colour)
+        set_all_leds(adjusted_color)
+        state["loop_counter"] = loop_counter + 1
+
+    def wave_pattern():
+        loop_counter = state["loop_counter"] % 255
+        for i in range(len(LED_GROUPS)):
+            wave_value = (math.sin(i / 10.0 + loop_counter / 10.0) + 1) / 2 * 255
+            color = (int(wave_value), 0, 255 - int(wave_value))
+            scaled_color = scale_color(color, low_power_brightness)
+            for led in LED_GROUPS[i]:
+                np[led - 1] = scaled_color
+        np.write()
+        state["loop_counter"] = loop_counter + 1
+
+    return {
+        "rainbow": rainbow_cycle,
+        "chase": chase_animation,
+        "twinkle": twinkle_effect,
+        "wave": wave_pattern,
+        "breathing": breathing_effect,
+    }
+
+
+def renderer_effects(np):
+    fb = Renderer(np, LED_GROUPS)
+    # the low power effects go through main.py's low power table
+    low_power = gamma_table(255 * LOW_POWER_SCALE >> 8, whole=True)
+    state = {"frame_no": 0}
+
+    def counted(effect, lut):
+        def step(refresh=False):
+            if fb.lut is not lut:
+                fb.set_lut(lut)
+            fb.begin()
+            effect.render(state["frame_no"], 0)
+            fb.commit()
+            state["frame_no"] += 1
+            if refresh:
+                # what FrameScheduler.sleep() does until the next frame
+                for _ in range(1000 // effect.fps // SLICE_MS - 1):
+                    fb.refresh()
+        return step
+
+    return fb, {
+        "rainbow": counted(animations.Rainbow(fb), low_power),
+        "chase": counted(animations.Chase(fb), low_power),
+        "twinkle": counted(animations.Twinkle(fb), low_power),
+        "wave": counted(animations.Wave(fb), low_power),
+        "breathing": counted(animations.Breathing(fb, (0, 10, 0)), fb.lut),
+    }
+
+
+def measure(step, frames):
+    for _ in range(10):
+        step()
+    start = time.perf_counter()
+    for _ in range(frames):
+        step()
+    elapsed = time.perf_counter() - start
+
+    # transient heap use per frame: peak traced memory above the baseline
+    tracemalloc.start()
+    transient = 0
+    for _ in range(100):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        step()
+        transient = max(transient, tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+
+    return elapsed / frames * 1e6, transient
+
+
+def writes(make, name, frames):
+    # np.write() calls per frame, dither writes among them, frames saved
+    np = NeoPixel(PIXELS)
+    made = make(np)
+    if not isinstance(made, tuple):
+        for _ in range(frames):
+            made[name]()
+        return np.writes / frames, 0, 0
+    fb, steps = made
+    for _ in range(frames):
+        steps[name](refresh=True)
+    return np.writes / frames, fb.refreshes / frames, fb.writes_saved
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    legacy = legacy_effects(NeoPixel(PIXELS))
+    fast = renderer_effects(NeoPixel(PIXELS))[1]
+
+    print("%-9s %11s %12s %8s %14s %14s" % (
+        "effect", "before us", "after us", "speedup", "heap B before", "heap B after"))
+    names = ("rainbow", "chase", "twinkle", "wave", "breathing")
+    for name in names:
+        t0, a0 = measure(legacy[name], frames)
+        t1, a1 = measure(fast[name], frames)
+        print("%-9s %11.1f %12.1f %7.2fx %14d %14d" % (
+            name, t0, t1, t0 / t1, a0, a1))
+
+    print()
+    print("%-9s %14s %14s %14s %14s" % (
+        "effect", "writes before", "writes after", "of them dither", "writes saved"))
+    for name in names:
+        w0, _, _ = writes(legacy_effects, name, 200)
+        w1, dither, saved = writes(renderer_effects, name, 200)
+        print("%-9s %14.2f %14.2f %14.2f %10d/200" % (name, w0, w1, dither, saved))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""Benchmarks on the host simulator (see sim/__init__.py).
+
+Three parts, all on the virtual clock:
+
+  effects   each animation effect alone under FrameScheduler: the frame
+            rate it asks for against the rate it gets, late and dropped
+            frames, np.write() calls, writes the renderer skipped and
+            the extra writes that carry the dither between frames
+  audio     every clip played back to back through WavPlayer, then the
+            three firing sounds mixed, with the Rainbow effect running on
+            the second thread: I2S callbacks, underruns, worst gap
+  strip     each effect rendered flat out, into the blocking NeoPixel
+            and into ledout.DoubleStrip, whose transfer overlaps the next
+            frame's render: frames per second on each and the gain
+  session   main.py itself through a scripted session (startup, arm,
+            pulses, low power, the sound chord, disarm, a held pulse
+            button): state machine latency, trace percentiles per path,
+            the pulse histogram and shot log and what was written to the
+            LEDs and I2S.  The HV pulses go through SoftPulser, so their
+            widths carry the CPU model's cost and are flagged as such;
+            pulsegen_check.py checks the PIO program's exact timing
+
+The CPU model is a fixed cost per line of Python (--line-us).  The
+default of 3 us is a rough figure for MicroPython on the RP2040; it
+puts the render and mixer costs in the right ballpark, not more.  The
+mixer and ADPCM decoder run their plain Python fallbacks here, which are
+slower than the viper versions on the device.  Pin IRQ handlers run as
+interrupts at no CPU cost, so the pulse histogram only shows the pulse's
+own timing.
+
+Run from the utilities directory:
+    python bench_sim.py [effects|audio|strip|session] [--seconds S] [--line-us N]
+"""
+
+import argparse
+import os
+import sys
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import trace_decode
+from badge_leds import EFFECTS, LED_GROUPS, PIXELS
+from sim import BADGE, Script, Sim, run_main
+
+
+# run through the low power table, as main.py does
+LOW_POWER_EFFECTS = ("chase", "rainbow", "twinkle", "wave", "reactive")
+FIRING = ("pew-small.wav", "tesla.wav", "blaster.wav")
+PARTS = ("effects", "audio", "strip", "session")
+# the charge sense reads empty for this long after an HV pulse, about
+# what charge_sim.py gives for the charge controller
+RECHARGE_MS = 700
+
+
+def leds(double=False):
+    # the badge's strip and renderer, inside an installed Sim
+    import neopixel
+    from ledout import DoubleStrip
+    from ledrender import Renderer
+    from machine import Pin
+    pin = Pin(BADGE.NEOPIXEL)
+    if double:
+        return Renderer(DoubleStrip(neopixel.Port(pin), PIXELS), LED_GROUPS)
+    return Renderer(neopixel.NeoPixel(pin, PIXELS), LED_GROUPS)
+
+
+def bench_effects(seconds, line_us):
+    print("%-10s %6s %8s %6s %8s %7s %7s %7s" % (
+        "effect", "target", "fps", "late", "dropped", "writes", "saved", "dither"))
+    for name, make in EFFECTS:
+        sim = Sim(line_us=line_us, end_ms=seconds * 1000)
+        sim.install()
+        try:
+            import animations
+            import time
+            from scheduler import FrameScheduler
+            from tables import LOW_POWER_SCALE, gamma_table
+            fb = leds()
+            if name in LOW_POWER_EFFECTS:
+                fb.set_lut(gamma_table(255 * LOW_POWER_SCALE >> 8, whole=True))
+            sched = FrameScheduler(fb)
+            effect = make(animations, fb)
+            span = [0, 0]
+
+            def body():
+                span[0] = time.ticks_us()
+                sched.play(effect)
+                while sched.step():
+                    span[1] = time.ticks_us()
+                span[1] = time.ticks_us()
+
+            sim.run(body)
+        finally:
+            sim.uninstall()
+        if effect.frames:
+            # a one-shot effect is timed from its first frame to its last
+            fps = (sched.frames - 1) * 1e6 / (span[1] - span[0])
+        else:
+            fps = sched.frames / seconds
+        print("%-10s %6d %8.1f %6d %8d %7d %7d %7d" % (
+            name, effect.fps, fps, sched.late, sched.dropped,
+            fb.writes, fb.writes_saved, fb.refreshes))
+
+
+def bench_audio(seconds, line_us):
+    sim = Sim(line_us=line_us, end_ms=seconds * 1000)
+    sim.install()
+    try:
+        import _thread
+        import animations
+        import time
+        from machine import Pin
+        from scheduler import FrameScheduler
+        from wavplayer import WavPlayer
+        flash = sim.use_flash()
+        clips = [f for f in flash.listdir("/") if f.endswith(".wav")]
+        sched = FrameScheduler(leds())
+        marks = []
+
+        def animate():
+            sched.play(animations.Rainbow(sched.fb))
+            while sched.step():
+                pass
+
+        def body():
+            wp = WavPlayer(id=0, sck_pin=Pin(20), ws_pin=Pin(21), sd_pin=Pin(19),
+                           ibuf=2000, cache_bytes=40000, voices=3)
+            for song in FIRING:
+                wp.preload(song)
+            _thread.start_new_thread(animate, ())
+
+            marks.append(len(sim.recorder.underruns))
+            for clip in clips:
+                wp.enqueue(clip)
+            while wp.isplaying():
+                time.sleep_ms(10)
+
+            marks.append(len(sim.recorder.underruns))
+            for song in FIRING:
+                wp.play(song)
+                time.sleep_ms(100)
+            while wp.isplaying():
+                time.sleep_ms(10)
+            marks.append(len(sim.recorder.underruns))
+            # stop the animation thread too
+            sim.clock.end_us = sim.clock.now()
+
+        sim.run(body)
+    finally:
+        sim.uninstall()
+
+    rec = sim.recorder
+    marks += [len(rec.underruns)] * (3 - len(marks))
+    print("%d clips, %.1f s of audio in %d writes, %d callbacks" % (
+        len(clips), len(rec.audio) / 16000, len(rec.writes), rec.callbacks))
+    for label, first, last in (("back to back", marks[0], marks[1]),
+                               ("firing mixed", marks[1], marks[2])):
+        gaps = [gap for _, gap in rec.underruns[first:last]]
+        print("%-13s underruns %3d  worst gap %6d us" % (
+            label, len(gaps), max(gaps) if gaps else 0))
+    print("LEDs meanwhile: %d frames, %d late, %d dropped" % (
+        sched.frames, sched.late, sched.dropped))
+
+
+def bench_strip(seconds, line_us):
+    print("%-10s %9s %9s %7s %12s" % ("effect", "blocking", "double", "gain", "waited us"))
+    for name, make in EFFECTS:
+        fps = []
+        for double in (False, True):
+            sim = Sim(line_us=line_us, end_ms=seconds * 1000)
+            sim.install()
+            try:
+                import animations
+                fb = leds(double)
+                effect = make(animations, fb)
+                count = [0]
+
+                def body():
+                    # every frame forced out, as fast as it renders
+                    period = 1000 // effect.fps
+                    while True:
+                        frame_no = count[0] % effect.frames if effect.frames else count[0]
+                        fb.begin()
+                        effect.render(frame_no, frame_no * period)
+                        fb.commit(force=True)
+                        count[0] += 1
+
+                sim.run(body)
+            finally:
+                sim.uninstall()
+            fps.append(count[0] / seconds)
+        np = fb.np
+        print("%-10s %9.1f %9.1f %6.0f%% %12d" % (
+            name, fps[0], fps[1], 100 * (fps[1] / fps[0] - 1),
+            np.wait_us // max(np.waits, 1)))
+
+
+def session():
+    # times in ms
+    s = Script()
+    s.set(3000, BADGE.ARM, 1)
+    s.press(4000, BADGE.PULSE)
+    s.press(5000, BADGE.PULSE)
+    s.press(5100, BADGE.PULSE)          # still recharging
+    s.set(6000, BADGE.CHARGED, 1)
+    s.press(6500, BADGE.PULSE)          # not charged
+    s.set(7000, BADGE.CHARGED, 0)
+    s.bounce(8000, BADGE.ARM, 0)
+    s.press(9000, BADGE.LOW_POWER)
+    s.press(10000, BADGE.LOW_POWER)
+    s.press(11000, BADGE.WAKEUP)
+    s.press(12000, BADGE.LOW_POWER)     # the sound on/off chord
+    s.press(12010, BADGE.WAKEUP)
+    s.press(18000, BADGE.LOW_POWER)     # once nosound.wav has played
+    s.press(18010, BADGE.WAKEUP)
+    s.bounce(27500, BADGE.ARM, 1)       # soundon.wav is 8.5 s long
+    s.press(28500, BADGE.PULSE, 1400)   # held, repeats as it recharges
+    return s
+
+
+def recharging(sim):
+    # the charge sense: the script's CHARGED level, but empty for
+    # RECHARGE_MS after every HV pulse
+    def read():
+        now = sim.clock.now()
+        for t, pin, level in reversed(sim.recorder.edges):
+            if pin == BADGE.PULSE_OUT and level:
+                if now - t < RECHARGE_MS * 1000:
+                    return 65535
+                break
+        return 65535 if sim.pin(BADGE.CHARGED).level else 0
+    return read
+
+
+def bench_session(seconds, line_us):
+    def setup(sim):
+        # room for the whole run in the trace ring
+        import trace
+        trace.SIZE = 16384
+        trace.buf = array("I", [0] * (2 * trace.SIZE))
+        sim.analog[BADGE.CHARGED] = recharging(sim)
+
+    sim, ns = run_main(seconds, session(), line_us=line_us, setup=setup)
+    rec = sim.recorder
+    fsm = ns["fsm"]
+    print("state machine: %d transitions, latency mean %d us, max %d us, %d ignored" % (
+        fsm.latency_count, fsm.latency_total // max(fsm.latency_count, 1),
+        fsm.latency_max, fsm.ignored))
+
+    events = trace_decode.parse(sim.modules["trace"].encode())
+    print("%-18s %6s %8s %8s %8s %8s" % ("path (us)", "n", "p50", "p90", "p99", "max"))
+    for name, start, end in trace_decode.PATHS:
+        values = trace_decode.latencies(events, start, end)
+        if not values:
+            print("%-18s %6d" % (name, 0))
+            continue
+        pct = trace_decode.percentile
+        print("%-18s %6d %8d %8d %8d %8d" % (
+            name, len(values), pct(values, 50), pct(values, 90), pct(values, 99),
+            max(values)))
+    print()
+
+    ns["trigger"].report()
+    widths = [w for _, w in rec.pulses(BADGE.PULSE_OUT)]
+    print("HV pulses on GPIO%d: %d, widths %s us" % (
+        BADGE.PULSE_OUT, len(widths), sorted(set(widths))))
+    if type(ns["pulseGen"]).__name__ == "SoftPulser":
+        # there is no rp2 here, so the pulses are timed from Python
+        print("  NOT the badge's widths: SoftPulser pays the per-line cost on every edge,"
+              " the badge's PioPulser gives exactly %g us (see pulsegen_check.py)"
+              % ns["trigger"].width_us)
+    print("LED frames written: %d (%.1f per second)" % (len(rec.frames), len(rec.frames) / seconds))
+    for th in sim.clock.started:
+        print("thread %s busy %.1f%%" % (th.name, th.busy / (seconds * 1e4)))
+    gaps = [gap for _, gap in rec.underruns]
+    print("audio: %.1f s written, %d underruns, worst gap %d us" % (
+        len(rec.audio) / 16000, len(gaps), max(gaps) if gaps else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks on the host simulator")
+    parser.add_argument("parts", nargs="*", default=PARTS, help=" ".join(PARTS))
+    parser.add_argument("--seconds", type=float, help="virtual seconds per run")
+    parser.add_argument("--line-us", type=float, default=3,
+                        help="virtual microseconds per line of Python")
+    args = parser.parse_args()
+    for part in args.parts:
+        if part not in PARTS:
+            parser.error("unknown part %r" % part)
+
+    for part in args.parts:
+        print("==== %s, %g us per line ====" % (part, args.line_us))
+        if part == "effects":
+            bench_effects(args.seconds or 5, args.line_us)
+        elif part == "audio":
+            bench_audio(args.seconds or 60, args.line_us)
+        elif part == "strip":
+            bench_strip(args.seconds or 2, args.line_us)
+        else:
+            bench_session(args.seconds or 30, args.line_us)
+        print()
+
+
+if __name__ == "__main__":
+    main()
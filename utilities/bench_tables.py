@@ -0,0 +1,120 @@
+"""Host-side frames-per-second comparison for the effect lookup tables.
+
+Runs each effect through ledrender.Renderer twice: once with the float
+wheel()/math.sin versions and once with the integer tables from tables.py,
+and prints the render rate in frames per second (no sleeps, np.write() is
+a no-op).  Absolute numbers are for the host CPU; the ratio is what
+matters, and it is larger on the RP2040 where every float op is soft-float.
+
+The float versions are main.py's code before tables.py.  Its breathing
+took the sine of the global `brightness`, which was never changed from
+0, so it drew the same colour every frame and the Renderer skipped all
+but the first; that is what is timed here.  The tables do not help
+everywhere: chase (five groups of a cleared frame) has too little float
+work to gain anything, and breathing comes out several times slower,
+as it now actually breathes, with a new colour to shade every frame.
+
+Run from the utilities directory:
+    python bench_tables.py [frames]
+"""
+
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+import animations
+import tables
+from badge_leds import LED_GROUPS, PIXELS, NeoPixel
+from ledrender import Renderer
+
+low_power_brightness = tables.low_power_brightness
+
+
+# ---- float versions of the effects, as they were before tables.py ----
+
+def wheel(pos):
+    if pos < 85:
+        return (pos * 3, 255 - pos * 3, 0)
+    elif pos < 170:
+        pos -= 85
+        return (255 - pos * 3, 0, pos * 3)
+    else:
+        pos -= 170
+        return (0, pos * 3, 255 - pos * 3)
+
+
+def set_group_dim(fb, i, color):
+    fb.set_group(i,
+                 int(color[0] * low_power_brightness),
+                 int(color[1] * low_power_brightness),
+                 int(color[2] * low_power_brightness))
+
+
+def float_rainbow(fb, counter):
+    for i in range(fb.groups):
+        set_group_dim(fb, i, wheel(((i * 256 // fb.groups) + counter) & 255))
+
+
+def float_chase(fb, counter):
+    fb.clear()
+    for j in range(5):
+        group_index = (counter + j) % fb.groups
+        set_group_dim(fb, group_index, wheel((group_index * 256 // fb.groups) & 255))
+
+
+def float_wave(fb, counter):
+    for i in range(fb.groups):
+        wave_value = int((math.sin(i / 10.0 + counter / 10.0) + 1) / 2 * 255)
+        set_group_dim(fb, i, (wave_value, 0, 255 - wave_value))
+
+
+def float_breathing(fb, counter, colour=(0, 10, 0), max_brightness=50):
+    # main.py's global `brightness` where the counter was meant to be
+    brightness = 0
+    brightness_factor = (math.sin(brightness / max_brightness * 2 * math.pi) + 1) / 2
+    fb.fill(int(colour[0] * brightness_factor),
+            int(colour[1] * brightness_factor),
+            int(colour[2] * brightness_factor))
+
+
+def table_effect(effect):
+    # the table version is an animations.Effect, built once per run
+    def frame(fb, counter):
+        if frame.effect is None:
+            frame.effect = effect(fb)
+        frame.effect.render(counter, 0)
+    frame.effect = None
+    return frame
+
+
+EFFECTS = [
+    ("rainbow", float_rainbow, animations.Rainbow, 256),
+    ("chase", float_chase, animations.Chase, len(LED_GROUPS)),
+    ("wave", float_wave, animations.Wave, 255),
+    ("breathing", float_breathing, lambda fb: animations.Breathing(fb, (0, 10, 0), 50), 50),
+]
+
+
+def fps(frame, modulo, frames):
+    fb = Renderer(NeoPixel(PIXELS), LED_GROUPS)
+    start = time.perf_counter()
+    for i in range(frames):
+        frame(fb, i % modulo)
+        fb.commit()
+    return frames / (time.perf_counter() - start)
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    print("%-10s %12s %12s %8s" % ("effect", "float fps", "table fps", "gain"))
+    for name, before, after, modulo in EFFECTS:
+        f0 = fps(before, modulo, frames)
+        f1 = fps(table_effect(after), modulo, frames)
+        print("%-10s %12.0f %12.0f %7.2fx" % (name, f0, f1, f1 / f0))
+
+
+if __name__ == "__main__":
+    main()
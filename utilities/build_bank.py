@@ -0,0 +1,101 @@
+"""Pack the sounds into one sound bank file for WavPlayer(bank=...).
+
+Every 16-bit mono WAV in ../sounds has leading and trailing silence
+(samples within SILENCE of zero) trimmed, is optionally encoded to
+IMA-ADPCM, and is appended to the bank.  The bank layout is the one
+wavplayer.load_bank() reads:
+
+    "WBNK"  uint16 version  uint16 count
+    count * (name[16], offset, length, audio_format, channels, rate,
+             bits, block_align)                   wavplayer.BANK_ENTRY
+    sample data, each clip starting on a 4 byte boundary
+
+Names keep their .wav extension, so wp.play("arm.wav") works unchanged.
+
+Run from the utilities directory:
+    python build_bank.py [--adpcm] [bank-file]
+
+bank-file defaults to ../sounds/sounds.bnk, which flash-all.py copies in
+place of the WAV files when it exists.
+"""
+
+import glob
+import os
+import struct
+import sys
+
+from wav2adpcm import BLOCK_ALIGN, ROOT, encode, read_pcm
+
+import adpcm
+
+# same as wavplayer.py, which cannot be imported here (it needs machine)
+BANK_MAGIC = b"WBNK"
+BANK_VERSION = 1
+BANK_ENTRY = "<16sIIHHIHH"
+
+SILENCE = 64
+
+
+def trim(samples, threshold=SILENCE):
+    # drop the quiet samples at both ends
+    start = 0
+    end = len(samples)
+    while start < end and abs(samples[start]) <= threshold:
+        start += 1
+    while end > start and abs(samples[end - 1]) <= threshold:
+        end -= 1
+    return samples[start:end]
+
+
+def build(paths, use_adpcm=False):
+    # returns (header, data) bytes and a report line per clip
+    clips = []
+    report = []
+    for path in paths:
+        name = os.path.basename(path)
+        if len(name.encode()) > 16:
+            raise ValueError("%s: name longer than 16 bytes" % name)
+        samples, rate = read_pcm(path)
+        trimmed = trim(samples)
+        if use_adpcm:
+            data = encode(trimmed)
+            fmt = (adpcm.WAVE_FORMAT_IMA_ADPCM, 1, rate, 16, BLOCK_ALIGN)
+        else:
+            data = struct.pack("<%dh" % len(trimmed), *trimmed)
+            fmt = (adpcm.WAVE_FORMAT_PCM, 1, rate, 16, 2)
+        clips.append((name, data, fmt))
+        report.append((name, len(samples), len(samples) - len(trimmed), len(data)))
+
+    base = 8 + len(clips) * struct.calcsize(BANK_ENTRY)
+    header = bytearray(struct.pack("<4sHH", BANK_MAGIC, BANK_VERSION, len(clips)))
+    data = bytearray()
+    for name, samples, fmt in clips:
+        data += bytes(-len(data) % 4)
+        header += struct.pack(BANK_ENTRY, name.encode(), base + len(data), len(samples), *fmt)
+        data += samples
+    return bytes(header), bytes(data), report
+
+
+def main():
+    args = sys.argv[1:]
+    use_adpcm = "--adpcm" in args
+    args = [a for a in args if a != "--adpcm"]
+    out = args[0] if args else os.path.join(ROOT, "sounds", "sounds.bnk")
+    paths = sorted(glob.glob(os.path.join(ROOT, "sounds", "*.wav")))
+
+    header, data, report = build(paths, use_adpcm)
+    with open(out, "wb") as f:
+        f.write(header)
+        f.write(data)
+
+    print("%-18s %8s %8s %8s" % ("clip", "samples", "trimmed", "bytes"))
+    source = 0
+    for name, samples, trimmed, size in report:
+        source += 2 * samples
+        print("%-18s %8d %8d %8d" % (name, samples, trimmed, size))
+    print("%d clips, %d bytes of samples -> %d byte bank %s"
+          % (len(report), source, len(header) + len(data), out))
+
+
+if __name__ == "__main__":
+    main()
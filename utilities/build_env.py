@@ -0,0 +1,80 @@
+"""Measure the loudness of every clip into an envelope file beside it.
+
+For each 16-bit mono WAV in ../sounds the RMS of every 1/RATE s step is
+taken and scaled so the clip's loudest step is 255, one byte per step.
+The file ("pew-small.wav" gets "pew-small.env") is the one envelope.py
+reads:
+
+    "WENV"  uint16 version  uint16 steps per second  uint16 steps
+    steps * uint8
+
+The badge looks the level up at the clip's playback position, so the
+envelope has to be measured on the samples that are actually played:
+give --bank when the badge plays from a sound bank, which has the
+silence at both ends trimmed (build_bank.py).
+
+Run from the utilities directory:
+    python build_env.py [--bank] [--rate N] [--out DIR]
+
+DIR defaults to ../sounds, flash-all.py copies the .env files from there.
+"""
+
+import argparse
+import glob
+import math
+import os
+import struct
+import sys
+
+from wav2adpcm import ROOT, read_pcm
+from build_bank import trim
+
+from envelope import ENV_HEADER, ENV_MAGIC, ENV_VERSION, env_name
+
+RATE = 50
+
+
+def envelope(samples, rate, steps_per_s=RATE):
+    # one byte per step, the RMS of the step scaled to the loudest one
+    step = max(1, rate // steps_per_s)
+    rms = []
+    for start in range(0, len(samples), step):
+        part = samples[start:start + step]
+        rms.append(math.sqrt(sum(v * v for v in part) / len(part)))
+    peak = max(rms + [1.0])
+    return bytes(int(v / peak * 255 + 0.5) for v in rms)
+
+
+def write(path, levels, steps_per_s=RATE):
+    with open(path, "wb") as f:
+        f.write(struct.pack(ENV_HEADER, ENV_MAGIC, ENV_VERSION, steps_per_s, len(levels)))
+        f.write(levels)
+    return os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="build envelope files for the sounds")
+    parser.add_argument("--bank", action="store_true",
+                        help="measure the clips trimmed, as in the sound bank")
+    parser.add_argument("--rate", type=int, default=RATE, help="steps per second")
+    parser.add_argument("--out", default=os.path.join(ROOT, "sounds"))
+    args = parser.parse_args()
+    if not 0 < args.rate <= 1000:
+        parser.error("--rate must be 1 to 1000")
+
+    os.makedirs(args.out, exist_ok=True)
+    print("%-18s %8s %8s %8s" % ("clip", "ms", "steps", "bytes"))
+    for path in sorted(glob.glob(os.path.join(ROOT, "sounds", "*.wav"))):
+        name = os.path.basename(path)
+        samples, rate = read_pcm(path)
+        if args.bank:
+            samples = trim(samples)
+        levels = envelope(samples, rate, args.rate)
+        if len(levels) > 0xFFFF:
+            sys.exit("%s: too long for an envelope at %d steps/s" % (name, args.rate))
+        size = write(os.path.join(args.out, env_name(name)), levels, args.rate)
+        print("%-18s %8d %8d %8d" % (name, len(samples) * 1000 // rate, len(levels), size))
+
+
+if __name__ == "__main__":
+    main()
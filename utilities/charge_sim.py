@@ -0,0 +1,208 @@
+"""Tune and regression-test charge.ChargeController against a capacitor model.
+
+CapModel stands in for both the PWM on the transformer and the ADC on the
+charge sense.  The energy on the capacitor (as V^2) grows by gain * t_on^2
+* freq, with the on-time capped where the core saturates, and leaks away
+with time constant tau_s.  gain is set so that the hand-tuned 2500 Hz /
+800 duty holds v_hold, and tau_s so that it recovers from empty in about
+2.5 s, as on the badge.  Swap in another model (or other constants) to
+retune; the controller only sees freq(), duty_u16() and read_u16().
+
+Each scenario is run with the fixed drive the badge used to have
+(boost = hold) and with the controller's defaults, on a virtual clock.
+The controller has to recharge clearly faster, settle on the hand-tuned
+drive once charged, not overshoot, and give up boosting when the sense
+never shows full, for good and before the capacitor gets much past what
+the fixed drive gives it.  After one bad contact on the sense it has to
+boost again once a few recharges at hold have shown the sense working.
+Exits non-zero on any failure.
+
+    python charge_sim.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+import charge
+from charge import ChargeController
+
+STEP_MS = 1
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def ticks_ms(self):
+        return self.now
+
+    def ticks_diff(self, a, b):
+        return a - b
+
+
+class Timer:
+    # the controller's periodic timer, fired by run()
+    def init(self, mode, period, callback):
+        self.period = period
+        self.callback = callback
+
+
+class CapModel:
+    def __init__(self, v_hold=250.0, tau_s=1.1, sense_v=300.0, t_sat_us=8.0):
+        self.tau = tau_s
+        self.sense_v = sense_v
+        self.t_sat = t_sat_us * 1e-6
+        self.gain = v_hold ** 2 / tau_s / (self.on_time(charge.DUTY_HOLD, charge.FREQ_HOLD) ** 2
+                                           * charge.FREQ_HOLD)
+        self.hz = 0
+        self.duty = 0
+        self.energy = 0.0
+        # drawn from the supply, and of that lost to saturation
+        self.drawn = 0.0
+        self.saturated = 0.0
+        self.peak = 0.0
+        # a bad contact on the sense, which then reads empty
+        self.loose = False
+
+    def on_time(self, duty, freq):
+        return duty / 65536 / freq
+
+    # PWM
+    def freq(self, hz):
+        self.hz = hz
+
+    def duty_u16(self, duty):
+        self.duty = duty
+
+    # ADC, active low
+    def read_u16(self):
+        if self.loose:
+            return 65535
+        return max(0, 65535 - int(self.volts() * 65535 / self.sense_v))
+
+    def volts(self):
+        return self.energy ** 0.5
+
+    def step(self, dt):
+        power = stored = 0.0
+        if self.duty and self.hz:
+            t_on = self.on_time(self.duty, self.hz)
+            power = self.gain * t_on * t_on * self.hz
+            stored = self.gain * min(t_on, self.t_sat) ** 2 * self.hz
+        self.drawn += power * dt
+        self.saturated += (power - stored) * dt
+        self.energy += (stored - self.energy / self.tau) * dt
+        self.peak = max(self.peak, self.volts())
+
+    def pulse(self, left=0.1):
+        # the HV pulse leaves `left` of the voltage behind
+        self.energy *= left * left
+
+
+def run(model, events, ms, **tuning):
+    # events: (time_ms, "on" | "off" | "pulse" | "loose" | "fixed"), returns
+    # the controller and
+    # the times at which the capacitor came up to charged
+    clock = Clock()
+    timer = Timer()
+    ctl = ChargeController(model, model, timer=timer, clock=clock, **tuning)
+    events = sorted(events)
+    charged_at = []
+    was = ctl.value()
+    for now in range(0, ms, STEP_MS):
+        clock.now = now
+        while events and events[0][0] <= now:
+            what = events.pop(0)[1]
+            if what == "on":
+                ctl.on()
+            elif what == "off":
+                ctl.off()
+            elif what in ("loose", "fixed"):
+                model.loose = what == "loose"
+            else:
+                model.pulse()
+        if now % timer.period == 0:
+            timer.callback(timer)
+            if ctl.value() and not was:
+                charged_at.append(now)
+            was = ctl.value()
+        model.step(STEP_MS / 1000)
+    return ctl, charged_at
+
+
+# the fixed drive takes 2.6 s to charge, which is no fault for it
+FIXED = dict(freq_boost=charge.FREQ_HOLD, duty_boost=charge.DUTY_HOLD,
+             max_boost_ms=1 << 30, boost_budget_ms=1 << 20)
+# no scenario may take the capacitor further past the fixed drive's peak
+PEAK_MARGIN = 1.15
+
+# name, model arguments, events, run time
+SCENARIOS = [
+    ("from empty", {}, [(0, "on")], 8000),
+    ("pulse every 4 s", {}, [(0, "on"), (5000, "pulse"), (9000, "pulse"), (13000, "pulse")], 18000),
+    # the sense reads a third of the voltage, so full is never seen
+    ("broken sense", {"sense_v": 900.0}, [(0, "on")], 10000),
+    # disarmed and armed again, the fault has to stay
+    ("broken, re-arm", {"sense_v": 900.0}, [(0, "on"), (3000, "off"), (3500, "on"),
+                                             (6000, "off"), (6100, "on")], 10000),
+    # one bad contact: a fault, then the boost is back after CLEAR_AFTER
+    # recharges at hold
+    ("bad contact", {}, [(0, "loose"), (0, "on"), (2500, "fixed"), (5000, "pulse"),
+                         (9000, "pulse"), (13000, "pulse"), (17000, "pulse")], 20000),
+]
+
+
+def main():
+    failures = 0
+    print("%-16s %-10s %8s %8s %8s %8s %6s %7s" % (
+        "scenario", "drive", "first ms", "rech ms", "peak V", "drawn", "sat %", "faults"))
+    for name, args, events, ms in SCENARIOS:
+        results = {}
+        for drive, tuning in (("fixed", FIXED), ("controller", {})):
+            model = CapModel(**args)
+            ctl, charged_at = run(model, events, ms, **tuning)
+            results[drive] = (model, ctl, charged_at)
+            first = charged_at[0] if charged_at else -1
+            recharge = ctl.recharge_max_ms if len(charged_at) > 1 else -1
+            saturated = max(0.0, 100 * model.saturated / max(model.drawn, 1))
+            print("%-16s %-10s %8d %8d %8.0f %8.0f %6.1f %7d" % (
+                name, drive, first, recharge, model.peak, model.drawn / 1000, saturated,
+                ctl.faults))
+
+        fixed, ctl_fixed, at_fixed = results["fixed"]
+        model, ctl, at = results["controller"]
+        problems = []
+        if model.peak > fixed.peak * PEAK_MARGIN:
+            problems.append("peak %.0f V against %.0f V" % (model.peak, fixed.peak))
+        if name.startswith("broken"):
+            if not ctl.fault or ctl.faults != 1 or ctl.duty != charge.DUTY_HOLD:
+                problems.append("did not fall back to hold for good")
+        elif name == "bad contact":
+            if ctl.fault or ctl.faults != 1:
+                problems.append("fault not cleared by recharges")
+            if ctl.recharge_last_ms > 0.6 * ctl_fixed.recharge_last_ms:
+                problems.append("last recharge not boosted")
+        else:
+            if not at or not at_fixed or at[0] > 0.6 * at_fixed[0]:
+                problems.append("first charge not faster")
+            if len(at) > 1 and ctl.recharge_max_ms > 0.6 * ctl_fixed.recharge_max_ms:
+                problems.append("recharge not faster")
+            if (ctl.duty, ctl.freq) != (charge.DUTY_HOLD, charge.FREQ_HOLD):
+                problems.append("steady drive %d at %d Hz" % (ctl.duty, ctl.freq))
+            if model.peak > fixed.peak * 1.02:
+                problems.append("overshoot to %.0f V" % model.peak)
+            if ctl.faults:
+                problems.append("faults")
+        if model.saturated > 0.01 * model.drawn:
+            problems.append("saturating")
+        for problem in problems:
+            print("  FAIL: %s" % problem)
+        failures += len(problems)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Run synthetic button edge sequences through debounce.Debouncer.
+
+Each scenario is a list of (time_ms, button, level) pin changes on a
+virtual clock.  Rising edges call the button's IRQ handler exactly as
+Pin.irq(trigger=IRQ_RISING) would, and the one-shot timer fires on the same
+clock.  The events the debouncer reports and its counters are checked
+against the expected outcome; exits non-zero on any mismatch.
+
+    python debounce_sim.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from debounce import Debouncer
+
+DEBOUNCE_MS = 50
+CHORD_MS = 50
+
+# name, edges, expected events, expected (bounces, rejected)
+SCENARIOS = [
+    ("clean press", [(0, 0, 1), (400, 0, 0)],
+     ["press 0"], (0, 0)),
+    ("bouncy press", [(0, 0, 1), (2, 0, 0), (5, 0, 1), (9, 0, 0), (12, 0, 1), (500, 0, 0)],
+     ["press 0"], (2, 0)),
+    ("glitch", [(0, 1, 1), (3, 1, 0)],
+     [], (0, 1)),
+    ("chord, same time", [(0, 0, 1), (1, 1, 1), (400, 0, 0), (400, 1, 0)],
+     ["chord"], (0, 0)),
+    ("chord, 80ms apart", [(0, 1, 1), (80, 0, 1), (600, 0, 0), (600, 1, 0)],
+     ["chord"], (0, 0)),
+    ("two presses, not a chord", [(0, 0, 1), (60, 0, 0), (300, 1, 1), (360, 1, 0)],
+     ["press 0", "press 1"], (0, 0)),
+    ("hold one, press the other", [(0, 0, 1), (400, 1, 1), (800, 0, 0), (800, 1, 0)],
+     ["press 0", "chord"], (0, 0)),
+    ("bouncy chord", [(0, 0, 1), (2, 0, 0), (4, 0, 1), (20, 1, 1), (21, 1, 0), (23, 1, 1),
+                      (700, 0, 0), (700, 1, 0)],
+     ["chord"], (2, 0)),
+]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def ticks_ms(self):
+        return self.now
+
+    def ticks_diff(self, a, b):
+        return a - b
+
+
+class Pin:
+    def __init__(self):
+        self.level = 0
+
+    def value(self):
+        return self.level
+
+
+class Timer:
+    """One-shot timer on the virtual clock."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.due = None
+        self.callback = None
+
+    def init(self, mode, period, callback):
+        self.due = self.clock.now + period
+        self.callback = callback
+
+    def deinit(self):
+        self.due = None
+
+
+def run(edges):
+    clock = Clock()
+    pins = (Pin(), Pin())
+    timer = Timer(clock)
+    events = []
+    buttons = Debouncer(pins, lambda i: events.append("press %d" % i),
+                        lambda: events.append("chord"),
+                        debounce_ms=DEBOUNCE_MS, chord_ms=CHORD_MS,
+                        timer=timer, clock=clock)
+
+    edges = sorted(edges)
+    end = edges[-1][0] + 1000
+    for t in range(end):
+        clock.now = t
+        for when, button, level in edges:
+            if when == t:
+                rising = level and not pins[button].level
+                pins[button].level = level
+                if rising:
+                    buttons.handlers[button](pins[button])
+        if timer.due is not None and timer.due <= t:
+            timer.due = None
+            timer.callback(timer)
+    return events, (buttons.bounces, buttons.rejected)
+
+
+def main():
+    failures = 0
+    for name, edges, expected, counters in SCENARIOS:
+        events, got = run(edges)
+        ok = events == expected and got == counters
+        failures += not ok
+        print("%-26s %-4s events=%s bounces=%d rejected=%d" % (
+            name, "ok" if ok else "FAIL", events, got[0], got[1]))
+    if failures:
+        print("%d scenarios failed" % failures)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -48,14 +48,36 @@ def copy_files(port):
     code_dir = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
     sounds_dir = os.path.join(code_dir, "sounds")
     
-    # Copy .wav files from /sounds directory
-    if os.path.exists(sounds_dir):
+    # Copy the sound bank if one was built (build_bank.py), otherwise the
+    # .wav files from /sounds directory
+    bank = os.path.join(sounds_dir, "sounds.bnk")
+    if os.path.exists(bank):
+        print(f"Copying {bank} to port {port}...")
+        subprocess.run(["mpremote.exe", "connect", port, "fs", "cp", bank, ":sounds.bnk"])
+    elif os.path.exists(sounds_dir):
         for file in os.listdir(sounds_dir):
             if file.endswith(".wav"):
                 file_path = os.path.join(sounds_dir, file)
                 print(f"Copying {file_path} to port {port}...")
                 subprocess.run(["mpremote.exe", "connect", port, "fs", "cp", file_path, f":{file}"])
     
+    # Copy the sound envelopes if they have been built (build_env.py)
+    if os.path.exists(sounds_dir):
+        for file in os.listdir(sounds_dir):
+            if file.endswith(".env"):
+                file_path = os.path.join(sounds_dir, file)
+                print(f"Copying {file_path} to port {port}...")
+                subprocess.run(["mpremote.exe", "connect", port, "fs", "cp", file_path, f":{file}"])
+
+    # Copy the baked LED animations if there are any (bake_anim.py)
+    frames_dir = os.path.join(code_dir, "frames")
+    if os.path.exists(frames_dir):
+        for file in os.listdir(frames_dir):
+            if file.endswith(".anim"):
+                file_path = os.path.join(frames_dir, file)
+                print(f"Copying {file_path} to port {port}...")
+                subprocess.run(["mpremote.exe", "connect", port, "fs", "cp", file_path, f":{file}"])
+
     # Copy .py files from parent directory
     for file in os.listdir(code_dir):
         if file.endswith(".py"):
@@ -0,0 +1,130 @@
+"""Replay an event trace through the raygun state machine on the host.
+
+Each line of a trace is one event, optionally with the arm switch level to
+set before it and the state expected afterwards:
+
+    ARM arm=1 -> Armed
+    FIRE -> Firing
+    LOW_POWER -> Low Power
+
+Events are posted through the IRQ path (post() then run_pending()), so the
+ring buffer and the latency counters are exercised too.  Lines starting
+with '#' are comments.  Without a file the built-in trace below is used.
+Exits non-zero if any expected state does not match.
+
+    python fsm_replay.py [trace-file]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+import fsm
+
+DEFAULT_TRACE = """
+# power on with the arm switch off
+DONE -> Disarmed
+PULSE -> Error
+DONE -> Disarmed
+ARM arm=1 -> Armed
+FIRE -> Firing
+DONE -> Armed
+# buttons cycle the low power animations
+LOW_POWER -> Low Power
+LOW_POWER -> Low Power
+ARM -> Low Power
+WAKEUP -> Armed
+# sound toggle comes back to where it started
+CHORD -> Sound Off
+LOW_POWER -> Sound Off
+DONE -> Armed
+TIMEOUT -> Low Power
+DISARM arm=0 -> Low Power
+WAKEUP -> Disarmed
+"""
+
+
+class HostClock:
+    """time.ticks_* on top of perf_counter_ns."""
+
+    def ticks_us(self):
+        return (time.perf_counter_ns() // 1000) & 0x3FFFFFFF
+
+    def ticks_ms(self):
+        return (time.perf_counter_ns() // 1000000) & 0x3FFFFFFF
+
+    def ticks_diff(self, a, b):
+        return ((a - b + 0x20000000) & 0x3FFFFFFF) - 0x20000000
+
+    def sleep_ms(self, ms):
+        time.sleep(ms / 1000)
+
+
+def parse(text):
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.split("#")[0].strip()
+        if not line:
+            continue
+        expect = None
+        if "->" in line:
+            line, expect = (part.strip() for part in line.split("->"))
+        words = line.split()
+        arm = None
+        for word in words[1:]:
+            if word.startswith("arm="):
+                arm = word[4:] == "1"
+        yield number, words[0], arm, expect
+
+
+def replay(text, out=sys.stdout):
+    switch = {"arm": False}
+    machine = fsm.StateMachine(lambda: switch["arm"], clock=HostClock())
+    failures = 0
+
+    for number, name, arm, expect in parse(text):
+        if arm is not None:
+            switch["arm"] = arm
+        event = fsm.EVENT_NAMES.index(name)
+        before = machine.state
+        seq = machine.seq
+        machine.post(event)
+        machine.run_pending()
+        after = fsm.STATE_NAMES[machine.state]
+
+        if machine.seq == seq:
+            result = "ignored"
+        else:
+            result = "%s -> %s" % (fsm.STATE_NAMES[before], after)
+            if machine.state == fsm.LOW_POWER:
+                result += " (animation %d)" % machine.low_power_mode
+
+        status = ""
+        if expect is not None and expect != after:
+            status = "  MISMATCH, expected %s" % expect
+            failures += 1
+        out.write("%4d %-10s %s%s\n" % (number, name, result, status))
+
+    count = machine.latency_count or 1
+    out.write("\n%d transitions, %d ignored, %d overflows\n" % (
+        machine.seq // 2, machine.ignored, machine.overflows))
+    out.write("post->transition latency: last %d us, mean %d us, max %d us\n" % (
+        machine.latency_last, machine.latency_total // count, machine.latency_max))
+    return failures
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            text = f.read()
+    else:
+        text = DEFAULT_TRACE
+    failures = replay(text)
+    if failures:
+        print("%d mismatches" % failures)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
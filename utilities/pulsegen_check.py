@@ -0,0 +1,183 @@
+"""Check pulsegen's descriptors and both backends on the host.
+
+Every descriptor on a grid of counts, widths and gaps is encoded and
+then stepped through the PIO program one instruction per cycle, as the
+state machine runs it (pio_edges() follows pulsegen._train line for
+line).  The edges must land exactly on the widths and gaps that were
+asked for, to the 0.1 us cycle.  Out-of-range descriptors must raise
+ValueError.
+
+The same trains then go through SoftPulser on the simulator, with no
+CPU cost and at --line-us per line of Python.  At no cost they must come
+out to the microsecond.  With a cost the widths and gaps stretch; that
+is what the PIO backend removes, so it is printed and not checked.
+Exits non-zero on any failure.
+
+Run from the utilities directory:
+    python pulsegen_check.py [--line-us N]
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+import pulsegen
+from pulsegen import CYCLES_PER_US, FIELD_MAX, encode, decode
+from sim import BADGE, Sim
+
+COUNTS = (1, 2, 3, 16)
+WIDTHS_US = (0.3, 1, 5, 5.5, 20, 1638.6)
+GAPS_US = (0, 0.4, 10, 100, 1638.7)
+
+BAD = (
+    dict(count=0),
+    dict(count=17),
+    dict(width_us=0.2),
+    dict(width_us=1638.7),
+    dict(count=2, gap_us=0.3),
+    dict(gap_us=1638.8),
+)
+
+# trains for the software backend, as (count, width_us, gap_us)
+SOFT = ((1, 5, 0), (3, 5, 100), (4, 20, 50))
+
+
+def pio_edges(word):
+    # (cycle, level) per pin change, and the cycles until the next pull
+    cycle = 1                               # pull(block)
+    x = word & 0xF                          # out(x, 4)
+    osr = word >> 4
+    cycle += 1
+    isr = osr & FIELD_MAX                   # out(isr, 14)
+    osr >>= 14
+    cycle += 1
+    edges = []
+    while True:
+        edges.append((cycle, 1))            # set(pins, 1)
+        cycle += 1
+        y = isr                             # mov(y, isr)
+        cycle += 1
+        while True:                         # jmp(y_dec, "high")
+            cycle += 1
+            if not y:
+                break
+            y -= 1
+        edges.append((cycle, 0))            # set(pins, 0)
+        cycle += 1
+        y = osr                             # mov(y, osr)
+        cycle += 1
+        while True:                         # jmp(y_dec, "low")
+            cycle += 1
+            if not y:
+                break
+            y -= 1
+        cycle += 1                          # jmp(x_dec, "pulse")
+        if not x:
+            break
+        x -= 1
+    cycle += 1                              # push(noblock)
+    return edges, cycle
+
+
+def spans(edges):
+    # (high, low) lengths between successive edges, in edge units
+    highs = [edges[i + 1][0] - edges[i][0] for i in range(0, len(edges), 2)]
+    lows = [edges[i + 1][0] - edges[i][0] for i in range(1, len(edges) - 1, 2)]
+    return highs, lows
+
+
+def check_pio():
+    failures = 0
+    checked = 0
+    for count in COUNTS:
+        for width in WIDTHS_US:
+            for gap in GAPS_US:
+                try:
+                    word = encode(count, width, gap)
+                except ValueError:
+                    if count > 1 and gap < 0.4:
+                        continue
+                    print("  FAIL: encode(%d, %s, %s) refused" % (count, width, gap))
+                    failures += 1
+                    continue
+                edges, _ = pio_edges(word)
+                highs, lows = spans(edges)
+                want_high = round(width * CYCLES_PER_US)
+                want_low = round(gap * CYCLES_PER_US)
+                problems = []
+                if len(highs) != count or decode(word)[0] != count:
+                    problems.append("%d pulses" % len(highs))
+                if set(highs) != {want_high} or decode(word)[1] != want_high:
+                    problems.append("high %s cycles" % sorted(set(highs)))
+                if lows and (set(lows) != {want_low} or decode(word)[2] != want_low):
+                    problems.append("low %s cycles" % sorted(set(lows)))
+                for problem in problems:
+                    print("  FAIL: encode(%d, %s, %s): %s" % (count, width, gap, problem))
+                failures += len(problems)
+                checked += 1
+    for args in BAD:
+        try:
+            encode(**args)
+        except ValueError:
+            continue
+        print("  FAIL: encode(%s) accepted" % ", ".join("%s=%s" % kv for kv in args.items()))
+        failures += 1
+    print("PIO program: %d descriptors exact to the cycle, %d bad ones refused" % (
+        checked, len(BAD)))
+    return failures
+
+
+def soft_pulses(line_us):
+    # what SoftPulser put on the pin for each of SOFT, in us
+    sim = Sim(line_us=line_us)
+    sim.install()
+    try:
+        from machine import Pin
+        from pulsegen import SoftPulser
+        out = SoftPulser(Pin(BADGE.PULSE_OUT, Pin.OUT))
+        marks = []
+
+        def body():
+            for count, width, gap in SOFT:
+                marks.append(len(sim.recorder.edges))
+                out.send(encode(count, width, gap))
+            marks.append(len(sim.recorder.edges))
+
+        sim.run(body)
+    finally:
+        sim.uninstall()
+    edges = sim.recorder.edges
+    return [spans([(t, level) for t, _, level in edges[a:b]])
+            for a, b in zip(marks, marks[1:])]
+
+
+def check_soft(line_us):
+    failures = 0
+    print("%-16s %8s %14s %14s" % ("SoftPulser", "us/line", "high us", "low us"))
+    for cost in (0, line_us):
+        for (count, width, gap), (highs, lows) in zip(SOFT, soft_pulses(cost)):
+            label = "%d x %g / %g" % (count, width, gap)
+            print("%-16s %8g %14s %14s" % (
+                label, cost, "%d-%d" % (min(highs), max(highs)),
+                "%d-%d" % (min(lows), max(lows)) if lows else "-"))
+            if cost == 0 and (len(highs) != count or set(highs) != {width}
+                              or (lows and set(lows) != {gap})):
+                print("  FAIL: not exact with no CPU cost")
+                failures += 1
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pulsegen descriptor and backend checks")
+    parser.add_argument("--line-us", type=float, default=3,
+                        help="virtual microseconds per line of Python")
+    args = parser.parse_args()
+    failures = check_pio() + check_soft(args.line_us)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Run the badge firmware on the host, on a virtual clock.
+
+Stand-ins for machine (Pin, Signal, ADC, PWM, Timer, I2S, mem32), neopixel,
+utime/time, _thread and micropython are swapped into sys.modules, and
+the badge modules are imported on top of them.  Time only moves when
+the code sleeps or runs Python lines (see clock.py), so a run of
+main.py is repeatable and takes no longer than the host needs.
+
+A Script drives the inputs (buttons, arm switch, charged signal) at
+set times.  The Recorder keeps every LED frame, every edge on an output
+pin and every byte sent to I2S, plus the I2S underruns.
+
+    from sim import Script, BADGE, run_main
+    script = Script()
+    script.set(500, BADGE.ARM, 1)
+    script.press(1500, BADGE.PULSE)
+    sim, ns = run_main(5, script)
+    print(len(sim.recorder.frames), sim.recorder.pulses(BADGE.PULSE_OUT))
+
+bench_sim.py in utilities is the benchmark suite built on this.
+"""
+
+import os
+
+from .core import REPO, Flash, Sim
+from .recorder import Recorder
+
+
+class BADGE:
+    # GPIOs as main.py uses them
+    PULSE = 3
+    ARM = 4
+    LOW_POWER = 9
+    PULSE_OUT = 10
+    HV_PWM = 12
+    WAKEUP = 15
+    CHARGED = 26
+    NEOPIXEL = 29
+
+    # input level while pressed / switched on / charged
+    ACTIVE = {PULSE: 1, ARM: 1, LOW_POWER: 0, WAKEUP: 0, CHARGED: 0}
+
+
+class Script:
+    """Input changes at given times, in ms from the start of the run."""
+
+    def __init__(self):
+        self.changes = []
+
+    def set(self, t_ms, pin, level):
+        self.changes.append((t_ms, pin, level))
+        return self
+
+    def press(self, t_ms, pin, ms=100):
+        # a clean press and release of a button
+        active = BADGE.ACTIVE.get(pin, 1)
+        self.set(t_ms, pin, active)
+        return self.set(t_ms + ms, pin, 1 - active)
+
+    def bounce(self, t_ms, pin, level, edges=6, gap_us=300):
+        # contact chatter settling on `level`
+        for i in range(edges):
+            at = t_ms + i * gap_us / 1000
+            self.set(at, pin, level if (edges - i) % 2 else 1 - level)
+        return self
+
+    def apply(self, sim):
+        for t_ms, pin, level in self.changes:
+            sim.clock.add_event(int(t_ms * 1000), sim.drive, pin, level)
+
+
+def run_main(seconds, script=None, line_us=1, setup=None, path=None):
+    """Run main.py for `seconds` of virtual time.
+
+    setup(sim), if given, runs just before main.py starts, with the fake
+    modules installed.  Returns the Sim (with its recorder and the badge
+    modules in sim.modules) and main.py's globals.
+    """
+    if path is None:
+        path = os.path.join(REPO, "main.py")
+    with open(path) as f:
+        code = compile(f.read(), path, "exec")
+    namespace = {"__name__": "__main__", "__file__": path}
+    sim = Sim(line_us=line_us, end_ms=seconds * 1000)
+    sim.install()
+    try:
+        sim.use_flash()
+        if script is not None:
+            script.apply(sim)
+        if setup is not None:
+            setup(sim)
+        sim.run(exec, code, namespace)
+    finally:
+        sim.uninstall()
+    return sim, namespace
@@ -0,0 +1,69 @@
+"""Fake _thread: threads and locks on the virtual clock.
+
+Anything else is taken from the host's _thread module.
+"""
+
+import _thread as _real
+
+from . import core
+
+
+def start_new_thread(func, args, kwargs=None):
+    name = getattr(func, "__name__", None)
+    if kwargs:
+        core.active.clock.spawn(lambda: func(*args, **kwargs), name=name)
+    else:
+        core.active.clock.spawn(func, tuple(args), name)
+
+
+def exit():
+    raise SystemExit
+
+
+def get_ident():
+    th = core.active.clock.current()
+    return th.order if th is not None else 0
+
+
+def stack_size(size=0):
+    return 0
+
+
+class LockType:
+    # spins on the virtual clock, so the holder gets to run and let go
+    def __init__(self):
+        self.held = False
+
+    def acquire(self, waitflag=1, timeout=-1):
+        clock = core.active.clock
+        waited = 0
+        while self.held:
+            if not waitflag or (timeout >= 0 and waited >= timeout * 1000000):
+                return False
+            clock.sleep_us(1)
+            waited += 1
+        self.held = True
+        return True
+
+    def release(self):
+        if not self.held:
+            raise RuntimeError("release unlocked lock")
+        self.held = False
+
+    def locked(self):
+        return self.held
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def allocate_lock():
+    return LockType()
+
+
+def __getattr__(name):
+    return getattr(_real, name)
@@ -0,0 +1,338 @@
+"""Virtual clock and cooperative threads for the simulator.
+
+Every simulated thread (the main program and anything started with
+_thread.start_new_thread) is a real Python thread, but only the one that
+holds the token runs.  Each keeps its own virtual time in microseconds.
+Sleeping, and reading the clock while another thread or an event is due
+earlier, hands the token to whichever thread or event comes first, so runs
+are repeatable.
+
+Events are timer expiries, I2S completions and scripted pin changes.
+They run like interrupts, on a timeline of their own starting at the
+event time.  micropython.schedule() callbacks run on the main thread at
+the next line boundary, which stands in for the VM's jump points, so they
+can land in the middle of whatever the main thread is doing, and wake it
+early from a sleep, as they do on the device.  With line_us=0 nothing is
+traced and they wait until the main thread next touches the clock.
+
+The CPU model is a cost per line of Python: each line a thread executes
+adds line_us to its virtual time (counted with sys.settrace), and every
+few lines the thread gives way to anything due before it.  That is crude,
+but it is deterministic, it charges rendering and mixing for the work
+they do, and it lets a thread that spins without sleeping be preempted.
+line_us=0 makes the CPU infinitely fast; a thread that then spins
+without touching the clock hangs the simulation.
+
+When end_us is reached, each thread gets a KeyboardInterrupt at its next
+clock call, which is how main.py is told to stop.
+"""
+
+import heapq
+import os
+import sys
+import threading
+import traceback
+
+TICKS_PERIOD = 1 << 30
+# lines between checks for a thread or event due earlier, 1 interleaves
+# threads as finely as the tracing allows
+SLICE_LINES = 32
+# only the badge's own code (and the benchmarks) is charged; the
+# simulator and the host's standard library stand in for the C parts of
+# MicroPython and cost nothing
+SIM_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(os.path.dirname(SIM_DIR))
+
+
+class SimThread:
+    def __init__(self, name, local, order):
+        self.name = name
+        self.local = local
+        self.order = order
+        self.wake = None
+        self.go = threading.Event()
+        self.done = False
+        self.interrupted = False
+        # virtual microseconds charged for lines run
+        self.busy = 0
+
+    def key(self, clock):
+        if self.wake is None:
+            return self.local
+        if clock.pending and self is clock.main and not clock.in_scheduled:
+            # scheduled callbacks wake the main thread, unless it is
+            # sleeping in one and cannot run them yet
+            return min(self.wake, max(self.local, clock.pending_at))
+        return self.wake
+
+
+class Clock:
+    def __init__(self, line_us=0, end_us=None, slice_lines=SLICE_LINES):
+        self.line_us = line_us
+        self.slice_lines = slice_lines
+        self.end_us = end_us
+        self.threads = []
+        # every thread ever started, for reports
+        self.started = []
+        self.order = 0
+        self.local = threading.local()
+        self.main = None
+        self.events = []
+        self.seq = 0
+        self.event_now = None
+        self.pending = []
+        self.pending_at = 0
+        self.in_scheduled = False
+        self.idle = threading.Event()
+        self.errors = []
+
+    # ---- time ----
+
+    def current(self):
+        return getattr(self.local, "thread", None)
+
+    def tracer(self, th):
+        # sys.settrace hook charging line_us per line of Python executed
+        line_us = self.line_us
+        slice_lines = self.slice_lines
+        lines = [0]
+        part = [0.0]
+
+        def local(frame, event, arg):
+            if event != "line" or self.event_now is not None:
+                return local
+            # keep virtual time in whole microseconds for any line_us
+            part[0] += line_us
+            whole = int(part[0])
+            part[0] -= whole
+            th.local += whole
+            th.busy += whole
+            lines[0] += 1
+            if lines[0] >= slice_lines:
+                lines[0] = 0
+                # raising here also turns the hook off, fine for a thread
+                # that is being told to stop
+                self.check_end(th)
+                if self.first_key(th) < th.local:
+                    self.switch(th)
+            if self.pending and th is self.main and not self.in_scheduled:
+                # the hook is off while it runs, call_tracing turns it
+                # back on so the callbacks are charged and can be preempted
+                sys.call_tracing(self.run_scheduled, (th,))
+            return local
+
+        def call(frame, event, arg):
+            path = frame.f_code.co_filename
+            if path.startswith(REPO) and not path.startswith(SIM_DIR):
+                return local
+            return None
+
+        return call
+
+    def start_thread(self, th):
+        self.local.thread = th
+        if self.line_us:
+            sys.settrace(self.tracer(th))
+
+    def now(self):
+        # virtual microseconds for the caller
+        if self.event_now is not None:
+            return self.event_now
+        th = self.current()
+        if th is None:
+            return 0
+        self.check_end(th)
+        if self.first_key(th) < th.local:
+            self.switch(th)
+        self.run_scheduled(th)
+        return th.local
+
+    def check_end(self, th):
+        if self.end_us is None or th.local < self.end_us:
+            return
+        if not th.interrupted or th.local > self.end_us + 1000000:
+            th.interrupted = True
+            raise KeyboardInterrupt
+
+    def sleep_us(self, us):
+        if self.event_now is not None:
+            # busy wait inside an interrupt
+            self.event_now += max(0, int(us))
+            return
+        th = self.current()
+        # a scheduled callback may sleep inside the main thread's sleep
+        outer = th.wake
+        th.wake = th.local + max(0, int(us))
+        try:
+            while True:
+                self.switch(th)
+                if th.local >= th.wake:
+                    break
+                self.run_scheduled(th)
+        finally:
+            th.wake = outer
+        self.run_scheduled(th)
+        self.check_end(th)
+
+    # ---- events ----
+
+    def add_event(self, at, func, *args):
+        # run func(*args) as an interrupt at virtual time `at`, returns a
+        # handle for cancel()
+        self.seq += 1
+        entry = [at, self.seq, func, args]
+        heapq.heappush(self.events, entry)
+        return entry
+
+    def cancel(self, entry):
+        if entry is not None:
+            entry[2] = None
+
+    def schedule(self, func, arg):
+        # micropython.schedule()
+        if not self.try_schedule(func, arg):
+            raise RuntimeError("schedule queue full")
+
+    def try_schedule(self, func, arg):
+        # mp_sched_schedule(), False when the queue is full
+        if len(self.pending) >= 8:
+            return False
+        if not self.pending:
+            self.pending_at = self.event_now if self.event_now is not None else self.now_quiet()
+        self.pending.append((func, arg))
+        return True
+
+    def now_quiet(self):
+        th = self.current()
+        return th.local if th is not None else 0
+
+    def run_scheduled(self, th):
+        if th is not self.main or self.in_scheduled or not self.pending:
+            return
+        self.in_scheduled = True
+        try:
+            while self.pending:
+                func, arg = self.pending.pop(0)
+                func(arg)
+        finally:
+            self.in_scheduled = False
+
+    def run_event(self, entry):
+        at, _, func, args = entry
+        if func is None:
+            return
+        self.event_now = at
+        try:
+            func(*args)
+        finally:
+            self.event_now = None
+
+    # ---- threads ----
+
+    def first_key(self, exclude=None):
+        # earliest time anything other than `exclude` wants to run
+        key = None
+        for th in self.threads:
+            if th is not exclude and not th.done:
+                k = th.key(self)
+                if key is None or k < key:
+                    key = k
+        while self.events and self.events[0][2] is None:
+            heapq.heappop(self.events)
+        if self.events and (key is None or self.events[0][0] < key):
+            key = self.events[0][0]
+        return key if key is not None else float("inf")
+
+    def pick(self):
+        # run due events, then return the thread to run and its start time
+        while True:
+            best = None
+            best_key = None
+            for th in self.threads:
+                if th.done:
+                    continue
+                k = th.key(self)
+                if best is None or (k, th.order) < (best_key, best.order):
+                    best = th
+                    best_key = k
+            while self.events and self.events[0][2] is None:
+                heapq.heappop(self.events)
+            if self.events and (best is None or self.events[0][0] <= best_key):
+                self.run_event(heapq.heappop(self.events))
+                continue
+            return best, best_key
+
+    def switch(self, th):
+        # give up the token and come back when th is first in line
+        nxt, key = self.pick()
+        if nxt is not th:
+            self.resume(nxt, key)
+            th.go.wait()
+            th.go.clear()
+        else:
+            th.local = max(th.local, key)
+
+    def resume(self, th, key):
+        th.local = max(th.local, key)
+        th.go.set()
+
+    def spawn(self, func, args=(), name=None):
+        # _thread.start_new_thread()
+        parent = self.current()
+        self.order += 1
+        th = SimThread(name or "thread%d" % self.order, parent.local if parent else 0, self.order)
+        self.threads.append(th)
+        self.started.append(th)
+
+        def body():
+            th.go.wait()
+            th.go.clear()
+            self.start_thread(th)
+            try:
+                func(*args)
+            except (KeyboardInterrupt, SystemExit):
+                pass
+            except Exception:
+                self.fail(th)
+            sys.settrace(None)
+            self.finish(th)
+
+        threading.Thread(target=body, daemon=True).start()
+        return th
+
+    def fail(self, th):
+        sys.settrace(None)
+        self.errors.append((th.name, sys.exc_info()))
+        traceback.print_exc()
+        # stop everything else at the next clock call
+        self.end_us = min(self.end_us or th.local, th.local)
+
+    def finish(self, th):
+        th.done = True
+        self.threads.remove(th)
+        if not self.threads:
+            self.idle.set()
+            return
+        nxt, key = self.pick()
+        self.resume(nxt, key)
+
+    def run(self, func, *args):
+        # run func as the main thread until every thread has finished
+        th = SimThread("main", 0, 0)
+        self.threads.append(th)
+        self.started.append(th)
+        self.main = th
+        self.start_thread(th)
+        try:
+            func(*args)
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        except Exception:
+            self.fail(th)
+        sys.settrace(None)
+        self.finish(th)
+        self.idle.wait()
+        self.local.thread = None
+        if self.errors:
+            name, info = self.errors[0]
+            raise RuntimeError("simulated thread %s failed" % name) from info[1]
@@ -0,0 +1,157 @@
+"""The simulation the fake modules talk to.
+
+install() makes a Sim the active one and puts the fake machine,
+neopixel, utime/time, _thread and micropython modules in sys.modules.
+The badge modules in the repository root are re-imported on top of
+them.  uninstall() puts the real modules back.
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+from .clock import SLICE_LINES, Clock
+from .recorder import Recorder
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+SOUNDS = os.path.join(REPO, "sounds")
+FRAMES = os.path.join(REPO, "frames")
+
+# the badge's own modules, imported again for every simulation
+BADGE_MODULES = ("adpcm", "animations", "baked", "charge", "debounce", "envelope", "fsm", "ledout",
+                 "ledrender", "mixer", "pulse", "pulsegen", "scheduler", "tables", "trace", "wavplayer")
+FAKE_MODULES = ("machine", "neopixel", "utime", "time", "_thread", "micropython")
+
+active = None
+
+
+class PinState:
+    # shared by every Pin object made for the same GPIO
+    def __init__(self, id):
+        self.id = id
+        self.level = 0
+        self.mode = -1
+        self.pull = -1
+        self.handler = None
+        self.trigger = 0
+        self.hard = False
+        self.pwm = None
+
+
+class Sim:
+    def __init__(self, line_us=1, end_ms=None, seed=1, slice_lines=SLICE_LINES):
+        self.clock = Clock(line_us, None if end_ms is None else int(end_ms * 1000),
+                           slice_lines)
+        self.recorder = Recorder()
+        self.pins = {}
+        # pin -> what ADC(pin).read_u16() returns, see machine.ADC
+        self.analog = {}
+        self.mem32 = {}
+        self.seed = seed
+        self.flash = None
+        self.saved = {}
+        self.modules = {}
+
+    def pin(self, id):
+        state = self.pins.get(id)
+        if state is None:
+            state = self.pins[id] = PinState(id)
+        return state
+
+    def drive(self, id, level):
+        # an outside signal on an input pin, fires the IRQ like an edge would
+        from .machine import Pin
+        state = self.pin(id)
+        old = state.level
+        state.level = 1 if level else 0
+        if state.handler is None or old == state.level:
+            return
+        edge = Pin.IRQ_RISING if state.level else Pin.IRQ_FALLING
+        if state.trigger & edge:
+            pin = Pin(id)
+            if state.hard:
+                state.handler(pin)
+            else:
+                self.clock.schedule(state.handler, pin)
+
+    def install(self):
+        global active
+        from . import machine, micropython, neopixel, utime, _thread
+        active = self
+        random.seed(self.seed)
+        for name in FAKE_MODULES + BADGE_MODULES:
+            self.saved[name] = sys.modules.pop(name, None)
+        sys.modules["machine"] = machine
+        sys.modules["neopixel"] = neopixel
+        sys.modules["utime"] = utime
+        sys.modules["time"] = utime
+        sys.modules["_thread"] = _thread
+        sys.modules["micropython"] = micropython
+        if REPO not in sys.path:
+            sys.path.insert(0, REPO)
+
+    def uninstall(self):
+        global active
+        # the badge modules as the run left them, for reports
+        self.modules = {name: sys.modules.get(name) for name in BADGE_MODULES}
+        for name in FAKE_MODULES + BADGE_MODULES:
+            sys.modules.pop(name, None)
+            if self.saved.get(name) is not None:
+                sys.modules[name] = self.saved[name]
+        self.saved = {}
+        if self.flash is not None:
+            shutil.rmtree(self.flash.root, ignore_errors=True)
+            self.flash = None
+        active = None
+
+    def use_flash(self, files=None):
+        # give wavplayer, baked and envelope a flash file system holding the
+        # sounds (and the sound bank, envelopes and baked animations, if
+        # they have been built)
+        import baked
+        import envelope
+        import wavplayer
+        if files is None:
+            files = [os.path.join(SOUNDS, f) for f in sorted(os.listdir(SOUNDS))
+                     if f.endswith(".wav") or f.endswith(".bnk") or f.endswith(".env")]
+            if os.path.isdir(FRAMES):
+                files += [os.path.join(FRAMES, f) for f in sorted(os.listdir(FRAMES))
+                          if f.endswith(".anim")]
+        self.flash = Flash(files)
+        wavplayer.open = self.flash.open
+        wavplayer.os = self.flash
+        baked.open = self.flash.open
+        envelope.open = self.flash.open
+        return self.flash
+
+    def run(self, func, *args):
+        self.clock.run(func, *args)
+
+
+class Flash:
+    """The device's '/' in a temporary directory, enough of os for wavplayer."""
+
+    def __init__(self, files):
+        self.root = tempfile.mkdtemp(prefix="badge-flash-")
+        for path in files:
+            os.symlink(path, os.path.join(self.root, os.path.basename(path)))
+
+    def path(self, name):
+        return os.path.join(self.root, name.lstrip("/"))
+
+    def open(self, name, mode="r"):
+        return open(self.path(name), mode)
+
+    def listdir(self, name="/"):
+        return sorted(os.listdir(self.path(name)))
+
+    def stat(self, name):
+        st = os.stat(self.path(name))
+        return (st.st_mode, st.st_ino, st.st_dev, st.st_nlink, st.st_uid, st.st_gid,
+                st.st_size, int(st.st_atime), int(st.st_mtime), int(st.st_ctime))
+
+
+def now_us():
+    return active.clock.now()
@@ -0,0 +1,263 @@
+"""Fake machine module: Pin, Signal, ADC, PWM, Timer, I2S and mem32."""
+
+from . import core
+
+
+def _sim():
+    return core.active
+
+
+class _Mem32:
+    def __getitem__(self, addr):
+        return _sim().mem32.get(addr, 0)
+
+    def __setitem__(self, addr, value):
+        _sim().mem32[addr] = value & 0xFFFFFFFF
+
+
+mem32 = _Mem32()
+
+
+def freq(hz=None):
+    return 125000000
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state=0):
+    pass
+
+
+def idle():
+    _sim().clock.sleep_us(1)
+
+
+def reset():
+    raise SystemExit
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    ALT = 3
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        if isinstance(id, Pin):
+            id = id.id
+        self.id = id
+        self.state = _sim().pin(id)
+        self.init(mode, pull, value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        state = self.state
+        if pull != -1:
+            state.pull = pull
+            if state.mode != Pin.OUT and pull == Pin.PULL_UP:
+                state.level = 1
+        if mode != -1:
+            state.mode = mode
+            if mode == Pin.OUT:
+                state.pwm = None
+        if value is not None:
+            self.value(value)
+
+    def value(self, v=None):
+        if v is None:
+            return self.state.level
+        v = 1 if v else 0
+        state = self.state
+        if state.level != v:
+            state.level = v
+            if state.mode == Pin.OUT:
+                _sim().recorder.edges.append((_sim().clock.now(), self.id, v))
+
+    __call__ = value
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    high = on
+    low = off
+
+    def toggle(self):
+        self.value(1 - self.state.level)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        state = self.state
+        state.handler = handler
+        state.trigger = trigger
+        state.hard = hard
+
+    def __repr__(self):
+        return "Pin(%d)" % self.id
+
+
+class Signal:
+    def __init__(self, pin, *args, invert=False, **kwargs):
+        if not isinstance(pin, Pin):
+            pin = Pin(pin, *args, **kwargs)
+        self.pin = pin
+        self.invert = invert
+
+    def value(self, v=None):
+        if v is None:
+            return self.pin.value() ^ self.invert
+        self.pin.value((1 if v else 0) ^ self.invert)
+
+    __call__ = value
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+
+class ADC:
+    """read_u16() from Sim.analog[pin] (a number or a function of no
+    arguments), or full scale / zero from the pin's digital level."""
+
+    def __init__(self, pin):
+        self.id = pin.id if isinstance(pin, Pin) else pin
+
+    def read_u16(self):
+        sim = _sim()
+        source = sim.analog.get(self.id)
+        if source is None:
+            return 65535 if sim.pin(self.id).level else 0
+        value = source() if callable(source) else source
+        return max(0, min(65535, int(value)))
+
+
+class PWM:
+    def __init__(self, pin, freq=0, duty_u16=0):
+        self.pin = pin
+        self._freq = freq
+        self._duty = duty_u16
+        pin.state.pwm = self
+
+    def freq(self, f=None):
+        if f is None:
+            return self._freq
+        self._freq = f
+
+    def duty_u16(self, d=None):
+        if d is None:
+            return self._duty
+        self._duty = d
+
+    def deinit(self):
+        self.pin.state.pwm = None
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, mode=PERIODIC, period=-1, callback=None, freq=-1):
+        self.event = None
+        if callback is not None:
+            self.init(mode=mode, period=period, callback=callback, freq=freq)
+
+    def init(self, mode=PERIODIC, period=-1, callback=None, freq=-1):
+        self.deinit()
+        if freq > 0:
+            period = 1000 // freq
+        self.mode = mode
+        self.period = max(period, 1)
+        self.callback = callback
+        clock = _sim().clock
+        self.event = clock.add_event(clock.now() + self.period * 1000, self._expire)
+
+    def _expire(self):
+        clock = _sim().clock
+        if self.mode == Timer.PERIODIC:
+            self.event = clock.add_event(clock.now() + self.period * 1000, self._expire)
+        else:
+            self.event = None
+        # soft timer, runs from the scheduler like on the device, where a
+        # tick that finds the queue full is dropped
+        clock.try_schedule(self.callback, self)
+
+    def deinit(self):
+        if self.event is not None:
+            _sim().clock.cancel(self.event)
+            self.event = None
+
+
+class I2S:
+    """Non-blocking transmit only.
+
+    write() queues the bytes behind what is already playing and returns at
+    once.  The callback runs once the written data has moved into the
+    ibuf-sized DMA buffer, i.e. ibuf bytes before it has all been played.
+    A write from the callback that arrives after the DMA ran dry is an
+    underrun, recorded with the length of the gap.
+    """
+
+    TX = 0
+    RX = 1
+    MONO = 0
+    STEREO = 1
+
+    def __init__(self, id, sck=None, ws=None, sd=None, mode=TX, bits=16, format=MONO,
+                 rate=8000, ibuf=20000):
+        self.byte_rate = rate * (bits // 8) * (1 if format == I2S.MONO else 2)
+        self.ibuf = ibuf
+        self.handler = None
+        self.played_until = None
+        self.event = None
+        self.in_callback = False
+
+    def irq(self, handler):
+        self.handler = handler
+
+    def write(self, buf):
+        sim = _sim()
+        clock = sim.clock
+        now = clock.now()
+        n = len(buf)
+        rec = sim.recorder
+        rec.audio += bytes(buf)
+        rec.writes.append((now, n))
+
+        if self.played_until is None or self.played_until < now:
+            if self.in_callback and self.played_until is not None:
+                rec.underruns.append((self.played_until, now - self.played_until))
+            start = now
+        else:
+            start = self.played_until
+        self.played_until = start + n * 1000000 // self.byte_rate
+        done = max(now, self.played_until - self.ibuf * 1000000 // self.byte_rate)
+        self.event = clock.add_event(done, self._done)
+        return n
+
+    def _done(self):
+        self.event = None
+        if self.handler is not None:
+            _sim().clock.schedule(self._callback, self)
+
+    def _callback(self, arg):
+        _sim().recorder.callbacks += 1
+        self.in_callback = True
+        try:
+            self.handler(arg)
+        finally:
+            self.in_callback = False
+
+    def deinit(self):
+        if self.event is not None:
+            _sim().clock.cancel(self.event)
+            self.event = None
+        self.played_until = None
+        self.handler = None
@@ -0,0 +1,28 @@
+"""Fake micropython module.
+
+const() and native are identities and schedule() queues onto the main
+thread.  There is deliberately no viper, so modules take their plain
+Python fallbacks.
+"""
+
+from . import core
+
+
+def const(x):
+    return x
+
+
+def native(f):
+    return f
+
+
+def schedule(func, arg):
+    core.active.clock.schedule(func, arg)
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def mem_info(verbose=False):
+    pass
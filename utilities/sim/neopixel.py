@@ -0,0 +1,63 @@
+"""Fake neopixel module: records every write() and takes as long as one.
+
+Port stands in for ledout.PioPort, the PIO and DMA that clock a frame
+out in the background: start() records the frame and returns at once,
+busy() stays True for as long as the bytes would take on the wire.
+"""
+
+import sys
+
+from . import core
+
+if core.REPO not in sys.path:
+    sys.path.insert(0, core.REPO)
+
+# 1.25 us per bit plus the latch, with interrupts off on the device; the
+# same wire timing ledout.DoubleStrip charges, so the two compare fairly
+from ledout import BIT_US, LATCH_US
+
+
+class NeoPixel:
+    ORDER = (1, 0, 2, 3)
+
+    def __init__(self, pin, n, bpp=3, timing=1):
+        self.pin = pin
+        self.n = n
+        self.bpp = bpp
+        self.buf = bytearray(n * bpp)
+
+    def __len__(self):
+        return self.n
+
+    def __setitem__(self, i, value):
+        offset = i * self.bpp
+        for j in range(self.bpp):
+            self.buf[offset + self.ORDER[j]] = value[j]
+
+    def __getitem__(self, i):
+        offset = i * self.bpp
+        return tuple(self.buf[offset + self.ORDER[j]] for j in range(self.bpp))
+
+    def fill(self, value):
+        for i in range(self.n):
+            self[i] = value
+
+    def write(self):
+        sim = core.active
+        sim.recorder.frames.append((sim.clock.now(), bytes(self.buf)))
+        sim.clock.sleep_us(int(self.n * self.bpp * 8 * BIT_US) + LATCH_US)
+
+
+class Port:
+    def __init__(self, pin=None, sm_id=1):
+        self.pin = pin
+        self.done = 0
+
+    def start(self, buf):
+        sim = core.active
+        now = sim.clock.now()
+        sim.recorder.frames.append((now, bytes(buf)))
+        self.done = now + int(len(buf) * 8 * BIT_US)
+
+    def busy(self):
+        return core.active.clock.now() < self.done
@@ -0,0 +1,32 @@
+"""What the simulated hardware saw: LED frames, pin edges and audio."""
+
+
+class Recorder:
+    def __init__(self):
+        # (time_us, bytes of the NeoPixel buffer) per np.write()
+        self.frames = []
+        # (time_us, pin, level) per change of an output pin
+        self.edges = []
+        # every byte handed to I2S.write(), and (time_us, bytes) per write
+        self.audio = bytearray()
+        self.writes = []
+        # (time_us, gap_us): the I2S callback wrote after the DMA ran dry
+        self.underruns = []
+        self.callbacks = 0
+
+    def pulses(self, pin):
+        # (start_us, width_us) for every high pulse on an output pin
+        out = []
+        start = None
+        for t, p, level in self.edges:
+            if p != pin:
+                continue
+            if level and start is None:
+                start = t
+            elif not level and start is not None:
+                out.append((start, t - start))
+                start = None
+        return out
+
+    def frame_times(self):
+        return [t for t, _ in self.frames]
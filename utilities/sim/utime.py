@@ -0,0 +1,57 @@
+"""Fake utime (and time): the ticks_* and sleep functions on the virtual clock.
+
+Anything else is taken from the host's time module.
+"""
+
+import time as _time
+
+from . import core
+from .clock import TICKS_PERIOD
+
+
+def _now():
+    return core.active.clock.now()
+
+
+def ticks_us():
+    return _now() % TICKS_PERIOD
+
+
+def ticks_ms():
+    return (_now() // 1000) % TICKS_PERIOD
+
+
+def ticks_cpu():
+    return ticks_us()
+
+
+def ticks_diff(a, b):
+    return ((a - b + TICKS_PERIOD // 2) % TICKS_PERIOD) - TICKS_PERIOD // 2
+
+
+def ticks_add(a, b):
+    return (a + b) % TICKS_PERIOD
+
+
+def sleep_us(us):
+    core.active.clock.sleep_us(us)
+
+
+def sleep_ms(ms):
+    core.active.clock.sleep_us(ms * 1000)
+
+
+def sleep(s):
+    core.active.clock.sleep_us(int(s * 1000000))
+
+
+def time():
+    return _now() // 1000000
+
+
+def time_ns():
+    return _now() * 1000
+
+
+def __getattr__(name):
+    return getattr(_time, name)
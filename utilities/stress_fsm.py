@@ -0,0 +1,136 @@
+"""Stress the state hand-over between the two cores on the simulator.
+
+The main thread fires random events into a StateMachine with dispatch()
+as fast as it can, with random gaps, the way the main loop does on the
+badge, while interrupts at random times post() random events the way the
+buttons and the I2S callback do.  Their run_pending() is scheduled and
+runs at a line boundary of the main thread, so it lands in the middle of
+a dispatch() as often as not.  A second thread plays the animation
+thread: whenever seq has moved it reads the state with snapshot() and
+then "renders" for a random time.  Threads are switched after every line
+(see sim/clock.py), so every interleaving of a transition with a read
+comes up over a run.
+
+Each transition is recorded as it is applied, and must have moved seq
+by exactly two; one that did not overlapped another.  Each animation
+start is checked against the state and low power mode recorded for that
+seq.  A torn read (state and mode not from the transition whose seq was
+read) is an animation that is wrong, repeated or missing.  After the
+events stop, the last transition must have been shown.
+
+--racy reads seq, state and low_power_mode one by one, as main.py did
+before snapshot(), and --unguarded lets a scheduled run_pending() apply
+its events inside a dispatch(), as fsm.py did before its busy flag, to
+show what the checks catch.
+
+Run from the utilities directory:
+    python stress_fsm.py [--seconds S] [--seed N] [--racy] [--unguarded]
+"""
+
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sim import Sim
+
+
+def run(seconds, seed, racy, unguarded):
+    sim = Sim(line_us=1, end_ms=seconds * 1000, seed=seed, slice_lines=1)
+    sim.install()
+    try:
+        import _thread
+        import fsm
+        import time
+
+        # seq -> (state, low_power_mode) as each transition published it
+        published = {}
+        overlapped = []
+
+        class Recorded(fsm.StateMachine):
+            def apply(self, event):
+                seq = self.seq
+                if not super().apply(event):
+                    return False
+                if self.seq != seq + 2:
+                    overlapped.append(self.seq)
+                published[self.seq] = (self.state, self.low_power_mode)
+                return True
+
+        class Unguarded(Recorded):
+            # never busy, so nothing is deferred
+            busy = property(lambda self: False, lambda self, value: None)
+
+        switch = {"arm": False}
+        machine = (Unguarded if unguarded else Recorded)(lambda: switch["arm"])
+        published[0] = (machine.state, machine.low_power_mode)
+        shown = []
+        # no more events for the last 10%
+        quiet_us = seconds * 900000
+
+        def irq():
+            # a button or I2S interrupt, then the next one
+            now = sim.clock.now()
+            if now < quiet_us:
+                machine.post(random.randrange(fsm.NUM_EVENTS))
+                sim.clock.add_event(now + random.randrange(50, 1000), irq)
+
+        def reader():
+            seen = -1
+            while True:
+                if machine.seq != seen:
+                    if racy:
+                        seq = machine.seq
+                        state = machine.state
+                        mode = machine.low_power_mode
+                    else:
+                        seq, state, mode = machine.snapshot()
+                    seen = seq
+                    shown.append((seq, state, mode))
+                time.sleep_us(random.randrange(20, 400))
+
+        def writer():
+            _thread.start_new_thread(reader, ())
+            sim.clock.add_event(random.randrange(50, 1000), irq)
+            while time.ticks_us() < quiet_us:
+                switch["arm"] = random.random() < 0.5
+                machine.dispatch(random.randrange(fsm.NUM_EVENTS))
+                time.sleep_us(random.randrange(0, 300))
+            while True:
+                # whatever was queued behind a dispatch()
+                machine.run_pending()
+                time.sleep_ms(100)
+
+        sim.run(writer)
+    finally:
+        sim.uninstall()
+
+    torn = [s for s in shown if published.get(s[0]) != s[1:]]
+    missed_last = not shown or shown[-1][0] != machine.seq
+    return machine.seq // 2, machine.latency_count, shown, torn, overlapped, missed_last
+
+
+def main():
+    parser = argparse.ArgumentParser(description="cross-core state hand-over stress test")
+    parser.add_argument("--seconds", type=float, default=10, help="virtual seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--racy", action="store_true",
+                        help="read the fields one by one instead of snapshot()")
+    parser.add_argument("--unguarded", action="store_true",
+                        help="let queued events be applied inside dispatch()")
+    args = parser.parse_args()
+
+    transitions, posted, shown, torn, overlapped, missed_last = run(
+        args.seconds, args.seed, args.racy, args.unguarded)
+    print("%d transitions (%d queued), %d overlapped, %d animation starts, %d torn reads%s" % (
+        transitions, posted, len(overlapped), len(shown), len(torn),
+        ", last transition never shown" if missed_last else ""))
+    for seq, state, mode in torn[:10]:
+        print("  seq %d read as state %d mode %d" % (seq, state, mode))
+    sys.exit(1 if torn or overlapped or missed_last else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Decode a trace.py dump into per-path latency percentiles.
+
+Reads either the raw file written by trace.save() or the hex lines
+printed by trace.dump() (copied from the REPL into a file), lists the
+event counts and prints percentiles for each path:
+
+    button -> state     button IRQ to the next state machine transition
+    trigger -> pulse    pulse button IRQ to the end of the HV pulse
+    play -> first       WavPlayer.play() to its first samples going to I2S
+    frame render        LED frame begin() to np.write()
+    frame write         np.write() itself
+    i2s period          time between I2S callbacks
+
+ticks_us() wraps at 2**30 on the RP2040; differences are taken modulo
+that.  Add --events to print every event with its time.
+
+    python trace_decode.py trace.bin [--events]
+"""
+
+import binascii
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+import trace as tr
+
+TICKS_PERIOD = 1 << 30
+
+# name, start event, end event, end must come before the next start
+PATHS = [
+    ("button -> state", tr.TR_BUTTON, tr.TR_STATE),
+    ("trigger -> pulse", tr.TR_PULSE_IRQ, tr.TR_PULSE),
+    ("play -> first", tr.TR_PLAY, tr.TR_FIRST_SAMPLE),
+    ("frame render", tr.TR_FRAME, tr.TR_WRITE),
+    ("frame write", tr.TR_WRITE, tr.TR_WRITTEN),
+    ("i2s period", tr.TR_I2S, tr.TR_I2S),
+]
+
+
+def ticks_diff(a, b):
+    return ((a - b + TICKS_PERIOD // 2) % TICKS_PERIOD) - TICKS_PERIOD // 2
+
+
+def load(path):
+    with open(path, "rb") as f:
+        return parse(f.read(), path)
+
+
+def parse(data, name="trace"):
+    # (event, arg, ticks_us) for each pair in a trace.encode() or dump()
+    if not data.startswith(tr.MAGIC):
+        # hex from trace.dump()
+        data = binascii.unhexlify(b"".join(data.split()))
+    if not data.startswith(tr.MAGIC):
+        raise ValueError("%s: not a trace" % name)
+    count = struct.unpack("<I", data[4:8])[0]
+    words = struct.unpack("<%dI" % (2 * count), data[8:8 + 8 * count])
+    return [(words[i] & 0xFF, words[i] >> 8, words[i + 1]) for i in range(0, len(words), 2)]
+
+
+def latencies(events, start, end):
+    # each start paired with the first end after it, unless another start
+    # comes first (a frame that was not written, a press that changed nothing)
+    out = []
+    begin = None
+    for evt, _, t in events:
+        if evt == end and begin is not None:
+            out.append(ticks_diff(t, begin))
+            begin = None
+        if evt == start:
+            begin = t
+    return out
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(2)
+    events = load(sys.argv[1])
+    if not events:
+        print("empty trace")
+        return
+
+    if "--events" in sys.argv:
+        t0 = events[0][2]
+        for evt, arg, t in events:
+            print("%10d us  %-12s %d" % (ticks_diff(t, t0), tr.NAMES[evt], arg))
+        print()
+
+    span = ticks_diff(events[-1][2], events[0][2])
+    print("%d events over %.3f s" % (len(events), span / 1e6))
+    counts = {}
+    for evt, _, _ in events:
+        counts[evt] = counts.get(evt, 0) + 1
+    print("  ".join("%s %d" % (tr.NAMES[evt], counts[evt]) for evt in sorted(counts)))
+    print()
+
+    print("%-18s %6s %8s %8s %8s %8s" % ("path (us)", "n", "p50", "p90", "p99", "max"))
+    for name, start, end in PATHS:
+        values = latencies(events, start, end)
+        if not values:
+            print("%-18s %6d" % (name, 0))
+            continue
+        print("%-18s %6d %8d %8d %8d %8d" % (
+            name, len(values), percentile(values, 50), percentile(values, 90),
+            percentile(values, 99), max(values)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Convert 16-bit mono PCM WAV files to 4:1 IMA-ADPCM WAV files.
+
+Writes a standard WAVE_FORMAT_IMA_ADPCM (0x11) file for every input: a
+20 byte fmt chunk with samples per block, a fact chunk with the sample
+count and the data chunk last, which is the layout WavPlayer reads.
+Blocks are BLOCK_ALIGN bytes, 505 samples each.  Copy the output files to
+the badge in place of the PCM ones, the names stay the same.
+
+Run from the utilities directory:
+    python wav2adpcm.py [out-dir] [file.wav ...]
+
+Without files every WAV in ../sounds is converted, out-dir defaults to
+../sounds/adpcm.
+"""
+
+import glob
+import os
+import struct
+import sys
+import wave
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT)
+
+from adpcm import INDEX_ADJUST, STEPS, WAVE_FORMAT_IMA_ADPCM, block_samples
+
+BLOCK_ALIGN = 256
+
+
+def encode_block(samples, index, decoded=None):
+    # samples[0] goes in the header, the rest as 4-bit codes; returns the
+    # block and the step index to carry into the next block.  What a
+    # decoder will reproduce is appended to decoded, if given.
+    pred = samples[0]
+    out = bytearray(struct.pack("<hBB", pred, index, 0))
+    if decoded is not None:
+        decoded.append(pred)
+    codes = []
+    for sample in samples[1:]:
+        step = STEPS[index]
+        diff = sample - pred
+        code = 0
+        if diff < 0:
+            code = 8
+            diff = -diff
+        # the same successive approximation the decoder undoes
+        delta = step >> 3
+        if diff >= step:
+            code |= 4
+            diff -= step
+            delta += step
+        step >>= 1
+        if diff >= step:
+            code |= 2
+            diff -= step
+            delta += step
+        step >>= 1
+        if diff >= step:
+            code |= 1
+            delta += step
+        if code & 8:
+            pred = max(pred - delta, -32768)
+        else:
+            pred = min(pred + delta, 32767)
+        index = min(max(index + INDEX_ADJUST[code & 7], 0), 88)
+        codes.append(code)
+        if decoded is not None:
+            decoded.append(pred)
+    if len(codes) & 1:
+        # pad to a whole byte, decoders produce one extra sample
+        codes.append(0)
+    for i in range(0, len(codes), 2):
+        out.append(codes[i] | (codes[i + 1] << 4))
+    return out, index
+
+
+def initial_index(samples):
+    # start with a step that roughly matches the first few differences
+    diff = max([abs(samples[i + 1] - samples[i]) for i in range(min(len(samples) - 1, 8))] + [0])
+    index = 0
+    while index < 88 and STEPS[index] < diff:
+        index += 1
+    return index
+
+
+def encode(samples, block_align=BLOCK_ALIGN, decoded=None):
+    per_block = block_samples(block_align)
+    index = initial_index(samples)
+    data = bytearray()
+    for start in range(0, len(samples), per_block):
+        block, index = encode_block(samples[start:start + per_block], index, decoded)
+        data += block
+    return data
+
+
+def read_pcm(path):
+    with wave.open(path) as w:
+        if w.getnchannels() != 1 or w.getsampwidth() != 2:
+            raise ValueError("%s: not 16-bit mono" % path)
+        frames = w.readframes(w.getnframes())
+        rate = w.getframerate()
+    return list(struct.unpack("<%dh" % (len(frames) // 2), frames)), rate
+
+
+def write_adpcm(path, samples, rate, block_align=BLOCK_ALIGN, decoded=None):
+    data = encode(samples, block_align, decoded)
+    per_block = block_samples(block_align)
+    byte_rate = rate * block_align // per_block
+    fmt = struct.pack("<HHIIHHHH", WAVE_FORMAT_IMA_ADPCM, 1, rate, byte_rate,
+                      block_align, 4, 2, per_block)
+    fact = struct.pack("<I", len(samples))
+    with open(path, "wb") as f:
+        f.write(b"RIFF")
+        f.write(struct.pack("<I", 4 + 8 + len(fmt) + 8 + len(fact) + 8 + len(data)))
+        f.write(b"WAVE")
+        f.write(b"fmt " + struct.pack("<I", len(fmt)) + fmt)
+        f.write(b"fact" + struct.pack("<I", len(fact)) + fact)
+        f.write(b"data" + struct.pack("<I", len(data)) + data)
+    return len(data)
+
+
+def main():
+    out_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT, "sounds", "adpcm")
+    files = sys.argv[2:] or sorted(glob.glob(os.path.join(ROOT, "sounds", "*.wav")))
+    os.makedirs(out_dir, exist_ok=True)
+    total_in = total_out = 0
+    for path in files:
+        samples, rate = read_pcm(path)
+        size = write_adpcm(os.path.join(out_dir, os.path.basename(path)), samples, rate)
+        total_in += 2 * len(samples)
+        total_out += size
+        print("%-18s %7d -> %6d bytes" % (os.path.basename(path), 2 * len(samples), size))
+    print("%-18s %7d -> %6d bytes" % ("total", total_in, total_out))
+
+
+if __name__ == "__main__":
+    main()
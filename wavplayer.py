@@ -9,6 +9,40 @@
 #     - resume()
 #     - stop()
 #     - isplaying()
+# - queue clips with enqueue(), drop the queue with clear().  A queued clip
+#   with the same format as the one playing follows it with no gap, and
+#   the I2S peripheral stays set up between clips until the format changes
+#   or close() is called.  on_complete(name) is called as each clip ends.
+# - play() and enqueue() take an on_done(name) callback for that clip.  It
+#   runs from the I2S callback once the clip has been played out (or cut
+#   off by stop()), so the caller can start a sound and carry on instead of
+#   polling isplaying().  Keep it short, posting an event is the idea.
+# - with voices > 1, play() while a clip is playing mixes a preloaded 16-bit
+#   clip of the same format over it instead of raising (see mixer.py).
+#   When every voice is busy the oldest one is cut off.
+# - preload() keeps short clips in RAM, play() then serves them with no
+#   file I/O.  The cache is limited to cache_bytes and evicts the least
+#   recently played clip first (mixed plays count), never one that is still
+#   playing, as the main clip or in a mixer voice.  With a sound bank,
+#   preload() shares the bank's file with the I2S callback and refuses
+#   while a clip plays.
+# - every WAV file in root is indexed once when the player is created, the
+#   index is kept in the index_file sidecar and only re-parsed for files
+#   whose size or mtime changed.  refresh() rescans after adding files.
+# - mono IMA-ADPCM files (see utilities/wav2adpcm.py) are decoded block by
+#   block as they are read, so a quarter of the bytes come from flash.
+#   Preloaded ADPCM clips are decoded once into the cache.
+# - position_ms() is how far the newest sound (the clip started last, or
+#   the last one mixed over it) has got, as heard.  Each I2S callback
+#   notes how much of it has gone into the I2S buffer, less the buffer
+#   itself, and the time; in between the position runs on with the clock.
+#   latest is its name.  Both are cheap enough to call from the animation
+#   thread every frame (see envelope.py).
+# - with bank set, clips come from one sound bank file built by
+#   utilities/build_bank.py instead of separate WAV files.  The bank is
+#   opened once and kept open, its index replaces the directory scan and
+#   play() is a single seek.  Without the bank file the WAV files in root
+#   are used as before.
 # Example:
 #    wp = WavPlayer(id=I2S_ID,
 #                   sck_pin=Pin(SCK_PIN),
@@ -18,11 +52,27 @@
 #    wp.play("YOUR_WAV_FILE.wav", loop=True)
 #
 # All methods are non-blocking.
-# The WAV file header is parsed in the play() method to get audio parameters
+# The WAV file headers are parsed when the index is built, play() only
+# looks the file up and seeks to its first sample.
+#
+# latency_us holds the time from the last play() call to its first audio
+# samples being handed to the I2S peripheral.
 
 import os
 import struct
+import time
 from machine import I2S
+from mixer import Mixer
+import adpcm
+from trace import trace, TR_PLAY, TR_I2S, TR_FIRST_SAMPLE
+
+# sound bank file: "WBNK", version, clip count, then one BANK_ENTRY per
+# clip (name, offset, length, audio_format, channels, rate, bits,
+# block_align) and the sample data
+BANK_MAGIC = b"WBNK"
+BANK_VERSION = 1
+BANK_ENTRY = "<16sIIHHIHH"
+BANK_ENTRY_SIZE = struct.calcsize(BANK_ENTRY)
 
 
 class WavPlayer:
@@ -32,7 +82,8 @@ class WavPlayer:
     FLUSH = 3
     STOP = 4
 
-    def __init__(self, id, sck_pin, ws_pin, sd_pin, ibuf, root="/"):
+    def __init__(self, id, sck_pin, ws_pin, sd_pin, ibuf, root="/", cache_bytes=0,
+                 index_file="wavindex.txt", voices=1, bank=None):
         self.id = id
         self.sck_pin = sck_pin
         self.ws_pin = ws_pin
@@ -46,6 +97,10 @@ class WavPlayer:
         self.sample_rate = None
         self.bits_per_sample = None
         self.first_sample_offset = None
+        self.data_length = 0
+        self.remaining = 0
+        self.block_align = 0
+        self.adpcm = False
         self.num_read = 0
         self.sbuf = 1000
         self.nflush = 0
@@ -56,22 +111,108 @@ class WavPlayer:
         # allocate audio sample array buffer
         self.wav_samples_mv = memoryview(bytearray(10000))
 
+        # encoded blocks read ahead of decoding into wav_samples_mv,
+        # adpcm_read is how many bytes of whole blocks fit both buffers
+        self.adpcm_mv = memoryview(bytearray(2560))
+        self.adpcm_read = 0
+
+        # extra voices mixed over the clip playing, None when not mixing
+        if voices > 1:
+            self.mixer = Mixer(voices - 1, len(self.wav_samples_mv) // 2)
+        else:
+            self.mixer = None
+
+        # name -> (size, mtime, audio_format, num_channels, sample_rate,
+        #          bits_per_sample, data_offset, data_length, block_align)
+        # bank entries have no size or mtime and offsets into the bank
+        self.index_file = index_file
+        self.index = {}
+        self.bank = bank
+        self.bank_file = None
+        self.refresh()
+
+        # preloaded clips: name -> (samples, index entry)
+        # cache_order is least recently played first
+        self.cache_bytes = cache_bytes
+        self.cache_used = 0
+        self.cache = {}
+        self.cache_order = []
+        self.clip = None
+        self.clip_pos = 0
+
+        # bytes of the clip playing now handed to the I2S peripheral
+        self.played = 0
+        # the newest sound, its voice (-1 for the clip playing now) and
+        # the mixer's count when it was added, to notice it being stolen
+        self.latest = None
+        self.latest_voice = -1
+        self.latest_count = 0
+        # bytes of the newest sound heard at mark_ms, negative while its
+        # start is still in the I2S buffer
+        self.heard = 0
+        self.mark_ms = 0
+
+        # clip playing now and its on_done, (name, on_done) waiting after it
+        self.name = None
+        self.done = None
+        self.queue = []
+        self.on_complete = None
+
+        # I2S peripheral and the format it was set up for
+        self.audio_out = None
+        self.i2s_channels = None
+        self.i2s_rate = None
+        self.i2s_bits = None
+
+        self.play_start = 0
+        self.latency_us = 0
+        self.waiting_first = False
+
     def i2s_callback(self, arg):
+        trace(TR_I2S)
         if self.state == WavPlayer.PLAY:
-            self.num_read = self.wav.readinto(self.wav_samples_mv)
+            # what went before is in the I2S buffer now
+            self.heard = self.latest_written() - self.ibuf
+            self.mark_ms = time.ticks_ms()
+            self.num_read = self.read()
+            if self.num_read == 0 and self.loop == False and self.queue:
+                entry = self.lookup(self.queue[0][0])
+                if self.same_format(entry):
+                    # gapless, straight into the next clip without a flush
+                    self.close_source()
+                    name, self.done = self.queue.pop(0)
+                    self.open_source(name, entry)
+                    self.num_read = self.read()
+            mixing = self.mixer is not None and self.mixer.active()
             # end of WAV file?
-            if self.num_read == 0:
+            if self.num_read == 0 and not mixing:
                 #print("end of file")
                 # end-of-file
                 if self.loop == False:
                     self.state = WavPlayer.FLUSH
                 else:
-                    # advance to first byte of Data section
-                    _ = self.wav.seek(self.first_sample_offset)
+                    self.rewind()
                 _ = self.audio_out.write(self.silence_samples)
             else:
                 #print("playing %d bytes" % self.num_read)
-                _ = self.audio_out.write(self.wav_samples_mv[: self.num_read])
+                if self.waiting_first:
+                    self.waiting_first = False
+                    self.latency_us = time.ticks_diff(time.ticks_us(), self.play_start)
+                    trace(TR_FIRST_SAMPLE)
+                if mixing:
+                    if self.num_read == 0:
+                        # the main clip is over, the voices carry on over silence
+                        if self.loop == False:
+                            self.close_source()
+                        else:
+                            self.rewind()
+                        n = self.mixer.mix(None, self.mixer.samples)
+                    else:
+                        n = self.mixer.mix(self.chunk(), self.num_read // 2)
+                    _ = self.audio_out.write(self.mixer.out_mv[:n])
+                else:
+                    _ = self.audio_out.write(self.chunk())
+                self.played += self.num_read
         elif self.state == WavPlayer.RESUME:
             self.state = WavPlayer.PLAY
             _ = self.audio_out.write(self.silence_samples)
@@ -87,9 +228,12 @@ class WavPlayer:
                 _ = self.audio_out.write(self.silence_samples)
             else:
                 #print("flush done")
-                self.wav.close()
-                self.audio_out.deinit()
-                self.state = WavPlayer.STOP
+                self.close_source()
+                if self.queue:
+                    name, on_done = self.queue.pop(0)
+                    self.start(name, on_done=on_done)
+                else:
+                    self.state = WavPlayer.STOP
         elif self.state == WavPlayer.STOP:
             pass
         else:
@@ -97,7 +241,10 @@ class WavPlayer:
             raise SystemError("Internal error:  unexpected state")
             self.state == WavPlayer.STOP
 
-    def parse(self, wav_file):
+    def read_header(self, wav_file):
+        # returns (audio_format, num_channels, sample_rate, bits_per_sample,
+        #          data_offset, block_align), bits_per_sample is that of the
+        #          samples played, so 16 for ADPCM
         chunk_ID = wav_file.read(4)
         if chunk_ID != b"RIFF":
             raise ValueError("WAV chunk ID invalid")
@@ -111,16 +258,14 @@ class WavPlayer:
         sub_chunk1_size = wav_file.read(4)
         audio_format = struct.unpack("<H", wav_file.read(2))[0]
         num_channels = struct.unpack("<H", wav_file.read(2))[0]
-
-        if num_channels == 1:
-            self.format = I2S.MONO
-        else:
-            self.format = I2S.STEREO
-
-        self.sample_rate = struct.unpack("<I", wav_file.read(4))[0]
+        sample_rate = struct.unpack("<I", wav_file.read(4))[0]
         byte_rate = struct.unpack("<I", wav_file.read(4))[0]
         block_align = struct.unpack("<H", wav_file.read(2))[0]
-        self.bits_per_sample = struct.unpack("<H", wav_file.read(2))[0]
+        bits_per_sample = struct.unpack("<H", wav_file.read(2))[0]
+        if audio_format == adpcm.WAVE_FORMAT_IMA_ADPCM:
+            if num_channels != 1:
+                raise ValueError("IMA-ADPCM WAV must be mono")
+            bits_per_sample = 16
 
         # usually the sub chunk2 ID ("data") comes next, but
         # some online MP3->WAV converters add
@@ -133,38 +278,326 @@ class WavPlayer:
         if offset == -1:
             raise ValueError("WAV sub chunk 2 ID not found")
 
-        self.first_sample_offset = 44 + offset
+        return (audio_format, num_channels, sample_rate, bits_per_sample, 44 + offset,
+                block_align)
+
+    def parse(self, wav_file):
+        header = self.read_header(wav_file)
+        self.use((0, 0) + header[:5] + (0, header[5]))
+
+    def use(self, entry):
+        # take the audio parameters of an index entry
+        if entry[3] == 1:
+            self.format = I2S.MONO
+        else:
+            self.format = I2S.STEREO
+        self.sample_rate = entry[4]
+        self.bits_per_sample = entry[5]
+        self.first_sample_offset = entry[6]
+        self.data_length = entry[7]
+        self.block_align = entry[8]
+        self.adpcm = entry[2] == adpcm.WAVE_FORMAT_IMA_ADPCM
+        if self.adpcm:
+            blocks = min(len(self.adpcm_mv) // self.block_align,
+                         len(self.wav_samples_mv) // (2 * adpcm.block_samples(self.block_align)))
+            if blocks == 0:
+                raise ValueError("IMA-ADPCM block too large")
+            self.adpcm_read = blocks * self.block_align
+
+    def load_index(self):
+        index = {}
+        if self.index_file is None:
+            return index
+        try:
+            with open(self.root + self.index_file) as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) == 10:
+                        index[fields[0]] = tuple(int(v) for v in fields[1:])
+        except (OSError, ValueError):
+            pass
+        return index
+
+    def save_index(self, index):
+        try:
+            with open(self.root + self.index_file, "w") as f:
+                for name in index:
+                    f.write(name)
+                    for v in index[name]:
+                        f.write(" %d" % v)
+                    f.write("\n")
+        except OSError:
+            # read-only file system, we just rebuild next boot
+            pass
+
+    def load_bank(self):
+        # open the bank and read its index, False if there is no bank file
+        try:
+            f = open(self.root + self.bank, "rb")
+        except OSError:
+            return False
+        magic, version, count = struct.unpack("<4sHH", f.read(8))
+        if magic != BANK_MAGIC or version != BANK_VERSION:
+            f.close()
+            raise ValueError("%s: not a version %d sound bank" % (self.bank, BANK_VERSION))
+        index = {}
+        for _ in range(count):
+            name, offset, length, audio_format, channels, rate, bits, block_align = \
+                struct.unpack(BANK_ENTRY, f.read(BANK_ENTRY_SIZE))
+            name = name.rstrip(b"\0").decode()
+            index[name] = (0, 0, audio_format, channels, rate, bits, offset, length, block_align)
+        if self.bank_file is not None:
+            self.bank_file.close()
+        self.bank_file = f
+        self.index = index
+        return True
+
+    def refresh(self):
+        # index the sound bank, or every WAV file in root reusing sidecar
+        # entries whose size and mtime still match
+        if self.bank is not None and self.load_bank():
+            return
+        old = self.load_index()
+        index = {}
+        changed = False
+        for name in os.listdir(self.root):
+            if not name.endswith(".wav"):
+                continue
+            st = os.stat(self.root + name)
+            size = st[6]
+            mtime = st[8]
+            entry = old.get(name)
+            if entry is None or entry[0] != size or entry[1] != mtime:
+                with open(self.root + name, "rb") as wav:
+                    header = self.read_header(wav)
+                entry = (size, mtime) + header[:5] + (size - header[4], header[5])
+                changed = True
+            index[name] = entry
+        if self.index_file is not None and (changed or len(index) != len(old)):
+            self.save_index(index)
+        self.index = index
 
-    def play(self, wav_file, loop=False):
-        if os.listdir(self.root).count(wav_file) == 0:
+    def read(self):
+        # next chunk of samples, from the cached clip or the file
+        if self.name is None:
+            return 0
+        if self.clip is not None:
+            n = min(len(self.wav_samples_mv), len(self.clip) - self.clip_pos)
+            self.clip_pos += n
+            return n
+        if self.adpcm:
+            n = self.wav.readinto(self.adpcm_mv[: min(self.adpcm_read, self.remaining)])
+            self.remaining -= n
+            return adpcm.decode(self.adpcm_mv, n, self.wav_samples_mv, self.block_align)
+        # a bank holds more than this clip, stop at the end of its data
+        n = self.wav.readinto(self.wav_samples_mv[: min(len(self.wav_samples_mv), self.remaining)])
+        self.remaining -= n
+        return n
+
+    def rewind(self):
+        # back to the first sample of the clip playing, for looping
+        if self.clip is not None:
+            self.clip_pos = 0
+        else:
+            _ = self.wav.seek(self.first_sample_offset)
+            self.remaining = self.data_length
+        self.played = 0
+
+    def chunk(self):
+        # the samples read() just made available
+        if self.clip is not None:
+            return self.clip[self.clip_pos - self.num_read : self.clip_pos]
+        return self.wav_samples_mv[: self.num_read]
+
+    def preload(self, wav_file):
+        # load the samples of wav_file into RAM, evicting older clips to fit
+        if wav_file in self.cache:
+            return
+        entry = self.index.get(wav_file)
+        if entry is None:
             raise ValueError("%s: not found" % wav_file)
+        encoded = entry[2] == adpcm.WAVE_FORMAT_IMA_ADPCM
+        size = entry[7]
+        if encoded:
+            size = adpcm.decoded_length(entry[7], entry[8])
+        if size > self.cache_bytes:
+            raise ValueError("%s: larger than the cache" % wav_file)
+        if self.bank_file is not None and self.state != WavPlayer.STOP:
+            # the I2S callback may read the bank between our seek and read
+            raise ValueError("%s: cannot preload from the bank while playing" % wav_file)
+        while self.cache_used + size > self.cache_bytes:
+            self.evict()
+        samples = bytearray(size)
+        wav = self.bank_file
+        if wav is None:
+            wav = open(self.root + wav_file, "rb")
+        wav.seek(entry[6])
+        if encoded:
+            # keep the decoded samples, the cached entry is plain PCM
+            data = wav.read(entry[7])
+            adpcm.decode(data, len(data), samples, entry[8])
+            entry = entry[:2] + (adpcm.WAVE_FORMAT_PCM,) + entry[3:7] + (size, 2)
+        else:
+            wav.readinto(samples)
+        if wav is not self.bank_file:
+            wav.close()
+        self.cache[wav_file] = (samples, entry)
+        self.cache_order.append(wav_file)
+        self.cache_used += size
+
+    def evict(self):
+        # drop the least recently played clip that is not playing right now,
+        # as the main clip or in a mixer voice
+        for name in self.cache_order:
+            if name == self.name and self.clip is not None:
+                continue
+            if self.mixing(self.cache[name][0]):
+                continue
+            self.cache_order.remove(name)
+            self.cache_used -= len(self.cache.pop(name)[0])
+            return
+        raise ValueError("cache full")
+
+    def mixing(self, samples):
+        # True while a mixer voice plays samples
+        if self.mixer is None:
+            return False
+        for src in self.mixer.src:
+            if src is samples:
+                return True
+        return False
+
+    def lookup(self, wav_file):
+        cached = self.cache.get(wav_file)
+        entry = cached[1] if cached is not None else self.index.get(wav_file)
+        if entry is None:
+            raise ValueError("%s: not found" % wav_file)
+        return entry
+
+    def same_format(self, entry):
+        return (self.audio_out is not None and entry[3] == self.i2s_channels
+                and entry[4] == self.i2s_rate and entry[5] == self.i2s_bits)
+
+    def open_source(self, wav_file, entry):
+        if wav_file in self.cache:
+            # serve from RAM, no file system access at all
+            self.cache_order.remove(wav_file)
+            self.cache_order.append(wav_file)
+            self.clip = memoryview(self.cache[wav_file][0])
+            self.clip_pos = 0
+        else:
+            self.clip = None
+            if self.bank_file is not None:
+                self.wav = self.bank_file
+            else:
+                self.wav = open(self.root + wav_file, "rb")
+            # advance to first byte of Data section in WAV file
+            _ = self.wav.seek(entry[6])
+            self.remaining = entry[7]
+        self.name = wav_file
+        self.played = 0
+        self.use(entry)
+        self.newest(wav_file, -1)
+
+    def close_source(self):
+        if self.name is None:
+            return
+        if self.wav is not None:
+            # the bank stays open
+            if self.wav is not self.bank_file:
+                self.wav.close()
+            self.wav = None
+        self.clip = None
+        name = self.name
+        done = self.done
+        self.name = None
+        self.done = None
+        if self.on_complete is not None:
+            self.on_complete(name)
+        if done is not None:
+            done(name)
+
+    def open_i2s(self, entry):
+        # keep the peripheral we have unless the format changed
+        if self.same_format(entry):
+            return
+        # position_ms() runs on the other core: the format goes in while
+        # audio_out is None and audio_out is only published after it
+        audio_out = self.audio_out
+        if audio_out is not None:
+            self.audio_out = None
+            audio_out.deinit()
+        self.i2s_channels = entry[3]
+        self.i2s_rate = entry[4]
+        self.i2s_bits = entry[5]
+        audio_out = I2S(
+            self.id,
+            sck=self.sck_pin,
+            ws=self.ws_pin,
+            sd=self.sd_pin,
+            mode=I2S.TX,
+            bits=self.bits_per_sample,
+            format=self.format,
+            rate=self.sample_rate,
+            ibuf=self.ibuf,
+        )
+        self.audio_out = audio_out
+        audio_out.irq(self.i2s_callback)
+
+    def start(self, wav_file, loop=False, on_done=None):
+        entry = self.lookup(wav_file)
+        self.loop = loop
+        # a clip still flushing is over as far as its owner is concerned
+        self.close_source()
+        self.done = on_done
+        self.open_source(wav_file, entry)
+        self.open_i2s(entry)
+        self.nflush = self.ibuf // self.sbuf + 1
+        self.state = WavPlayer.PLAY
+        _ = self.audio_out.write(self.silence_samples)
+
+    def play(self, wav_file, loop=False, gain=256, on_done=None):
+        # gain (8.8 fixed point) applies when the clip is mixed over another,
+        # on_done is not called for a mixed clip
+        trace(TR_PLAY)
+        entry = self.lookup(wav_file)
         if self.state == WavPlayer.PLAY:
+            if (self.mixer is not None and wav_file in self.cache
+                    and self.same_format(entry) and entry[5] == 16 and entry[3] == 1):
+                self.newest(wav_file, self.mixer.add(self.cache[wav_file][0], gain))
+                self.cache_order.remove(wav_file)
+                self.cache_order.append(wav_file)
+                return
             raise ValueError("already playing a WAV file")
         elif self.state == WavPlayer.PAUSE:
             raise ValueError("paused while playing a WAV file")
         else:
-            self.wav = open(self.root + wav_file, "rb")
-            self.loop = loop
-            self.parse(self.wav)
-
-            self.audio_out = I2S(
-                self.id,
-                sck=self.sck_pin,
-                ws=self.ws_pin,
-                sd=self.sd_pin,
-                mode=I2S.TX,
-                bits=self.bits_per_sample,
-                format=self.format,
-                rate=self.sample_rate,
-                ibuf=self.ibuf,
-            )
+            self.play_start = time.ticks_us()
+            self.waiting_first = True
+            self.start(wav_file, loop, on_done)
 
-            # advance to first byte of Data section in WAV file
-            _ = self.wav.seek(self.first_sample_offset)
-            self.audio_out.irq(self.i2s_callback)
-            self.nflush = self.ibuf // self.sbuf + 1
-            self.state = WavPlayer.PLAY
-            _ = self.audio_out.write(self.silence_samples)
+    def enqueue(self, wav_file, on_done=None):
+        # play wav_file after everything already playing or queued
+        self.lookup(wav_file)
+        if self.state == WavPlayer.STOP:
+            self.play(wav_file, on_done=on_done)
+        else:
+            self.queue.append((wav_file, on_done))
+
+    def clear(self):
+        # drop everything queued, the clip playing now carries on
+        self.queue.clear()
+
+    def close(self):
+        # stop at once and release the I2S peripheral
+        self.queue.clear()
+        if self.mixer is not None:
+            self.mixer.stop()
+        self.close_source()
+        self.state = WavPlayer.STOP
+        if self.audio_out is not None:
+            self.audio_out.deinit()
+            self.audio_out = None
 
     def resume(self):
         if self.state != WavPlayer.PAUSE:
@@ -181,7 +614,51 @@ class WavPlayer:
         self.state = WavPlayer.PAUSE
 
     def stop(self):
-        self.state = WavPlayer.FLUSH
+        self.queue.clear()
+        if self.mixer is not None:
+            self.mixer.stop()
+        if self.state != WavPlayer.STOP:
+            self.state = WavPlayer.FLUSH
+
+    def newest(self, wav_file, voice):
+        # wav_file starts now, on voice or as the clip playing
+        self.latest = wav_file
+        self.latest_voice = voice
+        if voice >= 0:
+            self.latest_count = self.mixer.count
+        self.heard = -self.ibuf
+        self.mark_ms = time.ticks_ms()
+
+    def latest_written(self):
+        # bytes of the newest sound handed to the I2S peripheral so far,
+        # -1 once it has finished
+        if self.latest_voice >= 0:
+            mixer = self.mixer
+            voice = self.latest_voice
+            if (mixer.src[voice] is None
+                    or mixer.started[voice] != self.latest_count):
+                return -1
+            # mixed voices are 16-bit mono
+            return 2 * mixer.pos[voice]
+        if self.name is None or self.name != self.latest:
+            return -1
+        return self.played
+
+    def position_ms(self):
+        # ms into the newest sound as heard, -1 once it has finished or
+        # before the I2S is open (the format is not known until then)
+        rate = self.i2s_rate
+        if self.audio_out is None or rate is None:
+            return -1
+        written = self.latest_written()
+        if written < 0:
+            return -1
+        per_ms = rate * self.i2s_channels * self.i2s_bits // 8000
+        ms = self.heard // per_ms + time.ticks_diff(time.ticks_ms(), self.mark_ms)
+        if ms <= 0:
+            return 0
+        # never ahead of what has been written
+        return min(ms, written // per_ms)
 
     def isplaying(self):
         if self.state != WavPlayer.STOP: